@@ -1,3 +1,7 @@
 from django.contrib import admin
+from . import models
 
-# Register your models here.
+
+admin.site.register(models.OutgoingEmail)
+admin.site.register(models.ChunkedUpload)
+admin.site.register(models.AuthEvent)
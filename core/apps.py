@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .metrics import instrument_serializers, perf_settings, process_stats, registry
+
+        if perf_settings()['ENABLED']:
+            instrument_serializers()
+            registry.collect(process_stats)
@@ -0,0 +1,197 @@
+import atexit
+import ipaddress
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils.dateparse import parse_datetime
+from rest_framework.throttling import BaseThrottle
+
+from .models import AuthEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+AUTH_AUDIT_DEFAULTS = {
+    # events waiting in the process for the writer thread; when it is full
+    # they are appended to FALLBACK_FILE right away
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    # seconds a partial batch waits for more events
+    'FLUSH_INTERVAL': 1.0,
+    # a batch insert failing or taking longer than SLOW_SECONDS sends the
+    # batches of the next RETRY_AFTER seconds to FALLBACK_FILE, which
+    # `python manage.py replay_auth_events` loads back
+    'SLOW_SECONDS': 2.0,
+    'RETRY_AFTER': 30,
+    'FALLBACK_FILE': os.path.join(tempfile.gettempdir(), 'auth_events.jsonl'),
+    # False inserts every event in the request
+    'ASYNC': True,
+}
+
+FIELDS = ('event', 'user_id', 'ip', 'user_agent', 'identifier', 'data')
+
+_stop = object()
+
+
+def auth_audit_settings():
+    options = dict(AUTH_AUDIT_DEFAULTS)
+    options.update(getattr(settings, 'AUTH_AUDIT', {}))
+    return options
+
+
+def client_ip(request):
+    # with NUM_PROXIES unset DRF returns all of X-Forwarded-For, the client's first
+    ident = (BaseThrottle().get_ident(request) or '').split(',')[0]
+    try:
+        return str(ipaddress.ip_address(ident))
+    except ValueError:
+        return None
+
+
+def to_line(event):
+    line = {name: getattr(event, name) for name in FIELDS}
+    line['created'] = event.created.isoformat()
+    return json.dumps(line) + '\n'
+
+
+def from_line(line):
+    fields = json.loads(line)
+    created = parse_datetime(fields.pop('created'))
+    if created is None:
+        raise ValueError("no event time")
+    return AuthEvent(created=created, **{name: fields[name] for name in FIELDS})
+
+
+class AuditLog:
+    """
+    Hands auth events to a thread inserting them with one `bulk_create` per
+    batch, so requests never wait for the insert. Events are appended to
+    FALLBACK_FILE as JSON lines when the queue is full, or while inserts
+    fail or are slow.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        # monotonic time until which batches skip the database
+        self.degraded_until = 0.0
+
+    def record(self, event, user_id=None, request=None, identifier=None, **data):
+        entry = AuthEvent(event=event, user_id=user_id, identifier=(identifier or '')[:255], data=json.dumps(data))
+        if request is not None:
+            entry.ip = client_ip(request)
+            entry.user_agent = request.META.get('HTTP_USER_AGENT', '')[:255]
+        options = auth_audit_settings()
+        if not options['ASYNC']:
+            self.write([entry])
+            return entry
+        try:
+            self.start(options).put_nowait(entry)
+        except queue.Full:
+            self.write_file([entry])
+        return entry
+
+    def start(self, options):
+        with self.lock:
+            if self.thread is None:
+                self.queue = queue.Queue(options['QUEUE_SIZE'])
+                self.thread = threading.Thread(target=self.run, args=(self.queue,), name='auth-audit', daemon=True)
+                self.thread.start()
+            return self.queue
+
+    def stop(self, timeout=10):
+        """
+        Write the queued events and end the thread.
+        """
+        with self.lock:
+            thread, events = self.thread, self.queue
+            self.thread = self.queue = None
+        if thread is None:
+            return
+        try:
+            events.put(_stop, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def run(self, events):
+        stopping = False
+        while not stopping:
+            entry = events.get()
+            if entry is _stop:
+                return
+            batch = [entry]
+            options = auth_audit_settings()
+            deadline = time.monotonic() + options['FLUSH_INTERVAL']
+            while len(batch) < options['BATCH_SIZE']:
+                try:
+                    entry = events.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entry is _stop:
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                self.write(batch)
+            except Exception:
+                # the thread has to outlive a bad batch
+                logger.exception("writing %d auth events failed", len(batch))
+                self.write_file(batch)
+            finally:
+                connection.close()
+
+    def write(self, batch):
+        if time.monotonic() < self.degraded_until:
+            self.write_file(batch)
+            return
+        options = auth_audit_settings()
+        started = time.monotonic()
+        try:
+            AuthEvent.objects.bulk_create(batch)
+        except DatabaseError:
+            logger.exception("inserting %d auth events failed, appending them to %s",
+                             len(batch), options['FALLBACK_FILE'])
+            self.degraded_until = time.monotonic() + options['RETRY_AFTER']
+            self.write_file(batch)
+            return
+        elapsed = time.monotonic() - started
+        if elapsed > options['SLOW_SECONDS']:
+            logger.warning("inserting %d auth events took %.1fs, appending to %s for %ss",
+                           len(batch), elapsed, options['FALLBACK_FILE'], options['RETRY_AFTER'])
+            self.degraded_until = time.monotonic() + options['RETRY_AFTER']
+
+    def write_file(self, batch):
+        path = auth_audit_settings()['FALLBACK_FILE']
+        data = ''.join(to_line(entry) for entry in batch).encode()
+        try:
+            # a single write in append mode, so the lines of concurrent
+            # processes do not interleave
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError:
+            logger.exception("appending %d auth events to %s failed, they are lost", len(batch), path)
+
+
+audit_log = AuditLog()
+
+atexit.register(audit_log.stop)
+if hasattr(os, 'register_at_fork'):
+    # the thread does not survive a fork, the events queued in the parent
+    # are the parent's to write
+    os.register_at_fork(after_in_child=audit_log.reset)
@@ -0,0 +1,197 @@
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings
+
+from .revocation import revocation_store
+from .routers import pin_user
+
+
+jwt_get_username_from_payload = api_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER
+
+
+PRINCIPAL_CACHE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 1024,
+    'TIMEOUT': 300,
+    'KEY_PREFIX': 'auth:principal',
+}
+
+
+def principal_cache_settings():
+    options = dict(PRINCIPAL_CACHE_DEFAULTS)
+    options.update(getattr(settings, 'PRINCIPAL_CACHE', {}))
+    return options
+
+
+class PrincipalCache:
+    """
+    Two level cache of authenticated users (with their profile).
+
+    The local level is a bounded LRU holding pickled users, the shared level
+    is the configured django cache. Users are stored under their current
+    version, read before the row is loaded; invalidation starts a new
+    version, so a user loaded before a write (e.g. a ban) is stored under
+    the old one and never served, and every process drops its local copy on
+    the next lookup.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+
+    @property
+    def options(self):
+        return principal_cache_settings()
+
+    @property
+    def cache(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    def version_key(self, user_id):
+        return f"{self.options['KEY_PREFIX']}:{user_id}:version"
+
+    def principal_key(self, user_id, version):
+        return f"{self.options['KEY_PREFIX']}:{user_id}:{version}"
+
+    def version(self, user_id):
+        """
+        Current version of the user, started if there is none. Read it before
+        loading the user to `set()`.
+        """
+        key = self.version_key(user_id)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, self.options['TIMEOUT'])
+            # another process may have added its own first
+            version = self.cache.get(key)
+        return version
+
+    def get(self, user_id, version):
+        if version is None:
+            # the shared cache is unavailable, nothing could be invalidated
+            return self._miss(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                self.local_hits += 1
+                return pickle.loads(entry[1])
+
+        data = self.cache.get(self.principal_key(user_id, version))
+        if data is None:
+            return self._miss(user_id)
+
+        self._remember(user_id, version, data)
+        with self._lock:
+            self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, user, version):
+        if version is None:
+            return
+        data = pickle.dumps(user, pickle.HIGHEST_PROTOCOL)
+        self.cache.set(self.principal_key(user.pk, version), data, self.options['TIMEOUT'])
+        self._remember(user.pk, version, data)
+
+    def invalidate(self, user_id):
+        self.cache.set(self.version_key(user_id), uuid.uuid4().hex, self.options['TIMEOUT'])
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.local_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'local_hits': self.local_hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.options['MAX_ENTRIES'],
+            }
+
+    def _miss(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.misses += 1
+        return None
+
+    def _remember(self, user_id, version, data):
+        with self._lock:
+            self._entries[user_id] = (version, data)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.options['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+
+
+principal_cache = PrincipalCache()
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JWT authentication that resolves the token's user through `principal_cache`
+    instead of loading it from the database on every request, and refuses
+    tokens revoked in `revocation_store`. A view with a `before_principal(user_id)`
+    method gets it called before the user is read.
+    """
+
+    def authenticate(self, request):
+        self.request = request
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, payload):
+        # tokens without an id cannot be revoked, refresh tokens are not for requests
+        jti = payload.get('jti')
+        if jti is None or payload.get('type') == 'refresh' or revocation_store.is_revoked(jti):
+            msg = _('Token has been revoked.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        user_id = payload.get('user_id')
+        username = jwt_get_username_from_payload(payload)
+        if user_id is None or not username:
+            return super().authenticate_credentials(payload)
+
+        # before any read, the user may just have written
+        pin_user(user_id)
+        view = self.request.parser_context.get('view')
+        if hasattr(view, 'before_principal'):
+            view.before_principal(user_id)
+        version = principal_cache.version(user_id)
+        user = principal_cache.get(user_id, version)
+        if user is None:
+            user = self.load_user(user_id)
+            if user is not None:
+                principal_cache.set(user, version)
+
+        if user is None or user.get_username() != username:
+            msg = _('Invalid signature.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        if not user.is_active:
+            msg = _('User account is disabled.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        return user
+
+    def load_user(self, user_id):
+        User = get_user_model()
+        try:
+            return User.objects.select_related('profile').get(pk=user_id)
+        except (User.DoesNotExist, ValueError):
+            return None
@@ -0,0 +1,137 @@
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .runner import TestRunner
+
+
+logger = logging.getLogger(__name__)
+
+# metric -> True when a higher value is better
+METRICS = {
+    'throughput': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'queries_per_request': False,
+}
+
+
+@contextmanager
+def test_database():
+    """
+    Run the block in the test environment of `core.runner.TestRunner`,
+    against throwaway test databases created for it.
+    """
+    runner = TestRunner(verbosity=0)
+    runner.setup_test_environment()
+    try:
+        old_config = runner.setup_databases()
+        try:
+            yield
+        finally:
+            connection.close()
+            runner.teardown_databases(old_config)
+    finally:
+        runner.teardown_test_environment()
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted `values`.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class QueryCounter:
+    """
+    `connection.execute_wrapper()` callable counting the statements run.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run(call, requests, concurrency=1):
+    """
+    Run `call(index)` for every index in `range(requests)` from
+    `concurrency` threads. A call fails by returning False or raising.
+    Returns throughput, latency percentiles and queries per request.
+    """
+    lock = threading.Lock()
+    indexes = iter(range(requests))
+    samples = []
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    index = next(indexes, None)
+                if index is None:
+                    return
+                counter = QueryCounter()
+                start = time.perf_counter()
+                try:
+                    with connection.execute_wrapper(counter):
+                        ok = call(index) is not False
+                except Exception:
+                    logger.exception("benchmark call %s failed", index)
+                    ok = False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples.append((elapsed, counter.count, ok))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed for elapsed, count, ok in samples if ok)
+    succeeded = len(latencies)
+    queries = sum(count for elapsed, count, ok in samples if ok)
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - succeeded,
+        'concurrency': concurrency,
+        'seconds': round(wall, 4),
+        'throughput': round(succeeded / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'mean_ms': round(sum(latencies) / succeeded * 1000, 3) if latencies else None,
+        'queries_per_request': round(queries / succeeded, 2) if succeeded else None,
+    }
+
+
+def compare(baseline, current, threshold=10.0):
+    """
+    Rows `(scenario, metric, old, new, change %, regressed)` for the
+    scenarios of two result sets; `regressed` when a metric got worse by
+    more than `threshold` percent.
+    """
+    rows = []
+    for scenario, result in current['results'].items():
+        old_result = baseline.get('results', {}).get(scenario)
+        if old_result is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = old_result.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            worse = -change if higher_is_better else change
+            rows.append((scenario, metric, old, new, round(change, 1), worse > threshold))
+    return rows
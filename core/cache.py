@@ -0,0 +1,229 @@
+import math
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+TIERED_CACHE_DEFAULTS = {
+    # alias of the shared cache (L2) behind the local one
+    'SHARED': 'default',
+    # entries kept in the process (L1), least recently used dropped first
+    'LOCAL_MAX_ENTRIES': 1024,
+    # seconds a value read from L2 is served from L1: how stale a key
+    # written by another process can be here
+    'LOCAL_TIMEOUT': 5,
+    # get_or_set(): how eagerly values are recomputed before they expire,
+    # 0 disables it, higher starts earlier
+    'EARLY_RECOMPUTE': 1.0,
+    # get_or_set(): seconds a process may recompute a missing value while
+    # the others wait for it
+    'LOCK_TIMEOUT': 10,
+    'LOCK_POLL': 0.05,
+}
+
+# values returned as they are, everything else is copied out of L1
+IMMUTABLE = (bytes, str, int, float, bool, type(None))
+
+# what get_or_set() stores: the value, when it expires (None if never) and
+# how long computing it took
+Recomputed = namedtuple('Recomputed', 'value expires cost')
+
+_missing = object()
+
+
+class TieredCache(BaseCache):
+    """
+    Keeps the values read from and written to the SHARED cache in a bounded
+    in-process LRU for LOCAL_TIMEOUT seconds. Fits keys whose value never
+    changes under them (e.g. versioned keys) or that tolerate LOCAL_TIMEOUT
+    of staleness; writes from this process are seen at once. `add`, `incr`
+    and `decr` go straight to the shared cache.
+
+    `get_or_set()` recomputes a value once across processes: the process
+    taking the lock in the shared cache computes it while the others keep
+    serving the old value or wait for the new one, and values are
+    recomputed a little before they expire (probabilistic early expiration),
+    so a hot key never expires for everybody at once.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.options = dict(TIERED_CACHE_DEFAULTS, **params.get('OPTIONS', {}))
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.options['SHARED']]
+
+    def local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self.options['LOCAL_TIMEOUT']
+        return min(timeout, self.options['LOCAL_TIMEOUT'])
+
+    def _remember(self, key, value, timeout=DEFAULT_TIMEOUT):
+        timeout = self.local_timeout(timeout)
+        if timeout <= 0:
+            return
+        if not isinstance(value, IMMUTABLE):
+            value = _Pickled(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._local[key] = (time.monotonic() + timeout, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.options['LOCAL_MAX_ENTRIES']:
+                self._local.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return _missing
+            if entry[0] <= time.monotonic():
+                del self._local[key]
+                return _missing
+            self._local.move_to_end(key)
+        value = entry[1]
+        return pickle.loads(value.data) if isinstance(value, _Pickled) else value
+
+    def _forget(self, keys):
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+
+    def _get_entry(self, key, version=None):
+        local_key = self.make_key(key, version)
+        value = self._recall(local_key)
+        if value is _missing:
+            value = self.shared.get(key, _missing, version=version)
+            if value is not _missing:
+                self._remember(local_key, value)
+        return value
+
+    def get(self, key, default=None, version=None):
+        value = self._get_entry(key, version)
+        if value is _missing:
+            return default
+        return value.value if isinstance(value, Recomputed) else value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        remote = []
+        for key in keys:
+            value = self._recall(self.make_key(key, version))
+            if value is _missing:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote:
+            # one round trip for everything L1 did not have
+            for key, value in self.shared.get_many(remote, version=version).items():
+                self._remember(self.make_key(key, version), value)
+                found[key] = value
+        return {key: value.value if isinstance(value, Recomputed) else value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._remember(self.make_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version) or []
+        for key, value in data.items():
+            if key not in failed:
+                self._remember(self.make_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._remember(self.make_key(key, version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._forget([self.make_key(key, version)])
+        return self.shared.incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._forget([self.make_key(key, version)])
+        return self.shared.decr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self._forget([self.make_key(key, version)])
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self._forget([self.make_key(key, version) for key in keys])
+        self.shared.delete_many(keys, version=version)
+
+    def has_key(self, key, version=None):
+        return self._get_entry(key, version) is not _missing
+
+    def clear(self):
+        self.clear_local()
+        self.shared.clear()
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        entry = self._get_entry(key, version)
+        if entry is not _missing and not isinstance(entry, Recomputed):
+            return entry
+        if isinstance(entry, Recomputed) and not self.expires_early(entry):
+            return entry.value
+
+        lock_key = f'{key}:recompute'
+        if not self.shared.add(lock_key, 1, self.options['LOCK_TIMEOUT'], version=version):
+            if entry is not _missing:
+                # somebody else is recomputing it
+                return entry.value
+            entry = self.wait_for(key, version)
+            if entry is not _missing:
+                return entry.value if isinstance(entry, Recomputed) else entry
+        try:
+            start = time.monotonic()
+            value = default() if callable(default) else default
+            cost = time.monotonic() - start
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = self.shared.default_timeout
+            expires = None if timeout is None else time.time() + timeout
+            self.set(key, Recomputed(value, expires, cost), timeout, version=version)
+        finally:
+            self.shared.delete(lock_key, version=version)
+        return value
+
+    def expires_early(self, entry):
+        # the XFetch rule: the longer recomputing takes, the earlier it starts
+        if entry.expires is None:
+            return False
+        early = -entry.cost * self.options['EARLY_RECOMPUTE'] * math.log(1.0 - random.random())
+        return time.time() + early >= entry.expires
+
+    def wait_for(self, key, version):
+        deadline = time.monotonic() + self.options['LOCK_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(self.options['LOCK_POLL'])
+            value = self.shared.get(key, _missing, version=version)
+            if value is not _missing:
+                self._remember(self.make_key(key, version), value)
+                return value
+        # the lock holder died, compute it here
+        return _missing
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+
+class _Pickled:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
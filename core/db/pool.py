@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+from django.db.utils import OperationalError
+
+
+POOL_DEFAULTS = {
+    # connections a process keeps open to the database, idle or in use
+    'MAX_SIZE': 10,
+    # seconds a request waits for a free connection before failing
+    'TIMEOUT': 10,
+    # a connection idle for longer is checked with a query before reuse
+    'CHECK_AFTER': 30,
+    # and closed when idle for longer than MAX_IDLE or older than MAX_AGE
+    'MAX_IDLE': 300,
+    'MAX_AGE': 3600,
+}
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    DB-API connections shared by the threads of a process. The most recently
+    released idle connection is handed out first, the others age out. A
+    connection still in use by a thread that ended is closed when the pool
+    needs its slot.
+    """
+
+    def __init__(self, alias, **options):
+        self.alias = alias
+        self.options = dict(POOL_DEFAULTS, **options)
+        self.condition = threading.Condition()
+        # (connection, released at), most recent last
+        self.idle = deque()
+        # opening time of every connection of the pool, idle or in use
+        self.opened = {}
+        # (weak reference to the thread, connection) of every connection in use
+        self.owners = {}
+        self.connecting = 0
+
+    def acquire(self, connect):
+        """
+        An idle connection, or a new one from `connect()` if the pool is not
+        full. Waits for a release otherwise, PoolTimeout after TIMEOUT.
+        """
+        deadline = time.monotonic() + self.options['TIMEOUT']
+        while True:
+            abandoned = ()
+            with self.condition:
+                if self.idle:
+                    connection, released = self.idle.pop()
+                elif len(self.opened) + self.connecting < self.options['MAX_SIZE']:
+                    self.connecting += 1
+                    connection = None
+                else:
+                    abandoned = self.abandoned()
+                    if not abandoned:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                f"No free connection to '{self.alias}' after {self.options['TIMEOUT']}s "
+                                f"({self.options['MAX_SIZE']} in use).")
+                        # a thread ending does not notify, look for abandoned
+                        # connections again every second
+                        self.condition.wait(min(remaining, 1))
+                        continue
+
+            if abandoned:
+                for connection in abandoned:
+                    self.discard(connection)
+                continue
+            if connection is None:
+                return self.open(connect)
+            if self.usable(connection, released):
+                self.take(connection)
+                return connection
+            self.discard(connection)
+
+    def release(self, connection, broken=False):
+        with self.condition:
+            opened = self.opened.get(id(connection))
+            self.owners.pop(id(connection), None)
+        if opened is None:
+            # opened by the parent process before a fork
+            _inherited.append(connection)
+            return
+        if not broken and time.monotonic() - opened < self.options['MAX_AGE']:
+            try:
+                # a connection closed inside a transaction must not carry it over
+                connection.rollback()
+            except Exception:
+                pass
+            else:
+                with self.condition:
+                    self.idle.append((connection, time.monotonic()))
+                    self.condition.notify()
+                return
+        self.discard(connection)
+
+    def open(self, connect):
+        try:
+            connection = connect()
+        except BaseException:
+            with self.condition:
+                self.connecting -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.connecting -= 1
+            self.opened[id(connection)] = time.monotonic()
+        self.take(connection)
+        return connection
+
+    def take(self, connection):
+        with self.condition:
+            self.owners[id(connection)] = (weakref.ref(threading.current_thread()), connection)
+
+    def abandoned(self):
+        """
+        Takes the connections of threads that ended without closing them out
+        of `owners`, for the caller to discard. Call with the condition held.
+        """
+        abandoned = []
+        for key, (owner, connection) in list(self.owners.items()):
+            thread = owner()
+            if thread is None or not thread.is_alive():
+                del self.owners[key]
+                abandoned.append(connection)
+        return abandoned
+
+    def usable(self, connection, released):
+        now = time.monotonic()
+        if now - released > self.options['MAX_IDLE'] or now - self.opened[id(connection)] > self.options['MAX_AGE']:
+            return False
+        if now - released <= self.options['CHECK_AFTER']:
+            return True
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def discard(self, connection):
+        with self.condition:
+            self.opened.pop(id(connection), None)
+            self.owners.pop(id(connection), None)
+            self.condition.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.condition:
+            idle, self.idle = self.idle, deque()
+        for connection, released in idle:
+            self.discard(connection)
+
+    def stats(self):
+        with self.condition:
+            return {'size': len(self.opened), 'idle': len(self.idle), 'max_size': self.options['MAX_SIZE']}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# connections opened before a fork belong to the parent; closing them from the
+# child would end the parent's sessions, so they are only kept referenced
+_inherited = []
+
+
+def get_pool(alias, options=None):
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = ConnectionPool(alias, **(options or {}))
+    return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+def close_pool(alias):
+    with _pools_lock:
+        pool = _pools.pop(alias, None)
+    if pool is not None:
+        pool.close()
+
+
+def _forget_pools():
+    _inherited.extend(_pools.values())
+    _pools.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools)
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Takes the connections of a DatabaseWrapper from, and gives them back to,
+    the process wide pool of its alias, configured by the POOL dict of its
+    DATABASES entry. Keep CONN_MAX_AGE at 0: connections go back to the pool
+    at the end of every request.
+    """
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL'))
+
+    @property
+    def pooled(self):
+        # an in-memory SQLite database lives as long as its connection, which
+        # Django never closes, so it would keep its slot forever
+        is_in_memory_db = getattr(self, 'is_in_memory_db', None)
+        return not (is_in_memory_db and is_in_memory_db())
+
+    def get_new_connection(self, conn_params):
+        if not self.pooled:
+            return super().get_new_connection(conn_params)
+        return self.pool.acquire(lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params))
+
+    def _close(self):
+        if not self.pooled:
+            super()._close()
+        elif self.connection is not None:
+            # close_if_unusable_or_obsolete() closes the connection when an
+            # error left it unusable
+            self.pool.release(self.connection, broken=self.errors_occurred)
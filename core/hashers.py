@@ -0,0 +1,113 @@
+import base64
+import contextvars
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.encoding import force_bytes
+
+from .metrics import timed
+
+
+PASSWORD_HASH_ADMISSION_DEFAULTS = {
+    # hashes computed at the same time; pbkdf2 releases the GIL, so they run
+    # on separate cores
+    'CONCURRENT': os.cpu_count() or 1,
+    # hashes allowed to wait for a running one to finish before new ones are
+    # refused
+    'QUEUE_SIZE': 32,
+    # seconds a hash waits for its turn before it is refused
+    'TIMEOUT': 10,
+}
+
+admission_enabled = contextvars.ContextVar('admission_enabled', default=False)
+
+
+def hash_admission_settings():
+    options = dict(PASSWORD_HASH_ADMISSION_DEFAULTS)
+    options.update(getattr(settings, 'PASSWORD_HASH_ADMISSION', {}))
+    return options
+
+
+class AdmissionRefused(Exception):
+    pass
+
+
+class HashAdmission:
+    """
+    Admission limit for password hashing, which runs inline in the request
+    thread: at most CONCURRENT hashes run at once and QUEUE_SIZE wait for
+    them, anything beyond that, or waiting longer than TIMEOUT, fails fast
+    with `AdmissionRefused` instead of queueing behind the others. Nothing is
+    offloaded: the request thread is busy for the whole hash either way; this
+    bounds CPU contention and latency, it does not free WSGI threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = None
+        self._pid = None
+        self.submitted = 0
+        self.rejected = 0
+
+    def slots(self):
+        with self._lock:
+            # a forked worker must not share the parent's counts
+            if self._slots is None or self._pid != os.getpid():
+                options = hash_admission_settings()
+                concurrent = options['CONCURRENT']
+                self._slots = (threading.BoundedSemaphore(concurrent + options['QUEUE_SIZE']),
+                               threading.BoundedSemaphore(concurrent))
+                self._pid = os.getpid()
+            return self._slots
+
+    def run(self, func, *args):
+        admitted, running = self.slots()
+        if not admitted.acquire(blocking=False):
+            return self._reject()
+        try:
+            if not running.acquire(timeout=hash_admission_settings()['TIMEOUT']):
+                return self._reject()
+            try:
+                with self._lock:
+                    self.submitted += 1
+                return func(*args)
+            finally:
+                running.release()
+        finally:
+            admitted.release()
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise AdmissionRefused()
+
+    def stats(self):
+        with self._lock:
+            return {'submitted': self.submitted, 'rejected': self.rejected}
+
+
+hash_admission = HashAdmission()
+
+
+class AdmittedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher that runs the key derivation under the admission limit of
+    `hash_admission` while `admission_enabled` is set (see
+    `core.views.HashAdmissionMixin`), and unlimited otherwise. Produces the
+    same `pbkdf2_sha256` hashes as django's hasher.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        with timed('hash'):
+            if not admission_enabled.get():
+                return super().encode(password, salt, iterations)
+            assert password is not None
+            assert salt and '$' not in salt
+            iterations = iterations or self.iterations
+            hash = hash_admission.run(hashlib.pbkdf2_hmac, self.digest().name,
+                                      force_bytes(password), force_bytes(salt), iterations)
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return "%s$%d$%s$%s" % (self.algorithm, iterations, salt, hash)
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils.translation import ugettext_lazy as _
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image, ImageOps, features
+from rest_framework import serializers
+
+from .signals import after_image_processed
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PIPELINE_DEFAULTS = {
+    'MAX_UPLOAD_BYTES': 5 * 1024 * 1024,
+    'MAX_PIXELS': 40 * 1000 * 1000,
+    'THUMBNAIL_SIZES': (128, 512),
+    # WEBP when Pillow was built with it, JPEG otherwise
+    'THUMBNAIL_FORMAT': 'WEBP',
+    'QUALITY': 85,
+    # process in a background thread after commit, False runs inline
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+
+def image_pipeline_settings():
+    options = dict(IMAGE_PIPELINE_DEFAULTS)
+    options.update(getattr(settings, 'IMAGE_PIPELINE', {}))
+    return options
+
+
+class LimitedBase64ImageField(Base64ImageField):
+    """
+    Base64 image field that refuses oversized payloads before decoding them
+    and images with too many pixels before Pillow loads them.
+    """
+
+    def to_internal_value(self, base64_data):
+        options = image_pipeline_settings()
+        if isinstance(base64_data, str):
+            payload = base64_data.split(';base64,')[-1]
+            if len(payload) * 3 // 4 > options['MAX_UPLOAD_BYTES']:
+                raise ValidationError(_("Image is larger than %(size)s MB.") % {
+                    'size': options['MAX_UPLOAD_BYTES'] // (1024 * 1024)})
+        file = super().to_internal_value(base64_data)
+        image = getattr(file, 'image', None)
+        if image is not None and image.size[0] * image.size[1] > options['MAX_PIXELS']:
+            raise ValidationError(_("Image dimensions are too large."))
+        return file
+
+
+class ThumbnailsField(serializers.Field):
+    """
+    Read only `{size: url}` of the thumbnails stored as JSON on the model.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        thumbnails = json.loads(value or '{}')
+        request = self.context.get('request')
+        urls = {}
+        for size, name in thumbnails.items():
+            url = default_storage.url(name)
+            urls[size] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+
+def encode_original(image, quality):
+    """
+    Re-encode without metadata (EXIF, GPS...) after applying its orientation.
+    """
+    image = ImageOps.exif_transpose(image)
+    output = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(output, 'PNG', optimize=True)
+        return output.getvalue(), 'png'
+    image.convert('RGB').save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue(), 'jpg'
+
+
+def encode_thumbnail(image, size, fmt, quality):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    output = io.BytesIO()
+    if fmt == 'WEBP' and features.check('webp'):
+        thumbnail.save(output, 'WEBP', quality=quality)
+        return output.getvalue(), 'webp'
+    thumbnail.convert('RGB').save(output, 'JPEG', quality=quality, optimize=True)
+    return output.getvalue(), 'jpg'
+
+
+def process_image(model_label, pk, field_name, thumbnails_field):
+    """
+    Replace the stored upload with a stripped, content-hashed copy and store
+    its thumbnails next to it. The row is only updated if it still points at
+    the file that was processed.
+    """
+    options = image_pipeline_settings()
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return None
+    field = getattr(instance, field_name)
+    if not field or getattr(instance, thumbnails_field) is not None:
+        # nothing uploaded, or already processed by an earlier task
+        return None
+    old_name = field.name
+    storage = field.storage
+
+    with storage.open(old_name, 'rb') as upload:
+        image = Image.open(upload)
+        if image.size[0] * image.size[1] > options['MAX_PIXELS']:
+            raise ValueError(f"{old_name} has too many pixels")
+        image.load()
+
+    content, extension = encode_original(image, options['QUALITY'])
+    digest = hashlib.sha256(content).hexdigest()[:20]
+    field.save(f"{digest}.{extension}", ContentFile(content), save=False)
+    new_name = field.name
+    base = os.path.splitext(new_name)[0]
+
+    thumbnails = {}
+    for size in options['THUMBNAIL_SIZES']:
+        content, extension = encode_thumbnail(image, size, options['THUMBNAIL_FORMAT'], options['QUALITY'])
+        thumbnails[str(size)] = storage.save(f"{base}_{size}.{extension}", ContentFile(content))
+
+    updated = model.objects.filter(pk=pk, **{field_name: old_name}).update(
+        **{field_name: new_name, thumbnails_field: json.dumps(thumbnails)})
+    if not updated:
+        # replaced by a newer upload meanwhile, which has its own task
+        for name in [new_name, *thumbnails.values()]:
+            storage.delete(name)
+        return None
+    storage.delete(old_name)
+    after_image_processed.send(sender=model, instance=instance)
+    return new_name, thumbnails
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=image_pipeline_settings()['WORKERS'], thread_name_prefix='images')
+        return _executor
+
+
+def shutdown(wait=True):
+    """
+    Stop the background pool, waiting for scheduled images when `wait`.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def run_process_image(*args):
+    try:
+        process_image(*args)
+    except Exception:
+        logger.exception("image processing failed for %s", args)
+    finally:
+        connection.close()
+
+
+def schedule_image(instance, field_name, thumbnails_field):
+    """
+    Process `instance.<field_name>` once the current transaction commits.
+    """
+    args = (instance._meta.label, instance.pk, field_name, thumbnails_field)
+    if image_pipeline_settings()['ASYNC']:
+        transaction.on_commit(lambda: executor().submit(run_process_image, *args))
+    else:
+        transaction.on_commit(lambda: process_image(*args))
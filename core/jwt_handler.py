@@ -1,7 +1,135 @@
+import datetime
+import time
+import uuid
+
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt import utils
 from rest_framework_jwt.settings import api_settings
 
-jwt_payload_handler = api_settings.JWT_PAYLOAD_HANDLER
-jwt_encode_handler = api_settings.JWT_ENCODE_HANDLER
+from .revocation import revocation_store
+
+
+REFRESH_TOKEN_DEFAULTS = {
+    'LIFETIME': datetime.timedelta(days=14),
+}
+
+
+def refresh_token_settings():
+    options = dict(REFRESH_TOKEN_DEFAULTS)
+    options.update(getattr(settings, 'REFRESH_TOKEN', {}))
+    return options
+
+
+def jwt_payload_handler(user):
+    """
+    Access token payload of rest_framework_jwt with a `jti`, so that the
+    token can be revoked before it expires.
+    """
+    payload = utils.jwt_payload_handler(user)
+    payload['jti'] = uuid.uuid4().hex
+    return payload
+
+
+def refresh_token_encode(user, family=None):
+    """
+    Single use refresh token. Rotated tokens keep the `family` of the login
+    they descend from, so a replayed one can revoke all of them.
+    """
+    payload = {
+        'type': 'refresh',
+        'user_id': user.pk,
+        'username': user.get_username(),
+        'jti': uuid.uuid4().hex,
+        'family': family or uuid.uuid4().hex,
+        # sub-second, so that tokens issued right after `revoke_user_refresh_tokens` stay valid
+        'iat': time.time(),
+        'exp': datetime.datetime.utcnow() + refresh_token_settings()['LIFETIME'],
+    }
+    if api_settings.JWT_AUDIENCE is not None:
+        payload['aud'] = api_settings.JWT_AUDIENCE
+    if api_settings.JWT_ISSUER is not None:
+        payload['iss'] = api_settings.JWT_ISSUER
+    return api_settings.JWT_ENCODE_HANDLER(payload)
+
+
+def issue_tokens(user, family=None):
+    return {
+        'token': api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user)),
+        'refresh': refresh_token_encode(user, family),
+    }
+
+
+def decode_refresh_token(token):
+    try:
+        payload = api_settings.JWT_DECODE_HANDLER(token)
+    except jwt.ExpiredSignature:
+        raise exceptions.AuthenticationFailed(_('Signature has expired.'))
+    except jwt.InvalidTokenError:
+        raise exceptions.AuthenticationFailed(_('Error decoding signature.'))
+    if payload.get('type') != 'refresh':
+        raise exceptions.AuthenticationFailed(_('Not a refresh token.'))
+    return payload
+
+
+def revoke_family(family):
+    expires_at = time.time() + refresh_token_settings()['LIFETIME'].total_seconds()
+    revocation_store.revoke(family, expires_at, fast_path=False)
+
+
+def refresh_floor_key(user_id):
+    return revocation_store.key('refresh-floor', user_id)
+
+
+def revoke_user_refresh_tokens(user_id):
+    """
+    Revoke every refresh token family of the user, e.g. once the password
+    changed: the refresh tokens issued until now are refused.
+    """
+    timeout = int(refresh_token_settings()['LIFETIME'].total_seconds()) + 1
+    revocation_store.cache.set(refresh_floor_key(user_id), time.time(), timeout)
+
+
+def rotate_refresh_token(token):
+    """
+    Exchange a refresh token for a new access and refresh token pair.
+    A refresh token presented twice has leaked, so its whole family is
+    revoked and the caller has to log in again.
+    """
+    payload = decode_refresh_token(token)
+    floor = revocation_store.cache.get(refresh_floor_key(payload['user_id']))
+    if floor is not None and payload.get('iat', 0) <= floor:
+        raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+    if revocation_store.is_denied(payload['family']):
+        raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+    if not revocation_store.consume(payload['jti'], payload['exp']):
+        revoke_family(payload['family'])
+        raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+
+    User = get_user_model()
+    user = User.objects.filter(pk=payload['user_id'], is_active=True).first()
+    if user is None or user.get_username() != payload['username']:
+        raise exceptions.AuthenticationFailed(_('Invalid signature.'))
+    return user, issue_tokens(user, payload['family'])
+
 
-payload = jwt_payload_handler(user)
-token = jwt_encode_handler(payload)
\ No newline at end of file
+def revoke_tokens(access_token=None, refresh_token=None):
+    """
+    Revoke an access token and the family of a refresh token, on logout.
+    Invalid or expired tokens are ignored.
+    """
+    if access_token:
+        try:
+            payload = api_settings.JWT_DECODE_HANDLER(access_token)
+        except jwt.InvalidTokenError:
+            payload = {}
+        if payload.get('jti'):
+            revocation_store.revoke(payload['jti'], payload['exp'])
+    if refresh_token:
+        try:
+            revoke_family(decode_refresh_token(refresh_token)['family'])
+        except exceptions.AuthenticationFailed:
+            pass
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import threading
+
+import jwt
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework_jwt import utils
+from rest_framework_jwt.settings import api_settings
+
+from .verifier import EdDSAAlgorithm, TokenVerifier, b64url
+
+
+JWT_KEYS_DEFAULTS = {
+    # RS256 or EdDSA (Ed25519)
+    'ALGORITHM': 'RS256',
+    # dicts with PRIVATE_KEY / PRIVATE_KEY_FILE for keys that sign (the first
+    # one does), or PUBLIC_KEY / PUBLIC_KEY_FILE for retired keys that only
+    # verify; KID is the RFC 7638 thumbprint unless given. No keys keeps the
+    # HS256 tokens signed with SECRET_KEY.
+    'KEYS': [],
+    'JWKS_MAX_AGE': 300,
+}
+
+
+def jwt_keys_settings():
+    options = dict(JWT_KEYS_DEFAULTS)
+    options.update(getattr(settings, 'JWT_KEYS', {}))
+    return options
+
+
+def int_b64url(number):
+    return b64url(number.to_bytes((number.bit_length() + 7) // 8, 'big'))
+
+
+def public_jwk(public_key):
+    """
+    JWK members of a public key, without `kid`, `alg` and `use`.
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        return {'kty': 'RSA', 'e': int_b64url(numbers.e), 'n': int_b64url(numbers.n)}
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return json.loads(EdDSAAlgorithm.to_jwk(public_key))
+    raise ImproperlyConfigured(f"unsupported JWT key type {type(public_key).__name__}")
+
+
+def thumbprint(jwk):
+    """
+    RFC 7638 thumbprint, used as `kid`.
+    """
+    required = {'RSA': ('e', 'kty', 'n'), 'OKP': ('crv', 'kty', 'x')}[jwk['kty']]
+    canonical = json.dumps({name: jwk[name] for name in required}, separators=(',', ':'), sort_keys=True)
+    return b64url(hashlib.sha256(canonical.encode()).digest())
+
+
+def read_key(entry, name):
+    if entry.get(name):
+        return entry[name].encode() if isinstance(entry[name], str) else entry[name]
+    if entry.get(f'{name}_FILE'):
+        with open(entry[f'{name}_FILE'], 'rb') as file:
+            return file.read()
+    return None
+
+
+class KeySet:
+    """
+    Parsed keys of JWT_KEYS: `signing` is `(kid, private key)` of the key
+    that signs new tokens, `public` maps every kid to its public key.
+    """
+
+    def __init__(self, options):
+        self.algorithm = options['ALGORITHM']
+        self.signing = None
+        self.public = {}
+        for entry in options['KEYS']:
+            private = read_key(entry, 'PRIVATE_KEY')
+            if private is not None:
+                private = serialization.load_pem_private_key(private, None, default_backend())
+                public = private.public_key()
+            else:
+                public = read_key(entry, 'PUBLIC_KEY')
+                if public is None:
+                    raise ImproperlyConfigured("JWT_KEYS entries need a private or public key")
+                public = serialization.load_pem_public_key(public, default_backend())
+            kid = entry.get('KID') or thumbprint(public_jwk(public))
+            self.public[kid] = public
+            if private is not None and self.signing is None:
+                self.signing = (kid, private)
+        if self.public and self.signing is None:
+            raise ImproperlyConfigured("JWT_KEYS needs at least one private key")
+        self.verifier = TokenVerifier(self.jwks())
+
+    def jwks(self):
+        keys = []
+        for kid, public in self.public.items():
+            keys.append(dict(public_jwk(public), kid=kid, alg=self.algorithm, use='sig'))
+        return {'keys': keys}
+
+
+_key_set = None
+_key_set_lock = threading.Lock()
+
+
+def key_set():
+    global _key_set
+    with _key_set_lock:
+        if _key_set is None:
+            _key_set = KeySet(jwt_keys_settings())
+        return _key_set
+
+
+@receiver(setting_changed)
+def reset_key_set(setting, **kwargs):
+    global _key_set
+    if setting in ('JWT_KEYS', 'JWT_AUTH'):
+        with _key_set_lock:
+            _key_set = None
+
+
+def jwt_encode_handler(payload):
+    """
+    Sign with the active JWT_KEYS key and its `kid` in the header, or with
+    rest_framework_jwt's HS256 handler when no keys are configured.
+    """
+    keys = key_set()
+    if keys.signing is None:
+        return utils.jwt_encode_handler(payload)
+    kid, private = keys.signing
+    return jwt.encode(payload, private, keys.algorithm, headers={'kid': kid}).decode('utf-8')
+
+
+def jwt_decode_handler(token):
+    """
+    Verify with the public JWT_KEYS only, or with rest_framework_jwt's HS256
+    handler when no keys are configured.
+    """
+    keys = key_set()
+    if keys.signing is None:
+        return utils.jwt_decode_handler(token)
+    return keys.verifier.decode(
+        token, audience=api_settings.JWT_AUDIENCE, issuer=api_settings.JWT_ISSUER,
+        leeway=api_settings.JWT_LEEWAY, verify_exp=api_settings.JWT_VERIFY_EXPIRATION)
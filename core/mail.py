@@ -0,0 +1,115 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from allauth.account.adapter import get_adapter
+
+from .models import OutgoingEmail
+
+
+EMAIL_OUTBOX_DEFAULTS = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'POLL_INTERVAL': 5,
+}
+
+
+def outbox_settings():
+    options = dict(EMAIL_OUTBOX_DEFAULTS)
+    options.update(getattr(settings, 'EMAIL_OUTBOX', {}))
+    return options
+
+
+def queue_mail(template_prefix, email, context=None):
+    """
+    Insert an outbox row for `template_prefix` (e.g. "account/email/email_confirmation").
+    `context` must be JSON serializable, a `user_id` key is turned back into
+    `user` when the mail is rendered.
+    """
+    return OutgoingEmail.objects.create(
+        template_prefix=template_prefix,
+        to_email=email,
+        context=json.dumps(context or {}),
+    )
+
+
+def render_mail(outgoing, users=None):
+    context = json.loads(outgoing.context)
+    user_id = context.get('user_id')
+    if user_id is not None:
+        if users is not None and user_id in users:
+            context['user'] = users[user_id]
+        else:
+            context['user'] = get_user_model().objects.filter(pk=user_id).first()
+    context['current_site'] = Site.objects.get_current()
+    return get_adapter().render_mail(outgoing.template_prefix, outgoing.to_email, context)
+
+
+def retry_delay(attempts):
+    options = outbox_settings()
+    delay = options['BACKOFF_SECONDS'] * 2 ** max(attempts - 1, 0)
+    return datetime.timedelta(seconds=min(delay, options['MAX_BACKOFF_SECONDS']))
+
+
+def send_batch(connection=None, batch_size=None):
+    """
+    Deliver one batch of due outbox rows over a single SMTP connection.
+    Rows are locked with SKIP LOCKED so several workers can run side by side.
+    Returns a `(sent, failed)` tuple.
+    """
+    options = outbox_settings()
+    batch_size = batch_size or options['BATCH_SIZE']
+    connection = connection or get_connection()
+    sent = failed = 0
+
+    with transaction.atomic():
+        now = timezone.now()
+        batch = list(
+            OutgoingEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.PENDING, next_attempt__lte=now)
+            .order_by('next_attempt', 'id')[:batch_size]
+        )
+        if not batch:
+            return sent, failed
+
+        user_ids = {json.loads(outgoing.context).get('user_id') for outgoing in batch}
+        user_ids.discard(None)
+        users = get_user_model().objects.in_bulk(user_ids)
+
+        for outgoing in batch:
+            outgoing.attempts += 1
+            try:
+                message = render_mail(outgoing, users)
+                # keeps the session open across the batch, the backend only
+                # closes connections it opened itself inside send_messages()
+                connection.open()
+                connection.send_messages([message])
+            except Exception as error:
+                failed += 1
+                outgoing.last_error = repr(error)
+                if outgoing.attempts >= options['MAX_ATTEMPTS']:
+                    outgoing.status = OutgoingEmail.FAILED
+                else:
+                    outgoing.next_attempt = now + retry_delay(outgoing.attempts)
+                # drop a broken SMTP session, it is reopened on the next send
+                connection.close()
+            else:
+                sent += 1
+                outgoing.status = OutgoingEmail.SENT
+                outgoing.sent_at = timezone.now()
+                outgoing.last_error = None
+            outgoing.modified = timezone.now()
+
+        OutgoingEmail.objects.bulk_update(
+            batch, ['status', 'attempts', 'next_attempt', 'last_error', 'sent_at', 'modified'])
+
+    return sent, failed
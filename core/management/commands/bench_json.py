@@ -0,0 +1,78 @@
+import base64
+import datetime
+import io
+import os
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core import parsers, renderers
+
+
+class Command(BaseCommand):
+    help = ("Time DRF's JSONRenderer/JSONParser against core.renderers.FastJSONRenderer "
+            "and core.parsers.FastJSONParser on a /user/ payload and an image upload body.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--addresses', type=int, default=20,
+                            help="nested addresses in the user payload")
+        parser.add_argument('--upload-kb', type=int, default=2048,
+                            help="size of the image in the upload body, before base64")
+        parser.add_argument('--seconds', type=float, default=1.0,
+                            help="time spent per measurement")
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed, the fast classes use the stdlib"))
+
+        user = self.user_payload(options['addresses'])
+        upload = {'profile_picture': 'data:image/jpeg;base64,' + base64.b64encode(
+            os.urandom(options['upload_kb'] * 1024)).decode()}
+        user_body = JSONRenderer().render(user)
+        upload_body = JSONRenderer().render(upload)
+        assert renderers.FastJSONRenderer().render(user) == user_body
+        # DRF's encoder has no PhoneNumber support, the serializer field converts it first
+        assert renderers.FastJSONRenderer().render(dict(
+            user, phone_number=PhoneNumber.from_string(user['phone_number']))) == user_body
+        self.stdout.write(f"user payload: {len(user_body)} bytes, upload body: {len(upload_body)} bytes")
+
+        for name, payload in (('user', user), ('upload', upload)):
+            self.compare(f"render {name}", options['seconds'],
+                         lambda: JSONRenderer().render(payload),
+                         lambda: renderers.FastJSONRenderer().render(payload))
+        for name, body in (('user', user_body), ('upload', upload_body)):
+            self.compare(f"parse {name}", options['seconds'],
+                         lambda: JSONParser().parse(io.BytesIO(body)),
+                         lambda: parsers.FastJSONParser().parse(io.BytesIO(body)))
+
+    def user_payload(self, addresses):
+        return {
+            'pk': 1, 'first_name': 'Thomas', 'last_name': 'Anderson', 'username': 'neo',
+            'email': 'neo@example.com', 'phone_number': '+201001234567',
+            'profile_picture': 'http://testserver/media/profile/3f2a9c1d0e.jpg',
+            'profile_picture_thumbnails': {'128': 'http://testserver/media/profile/3f2a9c1d0e_128.webp'},
+            'about': 'x' * 400, 'birth_date': datetime.date(1990, 3, 11),
+            'transportation': gettext_lazy('Car'), 'gender': 'm', 'id_number': 12345678901234,
+            'address': [{
+                'id': index, 'user': 1, 'street': f'{index} Tahrir street', 'building_number': index,
+                'city': 'C', 'country': 'Egypt', 'postal_code': 11511, 'task': False, 'profile': True,
+            } for index in range(addresses)],
+            'id_images': [{'id': index, 'profile': 1, 'title': 'front', 'image': 'http://testserver/media/id.png',
+                           'thumbnails': None} for index in range(2)],
+            'accept_terms': True, 'is_tasker': False,
+        }
+
+    def compare(self, label, seconds, baseline, fast):
+        results = []
+        for call in (baseline, fast):
+            timer = timeit.Timer(call)
+            number, elapsed = timer.autorange()
+            number = max(1, int(number * seconds / max(elapsed, 1e-9)))
+            results.append(min(timer.repeat(3, number)) / number)
+        self.stdout.write(
+            f"{label:>14}: drf {results[0] * 1e6:10.1f} us  fast {results[1] * 1e6:10.1f} us  "
+            f"x{results[0] / results[1]:.2f}")
@@ -0,0 +1,141 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# run in a fresh interpreter per measurement: imports the WSGI module, warms
+# up if asked, forks if asked, then serves `path` twice through the WSGI
+# callable and prints its numbers as JSON
+WORKER = r'''
+import json, os, resource, sys, time
+start = time.perf_counter()
+config = json.loads(sys.argv[1])
+module = __import__(config['module'], fromlist=['application'])
+imported = time.perf_counter()
+if config['warm_up']:
+    from core.startup import warm_up
+    warm_up(freeze_gc=config['freeze_gc'])
+warmed = time.perf_counter()
+
+def serve():
+    from wsgiref.util import setup_testing_defaults
+    environ = {'PATH_INFO': config['path'], 'REQUEST_METHOD': 'GET'}
+    setup_testing_defaults(environ)
+    started = time.perf_counter()
+    response = module.application(environ, lambda status, headers, exc_info=None: None)
+    b''.join(response)
+    if hasattr(response, 'close'):
+        response.close()
+    return time.perf_counter() - started
+
+def private_bytes():
+    # what a worker does not share with its parent, Linux only
+    try:
+        with open('/proc/self/smaps_rollup') as rollup:
+            fields = dict(line.split(':', 1) for line in rollup if ':' in line)
+    except OSError:
+        return None
+    return sum(int(fields[name].split()[0]) for name in ('Private_Clean', 'Private_Dirty')) * 1024
+
+def measure():
+    import gc
+    first = serve()
+    second = serve()
+    # a full collection, as a long running worker eventually makes
+    gc.collect()
+    return {
+        'import': imported - start, 'warm_up': warmed - imported, 'first': first, 'second': second,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 'private': private_bytes(),
+        'modules': len(sys.modules),
+    }
+
+if config['fork']:
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, json.dumps(measure()).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as pipe:
+        print(pipe.read())
+    os.waitpid(pid, 0)
+else:
+    print(json.dumps(measure()))
+'''
+
+MODES = (
+    ('cold', {}, {}),
+    ('cold, stdlib distutils', {}, {'SETUPTOOLS_USE_DISTUTILS': 'stdlib'}),
+    ('warm-up', {'warm_up': True}, {}),
+    ('preload, no gc.freeze', {'warm_up': True, 'fork': True, 'freeze_gc': False}, {}),
+    ('preload', {'warm_up': True, 'fork': True}, {}),
+)
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$')
+
+
+class Command(BaseCommand):
+    help = ("Time the start of a web worker in fresh interpreters: importing the WSGI application, "
+            "warming it up (core.startup) and its first two requests, with and without preloading "
+            "in a parent process; --profile lists what the import spends its time on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="interpreters started per mode")
+        parser.add_argument('--path', default='/.well-known/jwks.json', help="URL requested by the worker")
+        parser.add_argument('--profile', type=int, default=0, metavar='N',
+                            help="show the N packages taking longest to import instead")
+
+    def handle(self, *args, **options):
+        module = settings.WSGI_APPLICATION.rpartition('.')[0]
+        if options['profile']:
+            return self.profile(module, options['profile'])
+
+        self.stdout.write(f"{options['runs']} runs per mode, median, requesting {options['path']}")
+        self.stdout.write(f"{'':>24} {'import':>8} {'warm-up':>8} {'1st req':>8} {'2nd req':>8} "
+                          f"{'rss':>8} {'private':>8} {'modules':>8}")
+        for label, overrides, environ in MODES:
+            config = dict({'module': module, 'path': options['path'], 'warm_up': False,
+                           'fork': False, 'freeze_gc': True}, **overrides)
+            runs = [self.run(config, environ) for _ in range(options['runs'])]
+            median = {name: statistics.median(run[name] for run in runs) for name in runs[0]
+                      if runs[0][name] is not None}
+            private = f"{median['private'] / 2 ** 20:6.1f}MB" if 'private' in median else f"{'-':>8}"
+            self.stdout.write(
+                f"{label:>24} {median['import'] * 1e3:6.0f}ms {median['warm_up'] * 1e3:6.0f}ms "
+                f"{median['first'] * 1e3:6.1f}ms {median['second'] * 1e3:6.1f}ms "
+                f"{median['rss'] / 2 ** 20:6.1f}MB {private} {median['modules']:8.0f}")
+
+    def run(self, config, environ):
+        # a worker started with the environment of this command, without the
+        # warm-up the server's environment may ask for
+        environ = dict(os.environ, DJANGO_WARM_UP='False', **environ)
+        result = subprocess.run([sys.executable, '-c', WORKER, json.dumps(config)],
+                                env=environ, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(result.stderr)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def profile(self, module, count):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                env=dict(os.environ, DJANGO_WARM_UP='False'), cwd=settings.BASE_DIR,
+                                capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(result.stderr)
+        # own time of every module, added up per top-level package
+        packages = Counter()
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match:
+                packages[match.group(2).split('.')[0]] += int(match.group(1))
+        total = sum(packages.values())
+        self.stdout.write(f"importing {module}: {total / 1e3:.0f}ms")
+        for package, microseconds in packages.most_common(count):
+            self.stdout.write(f"{package:>24} {microseconds / 1e3:8.1f}ms {100 * microseconds / total:5.1f}%")
@@ -0,0 +1,20 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import ChunkedUpload
+from core.uploads import get_chunk_storage, uploads_settings
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads that were not completed within UPLOADS['EXPIRY_HOURS']."
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - datetime.timedelta(hours=uploads_settings()['EXPIRY_HOURS'])
+        storage = get_chunk_storage()
+        keys = list(ChunkedUpload.objects.filter(modified__lt=expired).values_list('pk', flat=True))
+        for key in keys:
+            storage.delete(key)
+        ChunkedUpload.objects.filter(pk__in=keys).delete()
+        self.stdout.write(f"deleted {len(keys)} stale uploads")
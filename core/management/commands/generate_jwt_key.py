@@ -0,0 +1,25 @@
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.core.management.base import BaseCommand
+
+from core.keys import public_jwk, thumbprint
+
+
+class Command(BaseCommand):
+    help = ("Print a new PEM private key for JWT_KEYS. Save it to a file listed "
+            "first in JWT_PRIVATE_KEY_FILES to start signing with it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=('RS256', 'EdDSA'), default='RS256')
+        parser.add_argument('--bits', type=int, default=2048)
+
+    def handle(self, *args, **options):
+        if options['algorithm'] == 'EdDSA':
+            key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            key = rsa.generate_private_key(65537, options['bits'], default_backend())
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+        self.stdout.write(pem.decode('ascii'), ending='')
+        self.stderr.write(f"kid: {thumbprint(public_jwk(key.public_key()))}")
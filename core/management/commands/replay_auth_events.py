@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.audit import auth_audit_settings, from_line
+from core.models import AuthEvent
+
+
+class Command(BaseCommand):
+    help = ("Insert the auth events appended to AUTH_AUDIT['FALLBACK_FILE'] while the database was "
+            "failing or slow, then delete the file. Run it on every web server.")
+
+    def handle(self, *args, **options):
+        options = auth_audit_settings()
+        path = options['FALLBACK_FILE']
+        replaying = f'{path}.replaying'
+        # the workers start a new file while this one is read; a file left
+        # by an interrupted run is replayed first (its inserts rolled back)
+        if not os.path.exists(replaying):
+            try:
+                os.rename(path, replaying)
+            except FileNotFoundError:
+                self.stdout.write("no auth events to replay")
+                return
+
+        events = []
+        with open(replaying, encoding='utf-8') as file:
+            for number, line in enumerate(file, 1):
+                try:
+                    events.append(from_line(line))
+                except (ValueError, KeyError, TypeError):
+                    self.stderr.write(f"{replaying}:{number}: skipped, not an auth event")
+        with transaction.atomic():
+            AuthEvent.objects.bulk_create(events, batch_size=options['BATCH_SIZE'])
+        os.remove(replaying)
+        self.stdout.write(f"replayed {len(events)} auth events")
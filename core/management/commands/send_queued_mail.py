@@ -0,0 +1,38 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from core.mail import outbox_settings, send_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued e-mails from the outbox table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the due e-mails and exit instead of polling.")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds to sleep when the outbox is empty.")
+
+    def handle(self, *args, **options):
+        settings = outbox_settings()
+        interval = options['interval'] or settings['POLL_INTERVAL']
+        connection = get_connection()
+
+        try:
+            while True:
+                sent, failed = send_batch(connection, options['batch_size'])
+                if sent or failed:
+                    self.stdout.write(f"sent {sent}, failed {failed}")
+                    continue
+                if options['once']:
+                    break
+                # nothing due, let the SMTP session go while idle
+                connection.close()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
@@ -0,0 +1,246 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+PERF_METRICS_DEFAULTS = {
+    'ENABLED': True,
+    # share of requests that get the query/serializer/hash breakdown and a
+    # Server-Timing header; every request is counted in the duration histogram
+    'SAMPLE_RATE': 0.01,
+    'SERVER_TIMING': True,
+    # bearer token of the Prometheus scraper for /metrics, staff can always read it
+    'TOKEN': '',
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# per-request totals of the sampled request being served, None otherwise
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def perf_settings():
+    options = dict(PERF_METRICS_DEFAULTS)
+    options.update(getattr(settings, 'PERF_METRICS', {}))
+    return options
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    In-process histograms, and the gauges of the registered collectors,
+    rendered in the Prometheus text format. Each worker process keeps its
+    own, so scrape every worker (or run one).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def collect(self, collector):
+        """
+        Render the `(name, labels, value, help)` gauges yielded by
+        `collector()` with every scrape; `clear()` keeps collectors.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS, help=''):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help)
+            histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._help.clear()
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(self._help):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for (key_name, labels), histogram in sorted(self._histograms.items()):
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+            collectors = list(self._collectors)
+
+        # outside the lock, the collectors take their owners' locks
+        gauges = {}
+        for collector in collectors:
+            for name, labels, value, help in collector():
+                gauges.setdefault(name, (help, []))[1].append((tuple(sorted(labels.items())), value))
+        for name in sorted(gauges):
+            help, samples = gauges[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+registry = Registry()
+
+
+def stats_gauges(prefix, stats, help, labels=None):
+    """
+    `Registry.collect()` gauges for the numbers of a `stats()` dict.
+    """
+    for key, value in stats.items():
+        if isinstance(value, (bool, int, float)):
+            yield f'{prefix}_{key}', labels or {}, int(value) if isinstance(value, bool) else value, help
+
+
+def process_stats():
+    """
+    The counters kept by the process wide caches, limiters and pools.
+    """
+    from .authentication import principal_cache
+    from .db.pool import pool_stats
+    from .hashers import hash_admission
+    from .revocation import revocation_store
+    from .throttling import login_limiter
+
+    yield from stats_gauges('login_throttle', login_limiter.stats(),
+                            "Login attempts checked, rejected and failed, lockouts, resets and cache fallbacks")
+    yield from stats_gauges('principal_cache', principal_cache.stats(),
+                            "Authenticated users served from the process, the shared cache or the database")
+    yield from stats_gauges('password_hash', hash_admission.stats(),
+                            "Password hashes run and refused by the admission limit")
+    yield from stats_gauges('token_revocation', revocation_store.stats(),
+                            "Token revocation checks, and the ones the bloom filter matched and the cache answered")
+    for alias, stats in pool_stats().items():
+        yield from stats_gauges('db_pool', stats, "Database connections of the pool", {'alias': alias})
+
+
+class Timings:
+    """
+    Seconds spent and events counted per phase during one request.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        # phases being timed, a nested call of the same phase (a serializer
+        # inside a serializer) is part of the outer one
+        self.active = set()
+
+    def add(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+
+@contextmanager
+def timed(phase):
+    timings = current_timings.get()
+    if timings is None or phase in timings.active:
+        yield
+        return
+    timings.active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(phase)
+        timings.add(phase, time.perf_counter() - start)
+
+
+class QueryTimer:
+    """
+    `connection.execute_wrapper()` callable adding to the `db` phase.
+    """
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings.add('db', time.perf_counter() - start)
+
+
+def timed_method(phase, method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        timings = current_timings.get()
+        if timings is None or phase in timings.active:
+            return method(self, *args, **kwargs)
+        with timed(phase):
+            return method(self, *args, **kwargs)
+    wrapper.timed_phase = phase
+    return wrapper
+
+
+def instrument_serializers():
+    """
+    Time `is_valid()` and the outermost `to_representation()` of every DRF
+    serializer. Outside sampled requests this costs one context var lookup.
+    """
+    from rest_framework import serializers
+
+    targets = (
+        (serializers.BaseSerializer, 'is_valid', 'validate'),
+        (serializers.Serializer, 'to_representation', 'serialize'),
+        (serializers.ListSerializer, 'to_representation', 'serialize'),
+    )
+    for cls, name, phase in targets:
+        method = cls.__dict__[name]
+        if not hasattr(method, 'timed_phase'):
+            setattr(cls, name, timed_method(phase, method))
+
+
+def server_timing(timings, total):
+    """
+    `Server-Timing` header value, durations in milliseconds.
+    """
+    parts = []
+    for phase in sorted(timings.seconds):
+        parts.append(f"{phase};dur={timings.seconds[phase] * 1000:.2f}")
+    if 'db' in timings.counts:
+        parts.append(f"queries;desc=\"{timings.counts['db']}\"")
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(parts)
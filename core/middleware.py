@@ -0,0 +1,125 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import (COUNT_BUCKETS, QueryTimer, Timings, current_timings, perf_settings,
+                      registry, server_timing)
+from .querycheck import DuplicateQueriesError, inspect_queries, query_inspector_settings
+from .routers import Pin, current_pin, pin_cache, replication_settings, user_pin_key
+
+
+logger = logging.getLogger(__name__)
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class PerformanceMiddleware:
+    """
+    Records the duration of every request per view in `core.metrics.registry`.
+    A SAMPLE_RATE share of requests also records database, serializer and
+    password hashing time and query counts, and returns them in a
+    `Server-Timing` header. Put it first in MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        if not perf_settings()['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = perf_settings()
+        if random.random() >= options['SAMPLE_RATE']:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            self.observe_request(request, response, time.perf_counter() - start)
+            return response
+
+        timings = Timings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(QueryTimer(timings)))
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total = time.perf_counter() - start
+
+        view = self.observe_request(request, response, total)
+        registry.observe('http_request_queries', {'view': view}, timings.counts.get('db', 0),
+                         buckets=COUNT_BUCKETS, help="Database queries per sampled request.")
+        for phase, seconds in timings.seconds.items():
+            registry.observe(f'http_request_{phase}_seconds', {'view': view}, seconds,
+                             help=f"Time spent in {phase} per sampled request.")
+        if options['SERVER_TIMING']:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
+
+    def observe_request(self, request, response, seconds):
+        match = getattr(request, 'resolver_match', None)
+        # unmatched paths would give a label per probed URL
+        view = match.view_name if match is not None else 'unmatched'
+        registry.observe('http_request_duration_seconds',
+                         {'view': view, 'method': request.method if request.method in METHODS else 'other',
+                          'status': response.status_code},
+                         seconds, help="Request duration.")
+        return view
+
+
+class QueryInspectorMiddleware:
+    """
+    Reports the query shapes a request repeats more than QUERY_INSPECTOR
+    THRESHOLD times, with the serializer field or code line that ran them:
+    as a warning in 'log' mode, as a DuplicateQueriesError in 'raise' mode.
+    """
+
+    def __init__(self, get_response):
+        if query_inspector_settings()['MODE'] == 'off':
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with inspect_queries() as inspector:
+            response = self.get_response(request)
+        if inspector.duplicates():
+            report = inspector.report(f"{request.method} {request.path}")
+            if query_inspector_settings()['MODE'] == 'raise':
+                raise DuplicateQueriesError(report)
+            logger.warning(report)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Serves the reads of a request from the replicas of DATABASE_REPLICATION
+    until it writes (see core.routers.ReplicaRouter). After a write, the
+    client's requests carry a PIN_COOKIE and those of the user named with
+    `core.routers.pin_user()` are marked in the cache; both read from the
+    primary for PIN_SECONDS, so nobody reads their own write from a lagging
+    replica.
+    """
+
+    def __init__(self, get_response):
+        if not replication_settings()['REPLICAS']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = replication_settings()
+        pin = Pin(pinned=options['PIN_COOKIE'] in request.COOKIES)
+        token = current_pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_pin.reset(token)
+        if pin.wrote:
+            response.set_cookie(options['PIN_COOKIE'], '1', max_age=options['PIN_SECONDS'],
+                                httponly=True, samesite='Lax')
+            if pin.user_id is not None:
+                pin_cache().set(user_pin_key(pin.user_id), 1, options['PIN_SECONDS'])
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.4 on 2026-10-18 11:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0002_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event', models.CharField(choices=[('login', 'Login'), ('login_failed', 'Failed login'), ('logout', 'Logout'), ('password_change', 'Password change'), ('password_reset_request', 'Password reset request'), ('password_reset', 'Password reset'), ('email_confirm', 'E-mail confirmation'), ('email_change_request', 'E-mail change request'), ('email_change', 'E-mail change')], max_length=32)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('user_agent', models.CharField(blank=True, max_length=255)),
+                ('identifier', models.CharField(blank=True, max_length=255)),
+                ('data', models.TextField(default='{}')),
+                ('user', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='authevent',
+            index=models.Index(fields=['user', 'created'], name='authevent_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='authevent',
+            index=models.Index(fields=['created'], name='authevent_created_idx'),
+        ),
+    ]
@@ -1,4 +1,9 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
 
 class TimeStampedModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -6,3 +11,118 @@ class TimeStampedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class OutgoingEmail(TimeStampedModel):
+    """
+    Outbox row for a templated e-mail, written in the request transaction
+    and delivered later by the `send_queued_mail` command.
+    """
+    PENDING = 'p'
+    SENT = 's'
+    FAILED = 'f'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (SENT, _('Sent')),
+        (FAILED, _('Failed')),
+    )
+
+    template_prefix = models.CharField(max_length=200)
+    to_email = models.EmailField()
+    context = models.TextField(default='{}')
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.template_prefix} -> {self.to_email}"
+
+
+class ChunkedUpload(TimeStampedModel):
+    """
+    A resumable upload. Its bytes live in `core.uploads` chunk storage under
+    `id` until the upload is complete and turned into a file field.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64)
+    # bytes received so far, the next chunk has to start here
+    offset = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class AuthEventQuerySet(models.QuerySet):
+
+    def for_user(self, user_id):
+        return self.filter(user_id=user_id)
+
+    def between(self, since=None, until=None):
+        queryset = self
+        if since is not None:
+            queryset = queryset.filter(created__gte=since)
+        if until is not None:
+            queryset = queryset.filter(created__lt=until)
+        return queryset
+
+
+class AuthEvent(models.Model):
+    """
+    A login, logout, password or e-mail change, recorded through
+    `core.audit.audit_log` and written in batches after the request.
+    """
+    LOGIN = 'login'
+    LOGIN_FAILED = 'login_failed'
+    LOGOUT = 'logout'
+    PASSWORD_CHANGE = 'password_change'
+    PASSWORD_RESET_REQUEST = 'password_reset_request'
+    PASSWORD_RESET = 'password_reset'
+    EMAIL_CONFIRM = 'email_confirm'
+    EMAIL_CHANGE_REQUEST = 'email_change_request'
+    EMAIL_CHANGE = 'email_change'
+    EVENT_CHOICES = (
+        (LOGIN, _('Login')),
+        (LOGIN_FAILED, _('Failed login')),
+        (LOGOUT, _('Logout')),
+        (PASSWORD_CHANGE, _('Password change')),
+        (PASSWORD_RESET_REQUEST, _('Password reset request')),
+        (PASSWORD_RESET, _('Password reset')),
+        (EMAIL_CONFIRM, _('E-mail confirmation')),
+        (EMAIL_CHANGE_REQUEST, _('E-mail change request')),
+        (EMAIL_CHANGE, _('E-mail change')),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    event = models.CharField(max_length=32, choices=EVENT_CHOICES)
+    # no constraint: events outlive their user, and inserts skip the check;
+    # indexed with `created` below
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', blank=True, null=True,
+                             on_delete=models.DO_NOTHING, db_constraint=False, db_index=False)
+    # when it happened, not when its batch was written
+    created = models.DateTimeField(default=timezone.now)
+    ip = models.GenericIPAddressField(blank=True, null=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+    # username, e-mail or phone number a failed login was attempted with
+    identifier = models.CharField(max_length=255, blank=True)
+    data = models.TextField(default='{}')
+
+    objects = AuthEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created'], name='authevent_user_created_idx'),
+            models.Index(fields=['created'], name='authevent_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.user_id} {self.created:%Y-%m-%d %H:%M:%S}"
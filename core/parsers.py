@@ -0,0 +1,57 @@
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# orjson reads integers over 64 bits (20 digits and more) as floats; small
+# bodies are scanned for such digit runs, big ones (mostly a few long
+# strings) are cheaper to check by walking the parsed data
+SCAN_LIMIT = 64 * 1024
+DIGITS = bytes(ord('0') if ord('0') <= byte <= ord('9') else ord(' ') for byte in range(256))
+DIGIT_RUN = b'0' * 20
+HUGE = float(2 ** 64)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser reading UTF-8 bodies with orjson when it is installed. Bodies
+    it refuses, or with integers it could only read as floats, go to DRF's
+    parser, which accepts or words the error the same as before.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read()
+        small = len(body) <= SCAN_LIMIT
+        if not small or DIGIT_RUN not in body.translate(DIGITS):
+            try:
+                data = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                pass
+            else:
+                if small or not has_huge_float(data):
+                    return data
+        return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+def has_huge_float(data):
+    stack = [data]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+        elif isinstance(item, float) and not -HUGE < item < HUGE:
+            return True
+    return False
@@ -0,0 +1,162 @@
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.fields import Field
+from rest_framework.serializers import ListSerializer
+
+from . import benchmark, metrics
+
+
+logger = logging.getLogger(__name__)
+
+QUERY_INSPECTOR_DEFAULTS = {
+    # 'off', 'log' (a warning per request, for staging) or 'raise'
+    # (DuplicateQueriesError, for the test suite)
+    'MODE': 'off',
+    # a query shape run more than THRESHOLD times in one request is reported
+    'THRESHOLD': 2,
+    # regexes of statements never reported
+    'IGNORE': (r'^(RELEASE |ROLLBACK TO )?SAVEPOINT ',),
+}
+
+MODES = ('off', 'log', 'raise')
+
+_IN_LIST = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+_VALUES_LIST = re.compile(r'(\((?:%s|\?)(?:, (?:%s|\?))*\))(?:, \1)+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+# modules of execute wrappers, never the origin of a query
+WRAPPER_FILES = {__file__, benchmark.__file__, metrics.__file__,
+                 os.path.join(os.path.dirname(__file__), 'middleware.py')}
+DB_PACKAGE = os.path.join('django', 'db', '')
+
+
+def query_inspector_settings():
+    options = dict(QUERY_INSPECTOR_DEFAULTS)
+    options.update(getattr(settings, 'QUERY_INSPECTOR', {}))
+    if options['MODE'] not in MODES:
+        raise ValueError(f"QUERY_INSPECTOR MODE must be one of {', '.join(MODES)}")
+    return options
+
+
+class DuplicateQueriesError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """
+    Shape of a statement: literals and placeholders become `?`, and IN and
+    VALUES lists of any length look the same.
+    """
+    sql = ' '.join(sql.split())
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql.replace('%s', '?'))
+    return _VALUES_LIST.sub(r'\1, ...', sql)
+
+
+def field_path(field):
+    """
+    `UserSerializer.address.city` for a field bound in nested serializers.
+    """
+    names = []
+    while field.parent is not None:
+        if field.field_name:
+            names.append(field.field_name)
+        field = field.parent
+    if isinstance(field, ListSerializer):
+        names.append(f'{type(field.child).__name__}[]')
+    else:
+        names.append(type(field).__name__)
+    return '.'.join(reversed(names))
+
+
+def query_origin(frame):
+    """
+    The serializer field whose `get_attribute()` or `to_representation()`
+    ran the query, or else the innermost line of project code, or else of
+    a library other than django.db.
+    """
+    code_line = library_line = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name in ('get_attribute', 'to_representation'):
+            field = frame.f_locals.get('self')
+            if isinstance(field, Field):
+                return field_path(field)
+        filename = code.co_filename
+        if code_line is None and filename not in WRAPPER_FILES:
+            if filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in filename:
+                code_line = f'{os.path.relpath(filename, settings.BASE_DIR)}:{frame.f_lineno}'
+            elif library_line is None and DB_PACKAGE not in filename:
+                library_line = f'{filename.rpartition("site-packages" + os.sep)[2]}:{frame.f_lineno}'
+        frame = frame.f_back
+    return code_line or library_line or 'unknown'
+
+
+class QueryInspector:
+    """
+    `connection.execute_wrapper()` callable grouping statements by their
+    fingerprint and remembering where each one was run from.
+    """
+
+    def __init__(self, threshold=None, ignore=None):
+        options = query_inspector_settings()
+        self.threshold = options['THRESHOLD'] if threshold is None else threshold
+        self.ignore = [re.compile(pattern) for pattern in (options['IGNORE'] if ignore is None else ignore)]
+        self.queries = {}
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not any(pattern.search(sql) for pattern in self.ignore):
+            self.count += 1
+            shape = fingerprint(sql)
+            self.queries.setdefault(shape, Counter())[query_origin(sys._getframe(1))] += 1
+        return execute(sql, params, many, context)
+
+    def duplicates(self):
+        """
+        `(fingerprint, times run, Counter of origins)` of the shapes run more
+        than `threshold` times, most repeated first.
+        """
+        found = []
+        for shape, origins in self.queries.items():
+            total = sum(origins.values())
+            if total > self.threshold:
+                found.append((shape, total, origins))
+        return sorted(found, key=lambda item: -item[1])
+
+    def report(self, label=''):
+        lines = [f"{label} ran {self.count} queries, repeated ones:".strip()]
+        for shape, total, origins in self.duplicates():
+            lines.append(f"  {total}x {shape}")
+            for origin, count in origins.most_common():
+                lines.append(f"      {count}x from {origin}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def inspect_queries(threshold=None, ignore=None):
+    """
+    Inspect the statements run on every database connection inside the block.
+    """
+    inspector = QueryInspector(threshold, ignore)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(inspector))
+        yield inspector
+
+
+@contextmanager
+def assert_no_duplicate_queries(threshold=None, ignore=None):
+    with inspect_queries(threshold, ignore) as inspector:
+        yield inspector
+    if inspector.duplicates():
+        raise DuplicateQueriesError(inspector.report())
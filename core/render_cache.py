@@ -0,0 +1,79 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+RENDER_CACHE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    # bodies never change under their key, a cache with a local tier (see
+    # core.cache.TieredCache) saves the round trip; CACHE_ALIAS when None
+    'BODY_CACHE_ALIAS': None,
+    'TIMEOUT': 3600,
+    'KEY_PREFIX': 'render',
+}
+
+
+def render_cache_settings():
+    options = dict(RENDER_CACHE_DEFAULTS)
+    options.update(getattr(settings, 'RENDER_CACHE', {}))
+    return options
+
+
+class RenderCache:
+    """
+    Rendered response bodies of `name` per owner, stored under the owner's
+    current version. Writes `bump()` the version instead of deleting the
+    body, so a response rendered from data read before the write is stored
+    under the old version and never served. The version doubles as ETag.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def options(self):
+        return render_cache_settings()
+
+    @property
+    def cache(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    @property
+    def body_cache(self):
+        return caches[self.options['BODY_CACHE_ALIAS'] or self.options['CACHE_ALIAS']]
+
+    def version_key(self, owner_id):
+        return f"{self.options['KEY_PREFIX']}:{self.name}:{owner_id}:version"
+
+    def body_key(self, owner_id, version, variant=''):
+        return f"{self.options['KEY_PREFIX']}:{self.name}:{owner_id}:{version}:{variant}"
+
+    def version(self, owner_id):
+        """
+        Current version of the owner's body, started if there is none. Read
+        it before loading the data to render.
+        """
+        key = self.version_key(owner_id)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, self.options['TIMEOUT'])
+            # another process may have added its own first
+            version = self.cache.get(key)
+        return version
+
+    def get(self, owner_id, version, variant=''):
+        return self.body_cache.get(self.body_key(owner_id, version, variant))
+
+    def set(self, owner_id, version, body, variant=''):
+        """
+        `variant` tells apart bodies of the same data, e.g. per media type.
+        """
+        self.body_cache.set(self.body_key(owner_id, version, variant), body, self.options['TIMEOUT'])
+
+    def bump(self, owner_id):
+        self.cache.set(self.version_key(owner_id), uuid.uuid4().hex, self.options['TIMEOUT'])
+
+
+# JSON of GET /user/, bumped by core.signals
+user_render_cache = RenderCache('user')
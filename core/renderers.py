@@ -0,0 +1,99 @@
+import json
+import math
+
+from django.utils.functional import Promise
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    # dates go through `json_default` to keep DRF's format (milliseconds, 'Z')
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+_encoder = encoders.JSONEncoder()
+
+
+def json_default(obj):
+    # lazy translations and phone numbers are what our serializers hand over
+    # most, DRF's encoder handles dates, decimals, querysets, ...
+    if isinstance(obj, (Promise, PhoneNumber)):
+        return str(obj)
+    return _encoder.default(obj)
+
+
+def has_non_finite(data):
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def dumps(data):
+    """
+    Compact UTF-8 JSON, the same DRF's JSONRenderer writes, through orjson
+    when it is installed.
+    """
+    if orjson is not None:
+        try:
+            ret = orjson.dumps(data, default=json_default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits, the stdlib decides
+            pass
+        else:
+            # orjson writes NaN and infinities as null, the stdlib refuses
+            # them like DRF does
+            if b'null' not in ret or not has_non_finite(data):
+                return ret
+    return json.dumps(data, default=json_default, ensure_ascii=False, allow_nan=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer using `dumps()`. Indented output (e.g. for the browsable
+    API) and ASCII only settings still go through DRF's renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.ensure_ascii or not self.compact or self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = dumps(data)
+        # escaped like JSONRenderer does, for JSON embedded in a <script>
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    One JSON document per line. Views stream large lists themselves, this
+    renders the remaining (e.g. error) responses in the same format.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(self.render_row(row) for row in rows)
+
+    def render_row(self, row):
+        return dumps(row) + b'\n'
@@ -0,0 +1,199 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+TOKEN_REVOCATION_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'auth:revoked',
+    # revoked access tokens expected per generation (one access token lifetime)
+    'BLOOM_CAPACITY': 100000,
+    'BLOOM_ERROR_RATE': 0.001,
+    # seconds between pulls of the revocations made by other processes
+    'SYNC_INTERVAL': 1.0,
+    # seconds to wait for a log entry whose writer has not finished
+    'GAP_TIMEOUT': 5.0,
+}
+
+
+def revocation_settings():
+    options = dict(TOKEN_REVOCATION_DEFAULTS)
+    options.update(getattr(settings, 'TOKEN_REVOCATION', {}))
+    return options
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over strings: no false negatives, about
+    `error_rate` false positives once `capacity` items were added.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class RevocationStore:
+    """
+    Deny-list of token ids (`jti`) kept in the shared cache until the token
+    would have expired anyway.
+
+    Revoked access tokens are also appended to a per generation log in the
+    cache, one generation per access token lifetime. Every process folds the
+    log into local Bloom filters for the current and previous generation, so
+    a token that is not revoked (nearly every request) is accepted without
+    any cache round trip; only Bloom hits are confirmed in the cache.
+    Revocations from other processes are seen within SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filters = {}
+        self._seen = {}
+        self._gaps = {}
+        self._synced = 0.0
+        self.bloom_hits = 0
+        self.checks = 0
+
+    @property
+    def options(self):
+        return revocation_settings()
+
+    @property
+    def cache(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    @property
+    def generation_seconds(self):
+        from rest_framework_jwt.settings import api_settings
+
+        return max(1, int(api_settings.JWT_EXPIRATION_DELTA.total_seconds()))
+
+    def generation(self, now=None):
+        return int((now or time.time()) // self.generation_seconds)
+
+    def key(self, *parts):
+        return ':'.join([self.options['KEY_PREFIX'], *map(str, parts)])
+
+    def revoke(self, jti, expires_at, fast_path=True):
+        """
+        Deny `jti` until `expires_at` (a unix timestamp). `fast_path` adds it
+        to the Bloom filters, for tokens checked on every request.
+        """
+        now = time.time()
+        timeout = int(expires_at - now) + 1
+        if timeout <= 0:
+            return
+        self.cache.set(self.key('jti', jti), 1, timeout)
+        if not fast_path:
+            return
+        generation = self.generation(now)
+        count_key = self.key(generation, 'count')
+        log_timeout = 2 * self.generation_seconds + 60
+        self.cache.add(count_key, 0, log_timeout)
+        index = self.cache.incr(count_key)
+        self.cache.set(self.key(generation, index), jti, log_timeout)
+        with self._lock:
+            self._filter(generation).add(jti)
+
+    def is_revoked(self, jti):
+        self.sync()
+        generation = self.generation()
+        with self._lock:
+            self.checks += 1
+            hit = any(jti in self._filter(g) for g in (generation, generation - 1))
+            if hit:
+                self.bloom_hits += 1
+        if not hit:
+            return False
+        return self.cache.get(self.key('jti', jti)) is not None
+
+    def consume(self, jti, expires_at):
+        """
+        Deny `jti` if it is not yet, returning False when it already was.
+        Used to make refresh tokens single use.
+        """
+        timeout = int(expires_at - time.time()) + 1
+        return timeout > 0 and self.cache.add(self.key('jti', jti), 1, timeout)
+
+    def is_denied(self, jti):
+        """
+        Exact check without the Bloom filters, for tokens used rarely.
+        """
+        return self.cache.get(self.key('jti', jti)) is not None
+
+    def sync(self, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._synced < self.options['SYNC_INTERVAL']:
+                return
+            self._synced = now
+        generation = self.generation(now)
+        for g in (generation - 1, generation):
+            count = self.cache.get(self.key(g, 'count')) or 0
+            with self._lock:
+                seen = self._seen.get(g, 0)
+            if count <= seen:
+                continue
+            keys = [self.key(g, index) for index in range(seen + 1, count + 1)]
+            found = self.cache.get_many(keys)
+            with self._lock:
+                bloom = self._filter(g)
+                for index, key in enumerate(keys, start=seen + 1):
+                    if key not in found:
+                        # the writer may still be between incr() and set(),
+                        # wait for it unless the entry was lost
+                        gap = self._gaps.setdefault(g, (index, now))
+                        if gap[0] != index:
+                            gap = self._gaps[g] = (index, now)
+                        if now - gap[1] < self.options['GAP_TIMEOUT']:
+                            break
+                    else:
+                        bloom.add(found[key])
+                    self._seen[g] = index
+        with self._lock:
+            for g in [g for g in self._filters if g < generation - 1]:
+                self._filters.pop(g)
+                self._seen.pop(g, None)
+                self._gaps.pop(g, None)
+
+    def clear(self):
+        with self._lock:
+            self._filters.clear()
+            self._seen.clear()
+            self._gaps.clear()
+            self._synced = 0.0
+            self.bloom_hits = self.checks = 0
+
+    def stats(self):
+        with self._lock:
+            return {'checks': self.checks, 'bloom_hits': self.bloom_hits,
+                    'generations': sorted(self._filters)}
+
+    def _filter(self, generation):
+        bloom = self._filters.get(generation)
+        if bloom is None:
+            options = self.options
+            bloom = self._filters[generation] = BloomFilter(
+                options['BLOOM_CAPACITY'], options['BLOOM_ERROR_RATE'])
+        return bloom
+
+
+revocation_store = RevocationStore()
@@ -0,0 +1,96 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+DATABASE_REPLICATION_DEFAULTS = {
+    # aliases of DATABASES serving reads, everything goes to 'default' when empty
+    'REPLICAS': [],
+    # seconds a client or user reads from the primary after a request of
+    # theirs wrote, longer than the replicas usually lag behind
+    'PIN_SECONDS': 15,
+    'PIN_COOKIE': 'db_pin',
+    'CACHE_ALIAS': 'default',
+}
+
+
+def replication_settings():
+    options = dict(DATABASE_REPLICATION_DEFAULTS)
+    options.update(getattr(settings, 'DATABASE_REPLICATION', {}))
+    return options
+
+
+class Pin:
+    """
+    Where the reads of the request being served go: to the primary once
+    `pinned`, which a write of the request (`wrote`) implies.
+    """
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.user_id = None
+
+
+# set by core.middleware.ReplicaPinMiddleware, code outside of requests reads
+# from the primary
+current_pin = contextvars.ContextVar('current_pin', default=None)
+
+
+def pin_cache():
+    return caches[replication_settings()['CACHE_ALIAS']]
+
+
+def user_pin_key(user_id):
+    return f'db_pin:{user_id}'
+
+
+def pin_user(user_id):
+    """
+    Tell the router the request acts for `user_id`: its reads go to the
+    primary if a request of that user wrote within PIN_SECONDS, and if it
+    writes, the next requests of the user read from the primary as well.
+    Call it before loading the user.
+    """
+    pin = current_pin.get()
+    if pin is None or pin.user_id == user_id:
+        return
+    pin.user_id = user_id
+    if not pin.pinned and pin_cache().get(user_pin_key(user_id)):
+        pin.pinned = True
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of a request to a random replica until the request
+    writes, then to the primary. Reads inside a transaction always go to the
+    primary, as do reads outside of requests.
+    """
+
+    def db_for_read(self, model, **hints):
+        pin = current_pin.get()
+        if pin is None or pin.pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = replication_settings()['REPLICAS']
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin = current_pin.get()
+        if pin is not None:
+            pin.pinned = pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *replication_settings()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in replication_settings()['REPLICAS']:
+            return False
+        return None
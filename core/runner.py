@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests, and the benchmark commands, with the auth events inserted
+    in the request (the tests look for them right after it) and appended to
+    a temporary file when the database fails.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.audit_directory = tempfile.TemporaryDirectory()
+        self.audit_settings = override_settings(AUTH_AUDIT=dict(
+            getattr(settings, 'AUTH_AUDIT', {}), ASYNC=False,
+            FALLBACK_FILE=os.path.join(self.audit_directory.name, 'auth_events.jsonl')))
+        self.audit_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.audit_settings.disable()
+        self.audit_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,72 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import ModelSignal, post_save, post_delete
+from django.dispatch import receiver
+
+from .render_cache import user_render_cache
+
+
+User = get_user_model()
+
+# sent by core.images with `instance` once a processed image replaced the
+# upload; defined here so connecting the receivers below at startup does not
+# import Pillow
+after_image_processed = ModelSignal(providing_args=['instance'], use_caching=True)
+
+
+def invalidate_principal(user_id):
+    # imported here: core.authentication pulls in jwt and cryptography, which
+    # management commands loading the apps have no use for
+    from .authentication import principal_cache
+
+    # drop now and again after commit, so a concurrent request can't re-cache
+    # the row as it was before this transaction
+    principal_cache.invalidate(user_id)
+    transaction.on_commit(lambda: principal_cache.invalidate(user_id))
+
+
+def invalidate_user_render(user_id):
+    # a new version now and again after commit, like invalidate_principal
+    user_render_cache.bump(user_id)
+    transaction.on_commit(lambda: user_render_cache.bump(user_id))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_principal(sender, instance, *args, **kwargs):
+    invalidate_principal(instance.pk)
+
+
+@receiver([post_save, post_delete], sender='users.Profile')
+def invalidate_profile_principal(sender, instance, *args, **kwargs):
+    invalidate_principal(instance.user_id)
+
+
+@receiver(after_image_processed, sender='users.Profile')
+def invalidate_processed_profile_principal(sender, instance, *args, **kwargs):
+    # the processed picture is written with a queryset update
+    invalidate_principal(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_rendered(sender, instance, *args, **kwargs):
+    invalidate_user_render(instance.pk)
+
+
+@receiver([post_save, post_delete], sender='users.Profile')
+@receiver([post_save, post_delete], sender='users.Address')
+@receiver(after_image_processed, sender='users.Profile')
+def invalidate_owner_rendered(sender, instance, *args, **kwargs):
+    if instance.user_id is not None:
+        invalidate_user_render(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender='users.IDImages')
+@receiver(after_image_processed, sender='users.IDImages')
+def invalidate_id_image_rendered(sender, instance, *args, **kwargs):
+    try:
+        user_id = instance.profile.user_id
+    except ObjectDoesNotExist:
+        # deleted along with its profile
+        return
+    invalidate_user_render(user_id)
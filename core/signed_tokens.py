@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import hmac
+import struct
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+
+from .verifier import b64url, b64url_decode
+
+
+SIGNED_TOKENS_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    # seconds a token stays valid, per purpose
+    'MAX_AGE': {
+        'email_confirm': 3 * 24 * 3600,
+        'email_change': 24 * 3600,
+        'password_reset': 24 * 3600,
+    },
+    # the first one signs, keep a retired one until its tokens expire;
+    # SECRET_KEY when empty
+    'SECRETS': [],
+}
+
+# purpose -> byte in the payload, never renumber
+PURPOSES = {
+    'email_confirm': 1,
+    'email_change': 2,
+    'password_reset': 3,
+}
+PURPOSE_NAMES = {code: name for name, code in PURPOSES.items()}
+
+VERSION = 2
+# version, purpose, key id of the secret, issued at (milliseconds), subject
+# (user id), object id
+PAYLOAD = struct.Struct('>BBBQQQ')
+# version 1 had the issue time in whole seconds, read until its tokens expire
+PAYLOADS = {1: struct.Struct('>BBBIQQ'), VERSION: PAYLOAD}
+ISSUED_UNITS = {1: 1, VERSION: 1000}
+SIGNATURE_BYTES = 16
+# tolerated clock difference between servers
+CLOCK_SKEW = 60
+
+SignedToken = namedtuple('SignedToken', 'purpose subject object_id issued signature')
+
+
+def signed_tokens_settings():
+    options = dict(SIGNED_TOKENS_DEFAULTS)
+    options.update(getattr(settings, 'SIGNED_TOKENS', {}))
+    options['MAX_AGE'] = dict(SIGNED_TOKENS_DEFAULTS['MAX_AGE'], **options['MAX_AGE'])
+    return options
+
+
+def token_cache():
+    return caches[signed_tokens_settings()['CACHE_ALIAS']]
+
+
+def secrets():
+    return signed_tokens_settings()['SECRETS'] or [settings.SECRET_KEY]
+
+
+@functools.lru_cache(maxsize=32)
+def key_id(secret):
+    # stays the same when secrets are added or retired around it
+    return hashlib.sha256(f'core.signed_tokens:{secret}'.encode()).digest()[0]
+
+
+@functools.lru_cache(maxsize=32)
+def purpose_key(purpose, secret):
+    # a key per purpose, a token of one purpose never checks as another
+    return hashlib.sha256(f'core.signed_tokens:{purpose}:{secret}'.encode()).digest()
+
+
+def sign(purpose, secret, payload):
+    return hmac.new(purpose_key(purpose, secret), payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def make_token(purpose, subject, object_id=0):
+    """
+    URL safe token for `purpose` about user `subject` and, optionally, one
+    of its rows (`object_id`), e.g. the e-mail address to confirm.
+    """
+    secret = secrets()[0]
+    issued = int(time.time() * ISSUED_UNITS[VERSION])
+    payload = PAYLOAD.pack(VERSION, PURPOSES[purpose], key_id(secret), issued, subject, object_id)
+    return b64url(payload + sign(purpose, secret, payload))
+
+
+def invalid():
+    return exceptions.ValidationError(_('Invalid or expired token.'))
+
+
+def check_token(token, *purposes):
+    """
+    SignedToken of a valid `token` of one of `purposes`, checked without
+    reading the database. Raises ValidationError otherwise.
+    """
+    try:
+        raw = b64url_decode(token)
+    except (ValueError, TypeError):
+        raise invalid()
+    layout = PAYLOADS.get(raw[0]) if raw else None
+    if layout is None or len(raw) != layout.size + SIGNATURE_BYTES:
+        raise invalid()
+    payload, signature = raw[:layout.size], raw[layout.size:]
+    version, code, kid, issued, subject, object_id = layout.unpack(payload)
+    issued /= ISSUED_UNITS[version]
+    purpose = PURPOSE_NAMES.get(code)
+    if purpose not in purposes:
+        raise invalid()
+    if not any(hmac.compare_digest(signature, sign(purpose, secret, payload))
+               for secret in secrets() if key_id(secret) == kid):
+        raise invalid()
+
+    now = time.time()
+    if not now - signed_tokens_settings()['MAX_AGE'][purpose] <= issued <= now + CLOCK_SKEW:
+        raise invalid()
+    revoked_before = token_cache().get(floor_key(purpose, subject))
+    if revoked_before is not None and issued <= revoked_before:
+        raise invalid()
+    return SignedToken(purpose, subject, object_id, issued, signature)
+
+
+def used_key(token):
+    return f'signed_token:used:{token.purpose}:{token.signature.hex()}'
+
+
+def floor_key(purpose, subject):
+    return f'signed_token:floor:{purpose}:{subject}'
+
+
+def consume(token):
+    """
+    Mark a checked token used, raising ValidationError when it already was.
+    """
+    max_age = signed_tokens_settings()['MAX_AGE'][token.purpose]
+    timeout = max(int(token.issued + max_age - time.time()), 0) + CLOCK_SKEW
+    if not token_cache().add(used_key(token), 1, timeout):
+        raise invalid()
+
+
+def revoke_before(purpose, subject):
+    """
+    Reject the tokens of `purpose` issued to `subject` until now, e.g. the
+    other reset links once the password changed.
+    """
+    # to the millisecond, a link sent right after is not caught
+    token_cache().set(floor_key(purpose, subject), time.time(),
+                      signed_tokens_settings()['MAX_AGE'][purpose] + CLOCK_SKEW)
@@ -0,0 +1,76 @@
+import gc
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.urls import get_resolver
+from django.utils import translation
+
+from .db.pool import close_pool
+
+
+STARTUP_DEFAULTS = {
+    # warm the process up as soon as taskkez.wsgi / taskkez.asgi built the
+    # application rather than on its first requests; run the server with
+    # --preload (gunicorn) so it is done once, before forking the workers
+    'WARM_UP': False,
+    # then leave everything loaded so far out of the garbage collections, so
+    # the workers do not copy the pages the collector would touch
+    'FREEZE_GC': True,
+}
+
+
+def startup_settings():
+    options = dict(STARTUP_DEFAULTS)
+    options.update(getattr(settings, 'STARTUP', {}))
+    return options
+
+
+def application_loaded():
+    """
+    Called by taskkez.wsgi and taskkez.asgi once the application is built.
+    """
+    options = startup_settings()
+    if options['WARM_UP']:
+        warm_up(freeze_gc=options['FREEZE_GC'])
+
+
+def warm_up(freeze_gc=True):
+    """
+    Do what the first requests of a process would otherwise do: import the
+    URLconf with its views and serializers, DRF's configured classes and the
+    JWT keys, fill the models' field caches and load the translation
+    catalogue, phone number metadata and Pillow's plugins. Ends with no
+    database connection or cache client open, so it is safe to fork after.
+    """
+    from phonenumbers import example_number
+    from PIL import Image
+    from rest_framework.settings import api_settings
+
+    from .keys import key_set
+
+    get_resolver().url_patterns
+    for name in api_settings.import_strings:
+        getattr(api_settings, name)
+    key_set()
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta.related_objects
+
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext('')
+    example_number(getattr(settings, 'PHONENUMBER_DEFAULT_REGION', None) or 'US')
+    Image.init()
+
+    # connections opened while importing must not be shared with the children
+    connections.close_all()
+    for alias in connections:
+        close_pool(alias)
+    for cache in caches.all():
+        cache.close()
+
+    gc.collect()
+    if freeze_gc:
+        gc.freeze()
@@ -1,3 +1,880 @@
-from django.test import TestCase
+import datetime
+import decimal
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from django.core import mail
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.db import OperationalError, connections, router, transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.utils.translation import gettext_lazy as _lazy
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+from . import benchmark, parsers, renderers
+from .audit import AuditLog
+from .authentication import PrincipalCache, principal_cache
+from .cache import Recomputed, TieredCache
+from .db.pool import ConnectionPool, PoolTimeout, close_pool, get_pool
+from .metrics import registry
+from .middleware import ReplicaPinMiddleware
+from .querycheck import DuplicateQueriesError, assert_no_duplicate_queries, fingerprint
+from .hashers import HashAdmission, AdmissionRefused, AdmittedPBKDF2PasswordHasher, hash_admission, admission_enabled
+from .mail import queue_mail, send_batch
+from .models import AuthEvent, OutgoingEmail
+from .revocation import BloomFilter, RevocationStore
+from .routers import pin_user
+from .startup import application_loaded, warm_up
+from . import signed_tokens
+from .verifier import TokenVerifier, b64url
+from allauth.account.models import EmailAddress
+from .throttling import SlidingWindowLimiter
+
+
+User = get_user_model()
+
+
+class BrokenEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("smtp is down")
+
+
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+
+    def test_queued_mail_is_rendered_and_sent(self):
+        queue_mail('account/email/email_confirmation_signup', self.user.email,
+                   {'user_id': self.user.pk, 'key': 'abc'})
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_batch(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('account-confirm-email/abc', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].to, ['bob@example.com'])
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.SENT)
+        self.assertEqual(send_batch(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='core.tests.BrokenEmailBackend',
+                       EMAIL_OUTBOX={'MAX_ATTEMPTS': 2, 'BACKOFF_SECONDS': 0})
+    def test_failed_mail_is_retried_then_given_up(self):
+        queue_mail('account/email/password_reset_key', self.user.email,
+                   {'user_id': self.user.pk, 'password_reset_url': 'http://x/'})
+
+        self.assertEqual(send_batch(), (0, 1))
+        outgoing = OutgoingEmail.objects.get()
+        self.assertEqual((outgoing.status, outgoing.attempts), (OutgoingEmail.PENDING, 1))
+        self.assertIn('smtp is down', outgoing.last_error)
+
+        self.assertEqual(send_batch(), (0, 1))
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.FAILED)
+
+
+class BrokenCache(LocMemCache):
+
+    def get_many(self, keys, version=None):
+        raise ConnectionError("memcached is down")
+
+
+@override_settings(LOGIN_THROTTLE={'RATES': {'ip': '10/min', 'username': '2/min', 'email': '2/min'},
+                                   'LOCKOUT_SECONDS': 60})
+class SlidingWindowLimiterTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.limiter = SlidingWindowLimiter()
+        self.idents = [('ip', '10.0.0.1'), ('username', 'bob')]
+
+    def test_lockout_after_limit_and_escalation(self):
+        self.assertIsNone(self.limiter.check(self.idents))
+        self.limiter.hit(self.idents)
+        self.assertIsNone(self.limiter.check(self.idents))
+        self.limiter.hit(self.idents)
+        self.assertAlmostEqual(self.limiter.check(self.idents), 60, delta=1)
+
+        # a second lockout of the same key lasts twice as long
+        self.limiter.reset([('username', 'bob')])
+        cache.set(self.limiter.key('username', 'bob') + ':strikes', 1)
+        self.limiter.hit(self.idents)
+        self.limiter.hit(self.idents)
+        self.assertAlmostEqual(self.limiter.check(self.idents), 120, delta=1)
+        self.assertEqual(self.limiter.stats()['lockouts'], 2)
+
+    def test_falls_back_to_local_store(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'core.tests.BrokenCache'}}):
+            self.assertIsNone(self.limiter.check(self.idents))
+            self.limiter.hit(self.idents)
+            self.limiter.hit(self.idents)
+            self.assertIsNotNone(self.limiter.check(self.idents))
+        self.assertTrue(self.limiter.stats()['degraded'])
+
+
+class HashAdmissionTest(TestCase):
+
+    def test_admitted_hash_matches_django_hasher(self):
+        hasher = AdmittedPBKDF2PasswordHasher()
+        token = admission_enabled.set(True)
+        try:
+            encoded = hasher.encode('secret', 'salt', iterations=1000)
+        finally:
+            admission_enabled.reset(token)
+        self.assertEqual(encoded, PBKDF2PasswordHasher().encode('secret', 'salt', iterations=1000))
+        self.assertEqual(hash_admission.stats()['submitted'], 1)
+
+    @override_settings(PASSWORD_HASH_ADMISSION={'CONCURRENT': 1, 'QUEUE_SIZE': 0, 'TIMEOUT': 1})
+    def test_hashes_past_the_limit_are_refused_and_slots_returned(self):
+        admission = HashAdmission()
+        started, release = threading.Event(), threading.Event()
+
+        def hash_slowly():
+            started.set()
+            release.wait(5)
+            return 'hash'
+
+        thread = threading.Thread(target=admission.run, args=(hash_slowly,))
+        thread.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(AdmissionRefused):
+                admission.run(lambda: 'hash')
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(admission.run(lambda: 'hash'), 'hash')
+        with self.assertRaises(ValueError):
+            admission.run(int, 'not a number')
+        self.assertEqual(admission.run(lambda: 'hash'), 'hash')
+        self.assertEqual(admission.stats(), {'submitted': 4, 'rejected': 1})
+
+
+@override_settings(TOKEN_REVOCATION={'SYNC_INTERVAL': 0, 'BLOOM_CAPACITY': 1000})
+class RevocationStoreTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f'jti-{i}' for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_revocation_reaches_other_processes_through_the_log(self):
+        here, there = RevocationStore(), RevocationStore()
+        self.assertFalse(there.is_revoked('abc'))
+        here.revoke('abc', time.time() + 60)
+        self.assertTrue(there.is_revoked('abc'))
+        self.assertFalse(there.is_revoked('def'))
+
+        # tokens that are not revoked never reach the cache
+        with override_settings(TOKEN_REVOCATION={'SYNC_INTERVAL': 60, 'CACHE_ALIAS': 'missing'}):
+            self.assertFalse(there.is_revoked('def'))
+
+    def test_refresh_token_ids_are_single_use(self):
+        store = RevocationStore()
+        self.assertTrue(store.consume('refresh', time.time() + 60))
+        self.assertFalse(store.consume('refresh', time.time() + 60))
+        self.assertTrue(store.is_denied('refresh'))
+
+
+def private_pem(key):
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption()).decode()
+
+
+def public_pem(key):
+    return key.public_key().public_bytes(serialization.Encoding.PEM,
+                                         serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+
+
+class JWTKeysTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.old_rsa = rsa.generate_private_key(65537, 2048, default_backend())
+        cls.new_rsa = rsa.generate_private_key(65537, 2048, default_backend())
+
+    def encode(self):
+        return jwt_settings.JWT_ENCODE_HANDLER({'user_id': 1, 'username': 'bob', 'jti': 'x'})
+
+    def test_rotated_keys_verify_from_the_published_set_only(self):
+        with override_settings(JWT_KEYS={'KEYS': [{'PRIVATE_KEY': private_pem(self.old_rsa)}]}):
+            old_token = self.encode()
+
+        with override_settings(JWT_KEYS={'KEYS': [{'PRIVATE_KEY': private_pem(self.new_rsa)},
+                                                  {'PUBLIC_KEY': public_pem(self.old_rsa)}]}):
+            new_token = self.encode()
+            jwks = APIClient().get('/.well-known/jwks.json').json()
+            self.assertEqual(len(jwks['keys']), 2)
+            self.assertEqual(jwt_settings.JWT_DECODE_HANDLER(old_token)['username'], 'bob')
+
+        # another service, with nothing but the JWKS
+        verifier = TokenVerifier(jwks)
+        for token in (old_token, new_token):
+            self.assertEqual(verifier.decode(token)['user_id'], 1)
+        verifier.load({'keys': jwks['keys'][:1]})
+        with self.assertRaises(jwt.InvalidTokenError):
+            verifier.decode(old_token)
+        with self.assertRaises(jwt.InvalidTokenError):
+            verifier.decode(jwt.encode({'user_id': 1}, 'secret', 'HS256'))
+
+    def test_header_with_a_non_string_kid_is_a_decode_error(self):
+        with override_settings(JWT_KEYS={'KEYS': [{'PRIVATE_KEY': private_pem(self.new_rsa)}]}):
+            token = self.encode()
+            verifier = TokenVerifier(APIClient().get('/.well-known/jwks.json').json())
+        body = token.split('.', 1)[1]
+        for kid in (['a', 'b'], {}, 1):
+            header = b64url(json.dumps({'kid': kid, 'alg': 'RS256', 'typ': 'JWT'}).encode())
+            with self.assertRaises(jwt.DecodeError):
+                verifier.decode(f'{header}.{body}')
+
+    def test_eddsa_tokens(self):
+        key = ed25519.Ed25519PrivateKey.generate()
+        with override_settings(JWT_KEYS={'ALGORITHM': 'EdDSA', 'KEYS': [{'PRIVATE_KEY': private_pem(key)}]}):
+            token = self.encode()
+            self.assertEqual(jwt_settings.JWT_DECODE_HANDLER(token)['jti'], 'x')
+            jwks = APIClient().get('/.well-known/jwks.json').json()
+        self.assertEqual(jwks['keys'][0]['kty'], 'OKP')
+        self.assertEqual(TokenVerifier(jwks).decode(token)['jti'], 'x')
+
+    def test_unreachable_key_set_is_an_invalid_token_and_not_refetched(self):
+        with override_settings(JWT_KEYS={'KEYS': [{'PRIVATE_KEY': private_pem(self.new_rsa)}]}):
+            token = self.encode()
+        verifier = TokenVerifier(jwks_url='https://auth.example.com/.well-known/jwks.json', min_refetch=30)
+        with mock.patch('urllib.request.urlopen', side_effect=urllib.error.URLError('down')) as urlopen:
+            for attempt in range(2):
+                with self.assertRaises(jwt.InvalidTokenError):
+                    verifier.decode(token)
+        self.assertEqual(urlopen.call_count, 1)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run_counts_queries_and_failures(self):
+        def call(index):
+            get_user_model().objects.filter(pk=index).exists()
+            return index != 3
+
+        result = benchmark.run(call, 10, concurrency=2)
+        self.assertEqual((result['requests'], result['errors']), (10, 1))
+        self.assertEqual(result['queries_per_request'], 1)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_compare_flags_regressions_beyond_the_threshold(self):
+        old = {'results': {'login': {'throughput': 100, 'p50_ms': 10, 'p99_ms': 20, 'queries_per_request': 5}}}
+        new = {'results': {'login': {'throughput': 95, 'p50_ms': 15, 'p99_ms': 20, 'queries_per_request': 4}}}
+        regressed = {metric for scenario, metric, *values, flag in benchmark.compare(old, new, 10) if flag}
+        self.assertEqual(regressed, {'p50_ms'})
+
+
+class PerformanceMiddlewareTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.user = get_user_model().objects.create_user('bob', 'bob@example.com', 'pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(PERF_METRICS={'SAMPLE_RATE': 1.0, 'TOKEN': 'scrape'})
+    def test_sampled_request_gets_server_timing_and_metrics(self):
+        response = self.client.get('/user/')
+        timing = response['Server-Timing']
+        for phase in ('db;dur=', 'serialize;dur=', 'queries;desc=', 'total;dur='):
+            self.assertIn(phase, timing)
+
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        text = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{method="GET",status="200",view="rest_user_details"} 1', text)
+        self.assertIn('http_request_serialize_seconds_bucket{view="rest_user_details",le="+Inf"} 1', text)
+
+    @override_settings(PERF_METRICS={'TOKEN': 'scrape'})
+    def test_process_counters_are_exported(self):
+        pool = get_pool('metrics')
+        self.addCleanup(close_pool, 'metrics')
+        principal_cache.clear()
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_settings.JWT_ENCODE_HANDLER(
+            jwt_settings.JWT_PAYLOAD_HANDLER(self.user)))
+        self.client.get('/user/')
+        self.client.credentials()
+
+        text = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('# TYPE principal_cache_misses gauge', text)
+        self.assertIn('principal_cache_misses 1', text)
+        for name in ('login_throttle_checked', 'password_hash_rejected', 'token_revocation_checks'):
+            self.assertIn(f'\n{name} ', text)
+        self.assertIn(f'db_pool_max_size{{alias="metrics"}} {pool.options["MAX_SIZE"]}', text)
+
+    @override_settings(PERF_METRICS={'SAMPLE_RATE': 0.0})
+    def test_unsampled_request_is_only_counted(self):
+        response = self.client.get('/user/')
+        self.assertNotIn('Server-Timing', response)
+        text = registry.render()
+        self.assertIn('http_request_duration_seconds_count', text)
+        self.assertNotIn('http_request_db_seconds', text)
+
+
+class EmailOwnerSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username')
+
+    class Meta:
+        model = EmailAddress
+        fields = ('email', 'username')
+
+
+class QueryInspectorTest(TestCase):
+
+    def test_fingerprint_ignores_literals_and_list_lengths(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = \'x\' LIMIT 21'),
+                         fingerprint('SELECT  * FROM t WHERE id IN (%s) AND name = \'y\' LIMIT 1'))
+        self.assertEqual(fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)'),
+                         'INSERT INTO t (a, b) VALUES (?, ?), ...')
+
+    def test_n_plus_one_is_attributed_to_the_serializer_field(self):
+        for name in ('ann', 'ben', 'cid'):
+            user = get_user_model().objects.create_user(name, f'{name}@example.com', 'pass')
+            EmailAddress.objects.create(user=user, email=user.email)
+
+        with self.assertRaisesMessage(DuplicateQueriesError, '3x from EmailOwnerSerializer[].username'):
+            with assert_no_duplicate_queries():
+                EmailOwnerSerializer(EmailAddress.objects.all(), many=True).data
+        with assert_no_duplicate_queries():
+            EmailOwnerSerializer(EmailAddress.objects.select_related('user'), many=True).data
+
+    def test_middleware_modes(self):
+        get_user_model().objects.create_user('bob', 'bob@example.com', 'pass')
+        with override_settings(QUERY_INSPECTOR={'MODE': 'raise', 'THRESHOLD': 0}):
+            client = APIClient()
+            client.force_authenticate(get_user_model().objects.get(username='bob'))
+            with self.assertRaisesMessage(DuplicateQueriesError, 'GET /user/ ran'):
+                client.get('/user/')
+        # render the user again instead of serving it from the cache
+        cache.clear()
+        with override_settings(QUERY_INSPECTOR={'MODE': 'log', 'THRESHOLD': 0}):
+            client = APIClient()
+            client.force_authenticate(get_user_model().objects.get(username='bob'))
+            with self.assertLogs('core.middleware', 'WARNING') as logs:
+                self.assertEqual(client.get('/user/').status_code, 200)
+        self.assertIn('GET /user/ ran 3 queries', logs.output[0])
+
+
+class SignedTokensTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_token_checks_without_queries_and_is_single_use(self):
+        token = signed_tokens.make_token('email_confirm', 7, 42)
+        with self.assertNumQueries(0):
+            checked = signed_tokens.check_token(token, 'email_confirm', 'email_change')
+        self.assertEqual((checked.purpose, checked.subject, checked.object_id), ('email_confirm', 7, 42))
+
+        signed_tokens.consume(checked)
+        with self.assertRaises(serializers.ValidationError):
+            signed_tokens.consume(signed_tokens.check_token(token, 'email_confirm'))
+
+    def test_tampered_foreign_and_expired_tokens_are_rejected(self):
+        token = signed_tokens.make_token('password_reset', 7)
+        raw = bytearray(signed_tokens.b64url_decode(token))
+        raw[10] ^= 1
+        forged = signed_tokens.b64url(bytes(raw))
+        for bad, purpose in ((forged, 'password_reset'), (token, 'email_confirm'), ('x' * 10, 'password_reset')):
+            with self.assertRaises(serializers.ValidationError):
+                signed_tokens.check_token(bad, purpose)
+
+        with override_settings(SIGNED_TOKENS={'MAX_AGE': {'password_reset': -1}}):
+            with self.assertRaises(serializers.ValidationError):
+                signed_tokens.check_token(token, 'password_reset')
+
+        signed_tokens.revoke_before('password_reset', 7)
+        with self.assertRaises(serializers.ValidationError):
+            signed_tokens.check_token(token, 'password_reset')
+
+    def test_revocation_spares_tokens_made_later_in_the_same_second(self):
+        with mock.patch.object(signed_tokens.time, 'time', return_value=1600000000.2):
+            before = signed_tokens.make_token('password_reset', 7)
+            signed_tokens.revoke_before('password_reset', 7)
+        with mock.patch.object(signed_tokens.time, 'time', return_value=1600000000.7):
+            after = signed_tokens.make_token('password_reset', 7)
+            self.assertEqual(signed_tokens.check_token(after, 'password_reset').subject, 7)
+            with self.assertRaises(serializers.ValidationError):
+                signed_tokens.check_token(before, 'password_reset')
+
+    def test_version_1_tokens_still_verify(self):
+        secret = signed_tokens.secrets()[0]
+        payload = signed_tokens.PAYLOADS[1].pack(1, signed_tokens.PURPOSES['email_confirm'],
+                                                 signed_tokens.key_id(secret), int(time.time()), 7, 42)
+        token = signed_tokens.b64url(payload + signed_tokens.sign('email_confirm', secret, payload))
+        self.assertEqual(signed_tokens.check_token(token, 'email_confirm').object_id, 42)
+
+    def test_retired_secret_still_verifies(self):
+        with override_settings(SIGNED_TOKENS={'SECRETS': ['old']}):
+            token = signed_tokens.make_token('email_change', 1, 2)
+        with override_settings(SIGNED_TOKENS={'SECRETS': ['new', 'old']}):
+            self.assertEqual(signed_tokens.check_token(token, 'email_change').object_id, 2)
+        with override_settings(SIGNED_TOKENS={'SECRETS': ['new']}):
+            with self.assertRaises(serializers.ValidationError):
+                signed_tokens.check_token(token, 'email_change')
+
+
+class FastJSONTest(TestCase):
+    payload = {
+        'when': datetime.datetime(2020, 3, 13, 17, 8, 1, 123456, tzinfo=datetime.timezone.utc),
+        'day': datetime.date(2020, 3, 13),
+        'price': decimal.Decimal('1.50'),
+        'label': _lazy('Car'),
+        1: 'non string key',
+        'text': 'line\u2028separator',
+        'big': 2 ** 70,
+    }
+
+    def test_output_matches_drf_with_and_without_orjson(self):
+        expected = JSONRenderer().render(self.payload)
+        self.assertEqual(renderers.FastJSONRenderer().render(self.payload), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.payload), expected)
+        self.assertEqual(renderers.FastJSONRenderer().render({'a': [1]}, 'application/json; indent=2'),
+                         JSONRenderer().render({'a': [1]}, 'application/json; indent=2'))
+
+    def test_non_finite_floats_are_refused_like_drf(self):
+        for value in (float('nan'), float('inf'), -float('inf')):
+            with self.assertRaises(ValueError):
+                JSONRenderer().render({'a': [value]})
+            with self.assertRaises(ValueError):
+                renderers.FastJSONRenderer().render({'a': [value]})
+        self.assertEqual(renderers.FastJSONRenderer().render({'a': None, 'b': 1.5}), b'{"a":null,"b":1.5}')
+
+    def test_parser_falls_back_to_drf(self):
+        parser = parsers.FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO(b'{"big": 123456789012345678901234}')),
+                         {'big': 123456789012345678901234})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"a": NaN}'))
+
+
+def add_sqlite_database(alias, name, **options):
+    # stand-in for a database of DATABASES, e.g. a replica
+    connections.databases[alias] = dict({'ENGINE': 'django.db.backends.sqlite3', 'NAME': name}, **options)
+    connections.ensure_defaults(alias)
+    connections.prepare_test_settings(alias)
+    return connections[alias]
+
+
+def remove_database(alias):
+    connections[alias].close()
+    delattr(connections._connections, alias)
+    del connections.databases[alias]
+    close_pool(alias)
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_connections_are_shared_between_threads(self):
+        add_sqlite_database('pooled', os.path.join(self.directory.name, 'pooled.sqlite3'),
+                            ENGINE='core.db.backends.sqlite3', POOL={'MAX_SIZE': 1, 'TIMEOUT': 0.1})
+        self.addCleanup(remove_database, 'pooled')
+        wrapper = connections['pooled']
+        wrapper.ensure_connection()
+        first = wrapper.connection
+
+        def in_thread(results):
+            try:
+                connections['pooled'].ensure_connection()
+                results.append(connections['pooled'].connection)
+                connections['pooled'].close()
+            except PoolTimeout as e:
+                results.append(e)
+
+        results = []
+        thread = threading.Thread(target=in_thread, args=(results,))
+        thread.start()
+        thread.join()
+        self.assertIsInstance(results[0], PoolTimeout)
+
+        wrapper.close()
+        thread = threading.Thread(target=in_thread, args=(results,))
+        thread.start()
+        thread.join()
+        self.assertIs(results[1], first)
+        self.assertEqual(wrapper.pool.stats(), {'size': 1, 'idle': 1, 'max_size': 1})
+
+    def test_broken_old_and_dirty_connections(self):
+        pool = ConnectionPool('test', CHECK_AFTER=0)
+        connect = lambda: sqlite3.connect(':memory:', check_same_thread=False)  # noqa: E731
+
+        connection = pool.acquire(connect)
+        connection.close()
+        pool.release(connection)
+        replacement = pool.acquire(connect)
+        self.assertIsNot(replacement, connection)
+        self.assertEqual(pool.stats()['size'], 1)
+
+        replacement.execute('CREATE TABLE t (x int)')
+        replacement.execute('INSERT INTO t VALUES (1)')
+        pool.release(replacement)
+        self.assertFalse(replacement.in_transaction)
+        self.assertEqual(pool.acquire(connect).execute('SELECT count(*) FROM t').fetchone(), (0,))
+
+        pool.options['MAX_AGE'] = 0
+        pool.release(replacement)
+        self.assertEqual(pool.stats(), {'size': 0, 'idle': 0, 'max_size': 10})
+
+    def test_connections_of_ended_threads_are_reclaimed(self):
+        pool = ConnectionPool('test', MAX_SIZE=1, TIMEOUT=0.1)
+        connect = lambda: sqlite3.connect(':memory:', check_same_thread=False)  # noqa: E731
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(pool.acquire(connect)))
+        thread.start()
+        thread.join()
+
+        connection = pool.acquire(connect)
+        self.assertIsNot(connection, taken[0])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            taken[0].execute('SELECT 1')
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(connect)
+        self.assertEqual(pool.stats(), {'size': 1, 'idle': 0, 'max_size': 1})
+
+    def test_in_memory_sqlite_is_not_pooled(self):
+        add_sqlite_database('memory', ':memory:', ENGINE='core.db.backends.sqlite3',
+                            POOL={'MAX_SIZE': 1, 'TIMEOUT': 0.1})
+        self.addCleanup(remove_database, 'memory')
+
+        def in_thread(errors):
+            try:
+                connections['memory'].cursor().execute('SELECT 1')
+            except PoolTimeout as e:
+                errors.append(e)
+            finally:
+                connections['memory'].close()
+
+        errors = []
+        for _ in range(3):
+            thread = threading.Thread(target=in_thread, args=(errors,))
+            thread.start()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(connections['memory'].pool.stats()['size'], 0)
+
+
+def replica_names(request):
+    user_id = int(request.GET['id'])
+    if 'as_user' in request.GET:
+        pin_user(user_id)
+    names = [User.objects.get(pk=user_id).first_name]
+    if request.method == 'POST':
+        User.objects.filter(pk=user_id).update(last_name='Anderson')
+        names.append(User.objects.get(pk=user_id).first_name)
+    with transaction.atomic():
+        names.append(User.objects.get(pk=user_id).first_name)
+    return JsonResponse(names, safe=False)
+
+
+@override_settings(DATABASE_REPLICATION={'REPLICAS': ['replica']})
+class ReplicaRouterTest(TransactionTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        replica = add_sqlite_database('replica', os.path.join(directory.name, 'replica.sqlite3'))
+        self.addCleanup(remove_database, 'replica')
+        with replica.schema_editor() as editor:
+            editor.create_model(User)
+        self.user = User.objects.create(username='neo', first_name='fresh')
+        # the replica lags behind
+        User.objects.using('replica').bulk_create([User(pk=self.user.pk, username='neo', first_name='stale')])
+        self.middleware = ReplicaPinMiddleware(replica_names)
+        self.factory = RequestFactory()
+        cache.clear()
+
+    def names(self, method, **params):
+        request = getattr(self.factory, method)(f'/?id={self.user.pk}&' + '&'.join(params))
+        request.COOKIES.update(self.cookies)
+        response = self.middleware(request)
+        return response, json.loads(response.content)
+
+    def test_reads_are_pinned_to_the_primary_after_a_write(self):
+        self.cookies = {}
+        response, names = self.names('get')
+        self.assertEqual(names, ['stale', 'fresh'])
+        self.assertNotIn('db_pin', response.cookies)
+
+        response, names = self.names('post')
+        self.assertEqual(names, ['stale', 'fresh', 'fresh'])
+        self.assertEqual(response.cookies['db_pin']['max-age'], 15)
+
+        self.cookies = {'db_pin': '1'}
+        self.assertEqual(self.names('get')[1], ['fresh', 'fresh'])
+        # outside of requests
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'fresh')
+
+    def test_users_read_their_writes_from_any_client(self):
+        self.cookies = {}
+        self.names('post', as_user=1)
+        self.assertEqual(self.names('get')[1], ['stale', 'fresh'])
+        self.assertEqual(self.names('get', as_user=1)[1], ['fresh', 'fresh'])
+
+    def test_replicas_are_not_migrated_and_optional(self):
+        self.assertFalse(router.allow_migrate('replica', 'users'))
+        self.assertTrue(router.allow_migrate('default', 'users'))
+        with override_settings(DATABASE_REPLICATION={'REPLICAS': []}):
+            with self.assertRaises(MiddlewareNotUsed):
+                ReplicaPinMiddleware(replica_names)
+
+
+class TieredCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.tiered = TieredCache('', {'OPTIONS': {
+            'SHARED': 'default', 'LOCAL_MAX_ENTRIES': 2, 'LOCAL_TIMEOUT': 60, 'LOCK_POLL': 0.01}})
+
+    def test_reads_are_served_locally_and_batched(self):
+        self.tiered.set('a', [1])
+        cache.set('b', 2)
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            value = self.tiered.get('a')
+            value.append(2)
+            self.assertEqual(self.tiered.get('a'), [1])
+            get.assert_not_called()
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(self.tiered.get_many(['a', 'b', 'c']), {'a': [1], 'b': 2})
+            get_many.assert_called_once_with(['b', 'c'], version=None)
+
+        # bounded, 'a' was used least recently
+        self.tiered.get('b')
+        self.tiered.set('d', 4)
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get:
+            self.tiered.get('b')
+            get.assert_not_called()
+            self.tiered.get('a')
+            get.assert_called_once()
+
+        self.tiered.incr('b')
+        self.assertEqual(self.tiered.get('b'), 3)
+        self.tiered.delete('d')
+        self.assertIsNone(self.tiered.get('d'))
+
+    def test_other_processes_writes_show_after_local_timeout(self):
+        self.tiered.set('key', 'old')
+        cache.set('key', 'new')
+        self.assertEqual(self.tiered.get('key'), 'old')
+        with mock.patch('core.cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(self.tiered.get('key'), 'new')
+
+    def test_get_or_set_recomputes_once(self):
+        compute = mock.Mock(return_value='fresh')
+        self.assertEqual(self.tiered.get_or_set('key', compute, 60), 'fresh')
+        self.assertEqual(self.tiered.get_or_set('key', compute, 60), 'fresh')
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(self.tiered.get('key'), 'fresh')
+
+        # due: recomputed by whoever takes the lock, the others keep the old value
+        cache.set('key', Recomputed('old', time.time() - 1, 0.1))
+        self.tiered.clear_local()
+        cache.add('key:recompute', 1)
+        self.assertEqual(self.tiered.get_or_set('key', compute, 60), 'old')
+        cache.delete('key:recompute')
+        self.assertEqual(self.tiered.get_or_set('key', compute, 60), 'fresh')
+        self.assertEqual(compute.call_count, 2)
+
+        # missing while another process computes it: wait for its value
+        self.tiered.delete('key')
+        cache.add('key:recompute', 1)
+        threading.Timer(0.05, cache.set, ('key', Recomputed('theirs', None, 0.1))).start()
+        self.assertEqual(self.tiered.get_or_set('key', compute, 60), 'theirs')
+        self.assertEqual(compute.call_count, 2)
+
+    def test_values_are_recomputed_before_they_expire(self):
+        self.tiered.options['EARLY_RECOMPUTE'] = 1.0
+        entry = Recomputed('value', time.time() + 1, 0.5)
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            self.assertFalse(self.tiered.expires_early(entry))
+        with mock.patch('core.cache.random.random', return_value=0.9):
+            self.assertTrue(self.tiered.expires_early(entry))
+        self.assertFalse(self.tiered.expires_early(Recomputed('value', None, 10)))
+
+
+class StartupTest(SimpleTestCase):
+
+    @override_settings(STARTUP={'WARM_UP': False})
+    def test_no_warm_up_by_default(self):
+        with mock.patch('core.startup.warm_up') as warm:
+            application_loaded()
+        warm.assert_not_called()
+
+    @override_settings(STARTUP={'WARM_UP': True, 'FREEZE_GC': False})
+    def test_warm_up_when_the_application_is_loaded(self):
+        with mock.patch('core.startup.warm_up') as warm:
+            application_loaded()
+        warm.assert_called_once_with(freeze_gc=False)
+
+    def test_warm_up_closes_what_it_opened_and_freezes(self):
+        with mock.patch('core.startup.gc') as gc, mock.patch('core.startup.close_pool') as close_pool:
+            warm_up()
+        self.assertEqual(sorted(call.args[0] for call in close_pool.call_args_list), sorted(connections))
+        gc.collect.assert_called_once_with()
+        gc.freeze.assert_called_once_with()
+
+        with mock.patch('core.startup.gc') as gc:
+            warm_up(freeze_gc=False)
+        gc.freeze.assert_not_called()
+
+
+class AuditLogTest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'auth_events.jsonl')
+        settings = override_settings(AUTH_AUDIT={'ASYNC': False, 'FALLBACK_FILE': self.path})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.log = AuditLog()
+
+    def test_event_carries_the_request(self):
+        request = RequestFactory().post('/login/', REMOTE_ADDR='10.0.0.7', HTTP_USER_AGENT='curl/7.68')
+        self.log.record(AuthEvent.LOGIN_FAILED, request=request, identifier='bob', reason='password')
+        event = AuthEvent.objects.get()
+        self.assertEqual((event.ip, event.user_agent, event.identifier, json.loads(event.data)),
+                         ('10.0.0.7', 'curl/7.68', 'bob', {'reason': 'password'}))
+
+    def test_failing_database_falls_back_to_the_file_until_replayed(self):
+        user = User.objects.create_user('bob')
+        with mock.patch.object(AuthEvent.objects, 'bulk_create', side_effect=OperationalError) as bulk_create, \
+                self.assertLogs('core.audit', 'ERROR'):
+            self.log.record(AuthEvent.LOGIN, user.pk)
+            self.log.record(AuthEvent.LOGOUT, user.pk)
+        # the second event did not wait for the database again
+        self.assertEqual(bulk_create.call_count, 1)
+        self.assertFalse(AuthEvent.objects.exists())
+
+        with open(self.path, 'a') as file:
+            file.write('{"event": "login", "created": "cut sho\n')
+        call_command('replay_auth_events', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(list(AuthEvent.objects.for_user(user.pk).order_by('created').values_list('event', flat=True)),
+                         [AuthEvent.LOGIN, AuthEvent.LOGOUT])
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_slow_insert_sends_the_next_batches_to_the_file(self):
+        with override_settings(AUTH_AUDIT={'ASYNC': False, 'FALLBACK_FILE': self.path, 'SLOW_SECONDS': -1}), \
+                self.assertLogs('core.audit', 'WARNING'):
+            self.log.record(AuthEvent.LOGIN, None)
+            self.log.record(AuthEvent.LOGOUT, None)
+        self.assertEqual(AuthEvent.objects.get().event, AuthEvent.LOGIN)
+        with open(self.path) as file:
+            self.assertEqual([json.loads(line)['event'] for line in file], [AuthEvent.LOGOUT])
+
+
+class AuditLogThreadTest(TransactionTestCase):
+
+    def test_events_are_inserted_in_batches_after_the_request(self):
+        log = AuditLog()
+        with override_settings(AUTH_AUDIT={'BATCH_SIZE': 3, 'FLUSH_INTERVAL': 0.2}), \
+                mock.patch.object(AuthEvent.objects, 'bulk_create', wraps=AuthEvent.objects.bulk_create) as bulk_create:
+            for _ in range(7):
+                log.record(AuthEvent.LOGIN, None)
+            log.stop()
+        self.assertEqual(AuthEvent.objects.count(), 7)
+        self.assertLessEqual(max(len(call.args[0]) for call in bulk_create.call_args_list), 3)
+        self.assertGreaterEqual(bulk_create.call_count, 3)
+
+    def test_full_queue_goes_to_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'auth_events.jsonl')
+            log = AuditLog()
+            with override_settings(AUTH_AUDIT={'QUEUE_SIZE': 1, 'FALLBACK_FILE': path}), \
+                    mock.patch.object(log, 'run'):
+                log.record(AuthEvent.LOGIN, None)
+                log.record(AuthEvent.LOGOUT, None)
+            with open(path) as file:
+                self.assertEqual([json.loads(line)['event'] for line in file], [AuthEvent.LOGOUT])
+
+
+class PrincipalCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        principal_cache.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+
+    def test_user_loaded_before_a_ban_is_never_served(self):
+        version = principal_cache.version(self.user.pk)
+        stale = User.objects.select_related('profile').get(pk=self.user.pk)
+        # the ban commits between the load and the set of another request
+        self.user.is_active = False
+        self.user.save()
+        principal_cache.set(stale, version)
+        self.assertIsNone(principal_cache.get(self.user.pk, principal_cache.version(self.user.pk)))
+
+    def test_disabling_the_user_applies_to_the_next_request(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_settings.JWT_ENCODE_HANDLER(
+            jwt_settings.JWT_PAYLOAD_HANDLER(self.user)))
+        self.assertEqual(client.get('/user/').status_code, 200)
+        self.assertEqual(principal_cache.stats()['size'], 1)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(client.get('/user/').status_code, 401)
+
+    def test_hits_misses_and_the_shared_level(self):
+        version = principal_cache.version(self.user.pk)
+        self.assertIsNone(principal_cache.get(self.user.pk, version))
+        principal_cache.set(User.objects.select_related('profile').get(pk=self.user.pk), version)
+        self.assertEqual(principal_cache.get(self.user.pk, version).username, 'bob')
+
+        # another process only finds it in the shared cache
+        other = PrincipalCache()
+        with self.assertNumQueries(0):
+            user = other.get(self.user.pk, other.version(self.user.pk))
+        self.assertEqual((user.username, user.profile.user_id), ('bob', self.user.pk))
+        self.assertEqual(other.stats()['size'], 1)
+        self.assertEqual({name: value for name, value in principal_cache.stats().items() if name != 'max_entries'},
+                         {'hits': 1, 'local_hits': 1, 'misses': 1, 'size': 1})
+        self.assertEqual((other.hits, other.local_hits, other.misses), (1, 0, 0))
+
+    @override_settings(PRINCIPAL_CACHE={'MAX_ENTRIES': 2})
+    def test_local_level_keeps_max_entries(self):
+        users = [self.user] + [User.objects.create_user(f'user{index}') for index in range(2)]
+        for user in users:
+            principal_cache.set(user, principal_cache.version(user.pk))
+        self.assertEqual(principal_cache.stats()['size'], 2)
+
+        # the least recently used one is left in the shared cache only
+        version = principal_cache.version(self.user.pk)
+        self.assertEqual(principal_cache.get(self.user.pk, version).pk, self.user.pk)
+        self.assertEqual((principal_cache.hits, principal_cache.local_hits), (1, 0))
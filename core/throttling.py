@@ -0,0 +1,316 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+
+LOGIN_THROTTLE_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'throttle:login',
+    # failed attempts allowed per sliding window for each key
+    'RATES': {
+        'ip': '30/min',
+        'username': '5/min',
+        'email': '5/min',
+        'phone': '5/min',
+    },
+    # first lockout, doubled for each new lockout of the same key
+    'LOCKOUT_SECONDS': 60,
+    'MAX_LOCKOUT_SECONDS': 3600,
+    'STRIKES_TIMEOUT': 24 * 3600,
+    # how long to stay on the in-process store after a cache error
+    'FALLBACK_SECONDS': 30,
+    'LOCAL_MAX_ENTRIES': 10000,
+}
+
+DURATIONS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def login_throttle_settings():
+    options = dict(LOGIN_THROTTLE_DEFAULTS)
+    options.update(getattr(settings, 'LOGIN_THROTTLE', {}))
+    return options
+
+
+def parse_rate(rate):
+    """
+    "5/min" -> (5, 60)
+    """
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period]
+
+
+class CacheUnavailable(Exception):
+    pass
+
+
+class LocalStore:
+    """
+    Small thread safe subset of the django cache API kept in process memory,
+    used while the shared cache is unreachable.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        value = self._data.get(key)
+        if value is None:
+            return None
+        if value[1] <= now:
+            del self._data[key]
+            return None
+        return value[0]
+
+    def _set(self, key, value, timeout, now):
+        if len(self._data) >= self.max_entries:
+            self._data = {k: v for k, v in self._data.items() if v[1] > now}
+            if len(self._data) >= self.max_entries:
+                self._data.clear()
+        self._data[key] = (value, now + timeout)
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            values = {key: self._get(key, now) for key in keys}
+        return {key: value for key, value in values.items() if value is not None}
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._set(key, value, timeout, time.time())
+
+    def incr_with_timeout(self, key, timeout):
+        now = time.time()
+        with self._lock:
+            value = (self._get(key, now) or 0) + 1
+            expires = self._data[key][1] if key in self._data else now + timeout
+            self._set(key, value, expires - now, now)
+        return value
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheStore:
+    """
+    Adapter over a django cache raising `CacheUnavailable` on any backend error.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_many(self, keys):
+        try:
+            return self.cache.get_many(keys)
+        except Exception as error:
+            raise CacheUnavailable(error)
+
+    def set(self, key, value, timeout):
+        try:
+            self.cache.set(key, value, timeout)
+        except Exception as error:
+            raise CacheUnavailable(error)
+
+    def incr_with_timeout(self, key, timeout):
+        # memcached can't incr a missing key, and an incr failing right after
+        # the add means the server is gone
+        try:
+            self.cache.add(key, 0, timeout)
+            return self.cache.incr(key)
+        except Exception as error:
+            raise CacheUnavailable(error)
+
+    def delete_many(self, keys):
+        try:
+            self.cache.delete_many(keys)
+        except Exception as error:
+            raise CacheUnavailable(error)
+
+
+class SlidingWindowLimiter:
+    """
+    Failed-attempt limiter over a sliding window approximated by two fixed
+    buckets. Keys over their rate are locked out, and every new lockout of
+    the same key doubles its length.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._degraded_until = 0
+        self._local = None
+        self.metrics = dict.fromkeys(
+            ('checked', 'rejected', 'failures', 'lockouts', 'resets', 'fallbacks'), 0)
+
+    @property
+    def options(self):
+        return login_throttle_settings()
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LocalStore(self.options['LOCAL_MAX_ENTRIES'])
+        return self._local
+
+    def store(self):
+        if time.time() < self._degraded_until:
+            return self.local
+        return CacheStore(self.options['CACHE_ALIAS'])
+
+    def run(self, operation):
+        store = self.store()
+        try:
+            return operation(store)
+        except CacheUnavailable:
+            with self._lock:
+                self.metrics['fallbacks'] += 1
+                self._degraded_until = time.time() + self.options['FALLBACK_SECONDS']
+            return operation(self.local)
+
+    def count(self, name, value):
+        with self._lock:
+            self.metrics[name] += value
+
+    def key(self, scope, ident):
+        digest = hashlib.md5(ident.encode()).hexdigest()
+        return f"{self.options['KEY_PREFIX']}:{scope}:{digest}"
+
+    def windows(self, scope, now):
+        limit, window = parse_rate(self.options['RATES'][scope])
+        return limit, window, int(now // window)
+
+    def weighted_count(self, counts, key, bucket, window, now):
+        previous = counts.get(f'{key}:{bucket - 1}', 0)
+        current = counts.get(f'{key}:{bucket}', 0)
+        return previous * (1 - (now % window) / window) + current
+
+    def check(self, idents):
+        """
+        Return the seconds to wait before another attempt is allowed for any of
+        `idents` (a list of `(scope, ident)`), or None if they are all allowed.
+        """
+        idents = [(scope, ident) for scope, ident in idents if ident]
+        now = time.time()
+        keys, plan = [], []
+        for scope, ident in idents:
+            key = self.key(scope, ident)
+            limit, window, bucket = self.windows(scope, now)
+            keys += [f'{key}:lock', f'{key}:{bucket}', f'{key}:{bucket - 1}']
+            plan.append((key, limit, window, bucket))
+
+        counts = self.run(lambda store: store.get_many(keys)) if keys else {}
+        wait = None
+        for key, limit, window, bucket in plan:
+            locked_until = counts.get(f'{key}:lock')
+            if locked_until and locked_until > now:
+                wait = max(wait or 0, locked_until - now)
+            elif self.weighted_count(counts, key, bucket, window, now) >= limit:
+                wait = max(wait or 0, window - now % window)
+
+        self.count('checked', 1)
+        if wait is not None:
+            self.count('rejected', 1)
+        return wait
+
+    def hit(self, idents):
+        """
+        Record a failed attempt for every `(scope, ident)` of `idents`.
+        """
+        idents = [(scope, ident) for scope, ident in idents if ident]
+        self.count('failures', 1)
+        self.run(lambda store: self._hit(store, idents))
+
+    def _hit(self, store, idents):
+        options = self.options
+        now = time.time()
+        for scope, ident in idents:
+            key = self.key(scope, ident)
+            limit, window, bucket = self.windows(scope, now)
+            current = store.incr_with_timeout(f'{key}:{bucket}', window * 2)
+            previous = store.get_many([f'{key}:{bucket - 1}']).get(f'{key}:{bucket - 1}', 0)
+            if self.weighted_count({f'{key}:{bucket - 1}': previous, f'{key}:{bucket}': current},
+                                   key, bucket, window, now) < limit:
+                continue
+            strikes = store.incr_with_timeout(f'{key}:strikes', options['STRIKES_TIMEOUT'])
+            lockout = min(options['LOCKOUT_SECONDS'] * 2 ** (strikes - 1),
+                          options['MAX_LOCKOUT_SECONDS'])
+            store.set(f'{key}:lock', now + lockout, lockout)
+            self.count('lockouts', 1)
+
+    def reset(self, idents):
+        """
+        Forget the failures and lockouts of `idents`, e.g. after a successful login.
+        """
+        idents = [(scope, ident) for scope, ident in idents if ident]
+        now = time.time()
+        keys = []
+        for scope, ident in idents:
+            key = self.key(scope, ident)
+            limit, window, bucket = self.windows(scope, now)
+            keys += [f'{key}:lock', f'{key}:strikes', f'{key}:{bucket}', f'{key}:{bucket - 1}']
+        if keys:
+            self.count('resets', 1)
+            self.run(lambda store: store.delete_many(keys))
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, degraded=time.time() < self._degraded_until)
+
+
+login_limiter = SlidingWindowLimiter()
+
+
+def normalize(value):
+    if not isinstance(value, str):
+        return None
+    return value.strip().lower() or None
+
+
+def normalize_phone(value):
+    # '+20 100 123 4567' and '+201001234567' share their limits
+    if not isinstance(value, str):
+        return None
+    return ''.join(char for char in value if char.isdigit()) or None
+
+
+def login_idents(request):
+    """
+    The `(scope, ident)` pairs a login attempt is limited by. The IP is read
+    as REST_FRAMEWORK['NUM_PROXIES'] says, never from X-Forwarded-For alone.
+    """
+    data = request.data if hasattr(request.data, 'get') else {}
+    return [
+        ('ip', BaseThrottle().get_ident(request)),
+        ('username', normalize(data.get('username'))),
+        ('email', normalize(data.get('email'))),
+        ('phone', normalize_phone(data.get('phone_number'))),
+    ]
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    Rejects login attempts for a locked or over-limit IP, username or e-mail
+    before the credentials are looked up or hashed. Wrong credentials are
+    recorded by the view through `login_limiter.hit()`.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_seconds = login_limiter.check(login_idents(request))
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
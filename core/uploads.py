@@ -0,0 +1,168 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+
+
+UPLOADS_DEFAULTS = {
+    'BACKEND': 'core.uploads.FileSystemChunkStorage',
+    # keep it out of MEDIA_ROOT, partial files must not be served
+    'LOCATION': os.path.join(tempfile.gettempdir(), 'uploads'),
+    'MAX_SIZE': 10 * 1024 * 1024,
+    # bytes read from the request stream at a time
+    'READ_SIZE': 64 * 1024,
+    'EXPIRY_HOURS': 24,
+}
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def uploads_settings():
+    options = dict(UPLOADS_DEFAULTS)
+    options.update(getattr(settings, 'UPLOADS', {}))
+    return options
+
+
+class ChunkStorage:
+    """
+    Where the bytes of unfinished uploads are kept, one object per upload key.
+    """
+
+    def append(self, key, offset, chunks):
+        """
+        Write the byte strings of `chunks` at `offset`, dropping anything
+        stored after it. Returns the number of bytes written.
+        """
+        raise NotImplementedError
+
+    def truncate(self, key, size):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class FileSystemChunkStorage(ChunkStorage):
+
+    def __init__(self, location):
+        self.location = location
+
+    def path(self, key):
+        return os.path.join(self.location, f"{key}.part")
+
+    def append(self, key, offset, chunks):
+        os.makedirs(self.location, exist_ok=True)
+        path = self.path(key)
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as file:
+            file.truncate(offset)
+            file.seek(offset)
+            written = 0
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+        return written
+
+    def truncate(self, key, size):
+        if os.path.exists(self.path(key)):
+            os.truncate(self.path(key), size)
+
+    def size(self, key):
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return 0
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def get_chunk_storage():
+    options = uploads_settings()
+    return import_string(options['BACKEND'])(options['LOCATION'])
+
+
+def parse_content_range(header, max_size):
+    """
+    `(start, end, total)` of a `Content-Range: bytes start-end/total` header,
+    `end` inclusive, or None when it is missing or invalid.
+    """
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        return None
+    start, end, total = map(int, match.groups())
+    if start > end or end >= total or total > max_size:
+        return None
+    return start, end, total
+
+
+def read_stream(stream, length, read_size):
+    """
+    Yield exactly `length` bytes of `stream` in pieces of `read_size`.
+    """
+    while length > 0:
+        chunk = stream.read(min(read_size, length))
+        if not chunk:
+            raise EOFError("request body is shorter than announced")
+        length -= len(chunk)
+        yield chunk
+
+
+def file_sha256(file, read_size=64 * 1024):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(read_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadTooLarge(exceptions.APIException):
+    status_code = 413
+    default_detail = _('The uploaded file is too large.')
+    default_code = 'upload_too_large'
+
+
+class ChecksumUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every multipart file straight to a temporary file and sets
+    `sha256` on it from the chunks as they arrive. A file growing past
+    `max_size` (UPLOADS['MAX_SIZE'] by default) stops the upload without
+    reading the rest of the body and sets `too_large`.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = uploads_settings()['MAX_SIZE'] if max_size is None else max_size
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_size:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
@@ -0,0 +1,171 @@
+"""
+Verification of the tokens of this app from their public keys only.
+
+Nothing here needs django settings, the database or a shared secret: other
+services can build a `TokenVerifier` from our `/.well-known/jwks.json`.
+"""
+import base64
+import functools
+import json
+import threading
+import time
+import urllib.request
+
+import jwt
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from jwt.algorithms import Algorithm, RSAAlgorithm
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def b64url_decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class EdDSAAlgorithm(Algorithm):
+    """
+    Ed25519 signatures (RFC 8037) for PyJWT 1.x, which only ships RSA/EC.
+    """
+
+    def prepare_key(self, key):
+        if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            return key
+        key = key.encode() if isinstance(key, str) else key
+        if b'PRIVATE' in key:
+            return serialization.load_pem_private_key(key, None, default_backend())
+        return serialization.load_pem_public_key(key, default_backend())
+
+    def sign(self, msg, key):
+        return key.sign(msg)
+
+    def verify(self, msg, key, sig):
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            key = key.public_key()
+        try:
+            key.verify(sig, msg)
+            return True
+        except InvalidSignature:
+            return False
+
+    @staticmethod
+    def to_jwk(key):
+        raw = key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        return json.dumps({'kty': 'OKP', 'crv': 'Ed25519', 'x': b64url(raw)})
+
+    @staticmethod
+    def from_jwk(jwk):
+        jwk = json.loads(jwk) if isinstance(jwk, str) else jwk
+        if jwk.get('kty') != 'OKP' or jwk.get('crv') != 'Ed25519':
+            raise jwt.InvalidKeyError("not an Ed25519 key")
+        return ed25519.Ed25519PublicKey.from_public_bytes(b64url_decode(jwk['x']))
+
+
+if 'EdDSA' not in jwt.algorithms.get_default_algorithms():
+    try:
+        jwt.register_algorithm('EdDSA', EdDSAAlgorithm())
+    except ValueError:
+        # already registered by an earlier import
+        pass
+
+
+ALGORITHMS = {
+    'RS256': RSAAlgorithm(RSAAlgorithm.SHA256),
+    'RS384': RSAAlgorithm(RSAAlgorithm.SHA384),
+    'RS512': RSAAlgorithm(RSAAlgorithm.SHA512),
+    'EdDSA': EdDSAAlgorithm(),
+}
+DEFAULT_ALGORITHMS = {'RSA': 'RS256', 'OKP': 'EdDSA'}
+
+
+@functools.lru_cache(maxsize=256)
+def parse_header(segment):
+    """
+    `(kid, alg)` of an encoded JOSE header. Every token signed with the same
+    key has the same header segment, so this is parsed once per key. Both
+    must be strings: the kid is used as a dict key.
+    """
+    try:
+        header = json.loads(b64url_decode(segment))
+    except (ValueError, TypeError):
+        raise jwt.DecodeError("Invalid header")
+    if not isinstance(header, dict):
+        raise jwt.DecodeError("Invalid header")
+    kid, algorithm = header.get('kid'), header.get('alg')
+    if not isinstance(kid, str) or not isinstance(algorithm, str):
+        raise jwt.DecodeError("Invalid header")
+    return kid, algorithm
+
+
+class TokenVerifier:
+    """
+    Verifies tokens with the public keys of a JWKS, kept parsed per `kid`.
+    With `jwks_url` an unknown kid refetches the set (at most every
+    `min_refetch` seconds), which picks up rotated keys.
+    """
+
+    def __init__(self, jwks=None, jwks_url=None, min_refetch=30, timeout=5):
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._fetched = None
+        self.jwks_url = jwks_url
+        self.min_refetch = min_refetch
+        self.timeout = timeout
+        if jwks is not None:
+            self.load(jwks)
+
+    def load(self, jwks):
+        keys = {}
+        for jwk in jwks.get('keys', ()):
+            if jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+                continue
+            algorithm = jwk.get('alg') or DEFAULT_ALGORITHMS.get(jwk.get('kty'))
+            if algorithm not in ALGORITHMS:
+                continue
+            current = self._keys.get(jwk['kid'])
+            if current is not None and current[0] == algorithm:
+                keys[jwk['kid']] = current
+            else:
+                keys[jwk['kid']] = (algorithm, ALGORITHMS[algorithm].from_jwk(json.dumps(jwk)))
+        with self._lock:
+            self._keys = keys
+
+    def fetch(self):
+        # counted from the attempt, so a JWKS endpoint that is down is not
+        # requested again for every token
+        self._fetched = time.monotonic()
+        try:
+            with urllib.request.urlopen(self.jwks_url, timeout=self.timeout) as response:
+                jwks = json.load(response)
+        except (OSError, ValueError) as error:
+            raise jwt.InvalidTokenError(f"Cannot fetch the key set: {error}") from error
+        if not isinstance(jwks, dict):
+            raise jwt.InvalidTokenError("Cannot fetch the key set: not a JWKS")
+        self.load(jwks)
+
+    def key(self, kid):
+        entry = self._keys.get(kid)
+        if entry is None and self.jwks_url is not None:
+            if self._fetched is None or time.monotonic() - self._fetched >= self.min_refetch:
+                self.fetch()
+                entry = self._keys.get(kid)
+        return entry
+
+    def kids(self):
+        return sorted(self._keys)
+
+    def decode(self, token, audience=None, issuer=None, leeway=0, verify_exp=True):
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        kid, algorithm = parse_header(token.split('.', 1)[0])
+        entry = self.key(kid)
+        if entry is None:
+            raise jwt.InvalidTokenError("Unknown key id")
+        if algorithm != entry[0]:
+            raise jwt.InvalidAlgorithmError("Algorithm does not match the key")
+        return jwt.decode(token, entry[1], algorithms=[entry[0]], audience=audience, issuer=issuer,
+                          leeway=leeway, options={'verify_exp': verify_exp})
@@ -1,3 +1,71 @@
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions, permissions, views
+from rest_framework.response import Response
 
-# Create your views here.
+from .hashers import AdmissionRefused, admission_enabled
+from .keys import jwt_keys_settings, key_set
+from .metrics import perf_settings, registry
+
+
+class HashingBusy(exceptions.APIException):
+    status_code = 503
+    default_detail = _('Server is busy, please try again.')
+    default_code = 'hashing_busy'
+
+
+class HashAdmissionMixin:
+    """
+    Puts the password hashing of the request under the admission limit of
+    `core.hashers.hash_admission` when the view is built with
+    `as_view(limit_hashing=True)`: over the limit the request gets a 503.
+    """
+    limit_hashing = False
+
+    def initial(self, request, *args, **kwargs):
+        self.admission_token = admission_enabled.set(self.limit_hashing)
+        super().initial(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, AdmissionRefused):
+            exc = HashingBusy()
+        response = super().handle_exception(exc)
+        if isinstance(exc, HashingBusy):
+            response['Retry-After'] = '1'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'admission_token', None)
+        if token is not None:
+            admission_enabled.reset(token)
+            self.admission_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class JWKSView(views.APIView):
+    """
+    Public keys that verify our tokens, for services that check them
+    locally with `core.verifier.TokenVerifier`.
+    """
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request, *args, **kwargs):
+        response = Response(key_set().jwks())
+        patch_cache_control(response, public=True, max_age=jwt_keys_settings()['JWKS_MAX_AGE'])
+        return response
+
+
+def metrics(request):
+    """
+    Prometheus text exposition of `core.metrics.registry`, for staff users
+    or a scraper sending `Authorization: Bearer <PERF_METRICS['TOKEN']>`.
+    """
+    token = perf_settings()['TOKEN']
+    bearer = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = (token and constant_time_compare(bearer, f'Bearer {token}')) or request.user.is_staff
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
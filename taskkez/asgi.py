@@ -11,6 +11,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'taskkez.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'taskkez.settings.development')
 
 application = get_asgi_application()
+
+# imported after the application so that the apps are loaded
+from core.startup import application_loaded  # noqa: E402
+
+application_loaded()
@@ -1,6 +1,7 @@
 import os
+import tempfile
 import datetime
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -36,11 +37,15 @@ INSTALLED_APPS = [
     'phonenumber_field',
 
     # apps
+    'core.apps.CoreConfig',
     'users',
     'task',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
+    'core.middleware.QueryInspectorMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +77,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'taskkez.wsgi.application'
 
+# inserts the auth events in the request during the tests, see core.runner
+TEST_RUNNER = 'core.runner.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -88,15 +96,32 @@ DATABASES = {
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # django's postgresql backend taking connections from a pool, see core.db.pool
+        'ENGINE': 'core.db.backends.postgresql',
         'NAME': 'taskkez',
         'USER': 'taskkez_user',
         'PASSWORD': 'taskkez_pass',
         'HOST': 'localhost',
         'PORT': '5432',
+        'POOL': {
+            'MAX_SIZE': config('DATABASE_POOL_SIZE', default=10, cast=int),
+            'TIMEOUT': 10,
+        },
     }
 }
 
+# streaming replicas of 'default', one alias per host
+for index, host in enumerate(config('DATABASE_REPLICA_HOSTS', default='', cast=Csv())):
+    DATABASES[f'replica_{index}'] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+# reads go to the replicas until a request writes, see core.middleware.ReplicaPinMiddleware
+DATABASE_REPLICATION = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': 15,
+}
+
 
 # Rest auth configuration
 SITE_ID = 1
@@ -131,29 +156,198 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+PASSWORD_HASHERS = [
+    'core.hashers.AdmittedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# concurrent password hashes of views built with `as_view(limit_hashing=True)`
+PASSWORD_HASH_ADMISSION = {
+    'CONCURRENT': os.cpu_count() or 1,
+    'QUEUE_SIZE': 32,
+    'TIMEOUT': 10,
+}
+
 # Cashing :
 CACHES = {
+    # libmemcached keeps its connections across requests, python-memcached
+    # reconnected on every one
     'default': {
-        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
-        'LOCATION': '127.0.0.1:11211',
-    }
+        'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache',
+        'LOCATION': config('MEMCACHED_LOCATION', default='127.0.0.1:11211', cast=Csv()),
+        'OPTIONS': {
+            'binary': True,
+            'behaviors': {'tcp_nodelay': True, 'ketama': True},
+        },
+    },
+    # 'default' with a local copy of recently used keys, for values that never
+    # change under their key, see core.cache.TieredCache
+    'tiered': {
+        'BACKEND': 'core.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'default',
+            'LOCAL_MAX_ENTRIES': 2048,
+            'LOCAL_TIMEOUT': 60,
+        },
+    },
 }
 
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'core.authentication.CachedJSONWebTokenAuthentication',
+    ),
+    # orjson when installed, see core.renderers
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    # reverse proxies in front of the app, each appending to X-Forwarded-For.
+    # The throttles and auth events take the client address that many entries
+    # from its end, and REMOTE_ADDR with 0: a client can send any
+    # X-Forwarded-For, DRF's default of None would trust it as is
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 
-
 JWT_AUTH = {
-    'JWT_EXPIRATION_DELTA': datetime.timedelta(days=30),
-    'JWT_ALLOW_REFRESH': True,
-    'JWT_REFRESH_EXPIRATION_DELTA': datetime.timedelta(days=7),
+    'JWT_EXPIRATION_DELTA': datetime.timedelta(minutes=15),
+    'JWT_ALLOW_REFRESH': False,
+    'JWT_PAYLOAD_HANDLER': 'core.jwt_handler.jwt_payload_handler',
+    'JWT_ENCODE_HANDLER': 'core.keys.jwt_encode_handler',
+    'JWT_DECODE_HANDLER': 'core.keys.jwt_decode_handler',
+}
+
+# asymmetric token keys published at /.well-known/jwks.json (see core.keys).
+# Create one with `python manage.py generate_jwt_key`; to rotate, put the new
+# file first and keep the old public key until its tokens expire.
+JWT_KEYS = {
+    'ALGORITHM': config('JWT_ALGORITHM', default='RS256'),
+    'KEYS': [{'PRIVATE_KEY_FILE': path} for path in config('JWT_PRIVATE_KEY_FILES', default='', cast=Csv())]
+    + [{'PUBLIC_KEY_FILE': path} for path in config('JWT_PUBLIC_KEY_FILES', default='', cast=Csv())],
+    'JWKS_MAX_AGE': 300,
+}
+
+# rotating refresh tokens, exchanged at /token/refresh/ (see core.jwt_handler)
+REFRESH_TOKEN = {
+    'LIFETIME': datetime.timedelta(days=14),
+}
+
+# revoked token ids, see core.revocation
+TOKEN_REVOCATION = {
+    'CACHE_ALIAS': 'default',
+    'BLOOM_CAPACITY': 100000,
+    'BLOOM_ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': 1.0,
+}
+
+# e-mail confirmation and password reset tokens, see core.signed_tokens
+SIGNED_TOKENS = {
+    'CACHE_ALIAS': 'default',
+    'MAX_AGE': {
+        'email_confirm': 3 * 24 * 3600,
+        'email_change': 24 * 3600,
+        'password_reset': 24 * 3600,
+    },
+    'SECRETS': config('SIGNED_TOKEN_SECRETS', default='', cast=Csv()),
+}
+
+# authenticated users cached by core.authentication
+PRINCIPAL_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 1024,
+    'TIMEOUT': 300,
+}
+
+# whether a user's e-mail is verified, checked at login, see users.verification
+EMAIL_VERIFIED = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 24 * 3600,
+}
+
+# rendered GET /user/ bodies and their ETag versions, see core.render_cache
+RENDER_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'BODY_CACHE_ALIAS': 'tiered',
+    'TIMEOUT': 3600,
+}
+
+# failed login limits, see core.throttling
+LOGIN_THROTTLE = {
+    'RATES': {
+        'ip': '30/min',
+        'username': '5/min',
+        'email': '5/min',
+        'phone': '5/min',
+    },
+    'LOCKOUT_SECONDS': 60,
+    'MAX_LOCKOUT_SECONDS': 3600,
+}
+
+# e-mail outbox, delivered by `python manage.py send_queued_mail`
+EMAIL_OUTBOX = {
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'POLL_INTERVAL': 5,
+}
+
+# uploaded images are stripped, renamed by content hash and thumbnailed
+# in a thread pool once the request's transaction commits
+IMAGE_PIPELINE = {
+    'MAX_UPLOAD_BYTES': 5 * 1024 * 1024,
+    'MAX_PIXELS': 40 * 1000 * 1000,
+    'THUMBNAIL_SIZES': (128, 512),
+    'THUMBNAIL_FORMAT': 'WEBP',
+    'ASYNC': True,
+}
+
+# resumable uploads, kept under LOCATION until complete (see core.uploads)
+UPLOADS = {
+    'BACKEND': 'core.uploads.FileSystemChunkStorage',
+    'LOCATION': os.path.join(BASE_DIR, 'uploads'),
+    'MAX_SIZE': 10 * 1024 * 1024,
+    'EXPIRY_HOURS': 24,
+}
+
+# request timing histograms at /metrics, see core.middleware.PerformanceMiddleware
+PERF_METRICS = {
+    'SAMPLE_RATE': 0.01,
+    'SERVER_TIMING': True,
+    'TOKEN': config('METRICS_TOKEN', default=''),
+}
+
+# repeated query (N+1) reports, see core.middleware.QueryInspectorMiddleware;
+# 'log' on staging, 'raise' while running the tests
+QUERY_INSPECTOR = {
+    'MODE': config('QUERY_INSPECTOR_MODE', default='off'),
+    'THRESHOLD': 2,
+}
+
+# logins, logouts, password and e-mail changes, written in batches by a
+# thread of each process, see core.audit
+AUTH_AUDIT = {
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    # outside the source tree; point it at persistent storage in production
+    'FALLBACK_FILE': config('AUTH_AUDIT_FILE',
+                            default=os.path.join(tempfile.gettempdir(), 'taskkez-auth-events.jsonl')),
+}
+
+# warm-up of the processes built by taskkez.wsgi / taskkez.asgi, see core.startup
+STARTUP = {
+    'WARM_UP': config('DJANGO_WARM_UP', default=False, cast=bool),
+    'FREEZE_GC': True,
 }
 
 # phone number config
@@ -179,4 +373,4 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-MEDIA_URL = '/media/'
\ No newline at end of file
+MEDIA_URL = '/media/'
@@ -1,8 +1,16 @@
+import sys
+
 from .base import *
 
 
 DEBUG = True
 
+# time every request in development
+PERF_METRICS = dict(PERF_METRICS, SAMPLE_RATE=1.0)
+
+# fail the tests on N+1 queries, log them when browsing
+QUERY_INSPECTOR = dict(QUERY_INSPECTOR, MODE='raise' if 'test' in sys.argv else 'log')
+
 # INSTALLED_APPS += [
 #     'debug_toolbar',
 # ]
@@ -6,11 +6,15 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import routers
 
+from core.views import JWKSView, metrics
+
 router = routers.DefaultRouter()
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('.well-known/jwks.json', JWKSView.as_view(), name='jwks'),
+    path('metrics', metrics, name='metrics'),
     # path('', include(router.urls)),
 
     path('', include('users.urls')),
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'taskkez.settings.development')
 
 application = get_wsgi_application()
+
+# imported after the application so that the apps are loaded
+from core.startup import application_loaded  # noqa: E402
+
+application_loaded()
@@ -0,0 +1,131 @@
+"""
+Scenarios of `manage.py bench_auth`. Each one prepares its data for
+`requests` calls and returns `call(index)`, run through the whole URL and
+middleware stack with one test client per thread.
+"""
+import threading
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from rest_auth.utils import jwt_encode
+from rest_framework.test import APIClient
+
+from allauth.account.models import EmailAddress
+from core.signed_tokens import make_token
+from .models import Profile
+
+
+User = get_user_model()
+
+PASSWORD = 'bench-Passw0rd!'
+
+_local = threading.local()
+
+
+def client():
+    # test clients keep cookies and are not thread safe
+    if getattr(_local, 'client', None) is None:
+        _local.client = APIClient()
+    return _local.client
+
+
+def create_users(prefix, count, verified=True):
+    """
+    `count` users sharing one password hash, hashing once instead of per user.
+    """
+    password = make_password(PASSWORD)
+    usernames = [f'{prefix}{index}' for index in range(count)]
+    User.objects.bulk_create([
+        User(username=username, email=f'{username}@example.com', password=password) for username in usernames
+    ])
+    users = list(User.objects.filter(username__in=usernames).order_by('pk'))
+    EmailAddress.objects.bulk_create([
+        EmailAddress(user=user, email=user.email, verified=verified, primary=True) for user in users
+    ])
+    # bulk_create skips the post_save signal that creates profiles
+    Profile.objects.bulk_create([Profile(user=user) for user in users])
+    return users
+
+
+def registration(requests):
+    def call(index):
+        response = client().post('/registration/', {
+            'username': f'register{index}',
+            'email': f'register{index}@example.com',
+            'password1': PASSWORD,
+            'password2': PASSWORD,
+            'first_name': 'Bench',
+            'last_name': 'Mark',
+            'phone_number': f'+20100{index:07d}',
+            'accept_terms': True,
+        }, format='json')
+        return response.status_code == 201
+    return call
+
+
+def login(requests):
+    create_users('login', 1)
+
+    def call(index):
+        response = client().post('/login/', {'username': 'login0', 'password': PASSWORD}, format='json')
+        return response.status_code == 200
+    return call
+
+
+def user_get(requests):
+    token = jwt_encode(create_users('get', 1)[0])
+
+    def call(index):
+        response = client().get('/user/', HTTP_AUTHORIZATION=f'JWT {token}')
+        return response.status_code == 200
+    return call
+
+
+def user_put(requests):
+    tokens = [jwt_encode(user) for user in create_users('put', 8)]
+
+    def call(index):
+        response = client().patch('/user/', {'about': f'about {index}'}, format='json',
+                                  HTTP_AUTHORIZATION=f'JWT {tokens[index % len(tokens)]}')
+        return response.status_code == 200
+    return call
+
+
+def verify_email(requests):
+    users = create_users('verify', requests, verified=False)
+    keys = [make_token('email_confirm', address.user_id, address.pk) for address in
+            EmailAddress.objects.filter(user__in=users).order_by('user_id')]
+
+    def call(index):
+        response = client().post(f'/account-confirm-email/{keys[index]}/', {'key': keys[index]}, format='json')
+        return response.status_code == 200
+    return call
+
+
+def password_reset(requests):
+    users = create_users('reset', requests)
+
+    def call(index):
+        user = users[index]
+        response = client().post('/password/reset/', {'email': user.email}, format='json')
+        if response.status_code != 200:
+            return False
+        uid = urlsafe_base64_encode(force_bytes(user.pk))
+        token = make_token('password_reset', user.pk)
+        response = client().post(f'/password/reset/confirm/{uid}/{token}/', {
+            'uid': uid, 'token': token, 'new_password1': PASSWORD + 'x', 'new_password2': PASSWORD + 'x',
+        }, format='json')
+        return response.status_code == 200
+    return call
+
+
+SCENARIOS = {
+    'registration': registration,
+    'login': login,
+    'user_get': user_get,
+    'user_put': user_put,
+    'verify_email': verify_email,
+    'password_reset': password_reset,
+}
@@ -0,0 +1,279 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Lower
+from django.utils.dateparse import parse_date
+
+from allauth.account.models import EmailAddress
+from . import models, choices
+from .phones import as_e164, parse_phone
+
+
+User = get_user_model()
+
+USER_FIELDS = ('username', 'email', 'first_name', 'last_name')
+PROFILE_FIELDS = ('phone_number', 'about', 'birth_date', 'transportation', 'gender',
+                  'id_number', 'accept_terms', 'is_tasker')
+ADDRESS_FIELDS = ('street', 'building_number', 'city', 'country', 'postal_code')
+EXPORT_FIELDS = ('id',) + USER_FIELDS + ('is_active', 'date_joined', 'email_verified') + PROFILE_FIELDS
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+
+
+def read_rows(stream, fmt):
+    """
+    Yield `(line_number, row)` from a CSV (with header) or NDJSON stream. An
+    NDJSON line that is not valid JSON is yielded as is, for `clean_row()` to
+    reject.
+    """
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+    else:
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, text
+
+
+def as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def as_int(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def clean_row(row):
+    """
+    Normalize one input row, returning `(data, errors)`.
+    """
+    if not isinstance(row, dict):
+        return None, {'row': "not a JSON object"}
+    errors, data = {}, {}
+    for field in USER_FIELDS:
+        value = row.get(field) or ''
+        if not isinstance(value, str):
+            errors[field] = "not a string"
+            value = ''
+        data[field] = value.strip()
+    data['password'] = row.get('password') or None
+    if not isinstance(data['password'], (str, type(None))):
+        errors['password'] = "not a string"
+    data['email'] = data['email'].lower()
+    data['email_verified'] = as_bool(row.get('email_verified'))
+
+    if not data['username']:
+        errors.setdefault('username', "required")
+    try:
+        validate_email(data['email'])
+    except ValidationError:
+        errors.setdefault('email', "invalid e-mail")
+
+    profile = {
+        'about': row.get('about') or None,
+        'accept_terms': as_bool(row.get('accept_terms')),
+        'is_tasker': as_bool(row.get('is_tasker')),
+        'transportation': row.get('transportation') or None,
+        'gender': row.get('gender') or None,
+    }
+    if profile['transportation'] not in (None,) + tuple(dict(choices.TRANSPORTATION_CHOICES)):
+        errors['transportation'] = "invalid choice"
+    if profile['gender'] not in (None,) + tuple(dict(choices.GENDER_CHOICES)):
+        errors['gender'] = "invalid choice"
+    try:
+        profile['id_number'] = as_int(row.get('id_number'))
+    except (ValueError, TypeError):
+        errors['id_number'] = "not a number"
+    try:
+        profile['birth_date'] = parse_date(row['birth_date']) if row.get('birth_date') else None
+    except (ValueError, TypeError):
+        errors['birth_date'] = "invalid date"
+    phone_number = parse_phone(str(row['phone_number'])) if row.get('phone_number') else None
+    if phone_number is not None and not phone_number.is_valid():
+        errors['phone_number'] = "invalid phone number"
+    profile['phone_number'] = phone_number
+    # bulk_create() skips Profile.save()
+    profile['phone_e164'] = as_e164(phone_number) if phone_number is not None else None
+    data['profile'] = profile
+
+    address = {field: row.get(field) or None for field in ADDRESS_FIELDS}
+    if address['street']:
+        try:
+            address['building_number'] = as_int(address['building_number'])
+            address['postal_code'] = as_int(address['postal_code'])
+        except (ValueError, TypeError):
+            errors['address'] = "building number and postal code must be numbers"
+        address['country'] = address['country'] or 'Egypt'
+        data['address'] = address
+    else:
+        data['address'] = None
+    return data, errors
+
+
+def find_duplicates(rows):
+    """
+    Errors for rows whose username, e-mail or phone number is already taken,
+    checked with one query per field for the whole chunk.
+    """
+    usernames = {data['username'] for line, data in rows}
+    emails = {data['email'] for line, data in rows}
+    phones = {data['profile']['phone_e164'] for line, data in rows} - {None}
+
+    taken_usernames = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    taken_emails = set(
+        User.objects.annotate(email_lower=Lower('email'))
+        .filter(email_lower__in=emails).values_list('email_lower', flat=True))
+    taken_emails |= set(
+        EmailAddress.objects.annotate(email_lower=Lower('email'))
+        .filter(email_lower__in=emails).values_list('email_lower', flat=True))
+    taken_phones = set(models.Profile.objects.filter(phone_e164__in=phones).values_list('phone_e164', flat=True))
+
+    errors, seen = {}, {'username': set(), 'email': set(), 'phone_number': set()}
+    for line, data in rows:
+        values = {
+            'username': (data['username'], taken_usernames),
+            'email': (data['email'], taken_emails),
+            'phone_number': (data['profile']['phone_e164'], taken_phones),
+        }
+        for field, (value, taken) in values.items():
+            if value is None:
+                continue
+            if value in taken or value in seen[field]:
+                errors.setdefault(line, {})[field] = "already exists"
+            seen[field].add(value)
+    return errors
+
+
+def hash_passwords(passwords, executor=None):
+    if executor is None:
+        return [make_password(password) for password in passwords]
+    return list(executor.map(make_password, passwords, chunksize=16))
+
+
+@transaction.atomic
+def create_chunk(rows, executor=None):
+    """
+    Insert the users of a validated chunk with one INSERT per table.
+    """
+    passwords = hash_passwords([data['password'] for line, data in rows], executor)
+    users = [
+        User(password=password, **{field: data[field] for field in USER_FIELDS})
+        for password, (line, data) in zip(passwords, rows)
+    ]
+    User.objects.bulk_create(users)
+    if users and users[0].pk is None:
+        # only postgres returns the new keys from bulk_create
+        ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                   .values_list('username', 'pk'))
+        for user in users:
+            user.pk = ids[user.username]
+
+    profiles, addresses, emails = [], [], []
+    for user, (line, data) in zip(users, rows):
+        profiles.append(models.Profile(user_id=user.pk, **data['profile']))
+        emails.append(EmailAddress(user_id=user.pk, email=user.email, primary=True,
+                                   verified=data['email_verified']))
+        if data['address']:
+            addresses.append(models.Address(user_id=user.pk, profile=True, **data['address']))
+
+    models.Profile.objects.bulk_create(profiles)
+    EmailAddress.objects.bulk_create(emails)
+    models.Address.objects.bulk_create(addresses)
+    return len(users)
+
+
+def import_users(stream, fmt, chunk_size=1000, workers=None, report=None):
+    """
+    Import users from `stream` in chunks. `report(line, errors)` is called for
+    every rejected row. Returns `(created, rejected)`.
+    """
+    created = rejected = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 0 else None
+
+    def reject(line, errors):
+        nonlocal rejected
+        rejected += 1
+        if report:
+            report(line, errors)
+
+    def flush(chunk):
+        nonlocal created
+        duplicates = find_duplicates(chunk)
+        for line, errors in duplicates.items():
+            reject(line, errors)
+        rows = [(line, data) for line, data in chunk if line not in duplicates]
+        try:
+            created += create_chunk(rows, executor)
+        except IntegrityError:
+            # a row taken since find_duplicates() or breaking another
+            # constraint: insert them one by one to reject only that one
+            for line, data in rows:
+                try:
+                    created += create_chunk([(line, data)], executor)
+                except IntegrityError as e:
+                    reject(line, {'row': str(e)})
+
+    try:
+        chunk = []
+        for line, row in read_rows(stream, fmt):
+            try:
+                data, errors = clean_row(row)
+            except (ValueError, TypeError, AttributeError) as e:
+                errors = {'row': str(e)}
+            if errors:
+                reject(line, errors)
+                continue
+            chunk.append((line, data))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return created, rejected
+
+
+def export_rows(chunk_size=2000):
+    """
+    Yield one dict per user, streamed with a server-side cursor on postgres.
+    """
+    verified = EmailAddress.objects.filter(user=OuterRef('pk'), email=OuterRef('email'), verified=True)
+    queryset = (
+        User.objects.order_by('pk')
+        .annotate(email_verified=Exists(verified))
+        .values_list(*EXPORT_FIELDS[:-len(PROFILE_FIELDS)],
+                     # numbers are exported in E.164, as stored in phone_e164
+                     *[f'profile__{"phone_e164" if field == "phone_number" else field}'
+                       for field in PROFILE_FIELDS])
+    )
+    for values in queryset.iterator(chunk_size=chunk_size):
+        row = dict(zip(EXPORT_FIELDS, values))
+        for field in ('date_joined', 'birth_date'):
+            row[field] = row[field].isoformat() if row[field] else None
+        yield row
+
+
+def write_rows(rows, stream, fmt):
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            stream.write(json.dumps(row) + '\n')
@@ -0,0 +1,40 @@
+import django_filters
+from django.db.models import Exists, OuterRef
+
+from core.models import AuthEvent
+from . import models, choices
+
+
+class ProfileFilter(django_filters.FilterSet):
+    is_tasker = django_filters.BooleanFilter()
+    gender = django_filters.ChoiceFilter(choices=choices.GENDER_CHOICES)
+    transportation = django_filters.ChoiceFilter(choices=choices.TRANSPORTATION_CHOICES)
+    city = django_filters.ChoiceFilter(choices=choices.GOVERNORATE_CHOICES, method='filter_city')
+
+    class Meta:
+        model = models.Profile
+        fields = ('is_tasker', 'gender', 'transportation', 'city')
+
+    def filter_city(self, queryset, name, value):
+        # EXISTS instead of a join, a user with two addresses in the city
+        # would otherwise be listed twice
+        addresses = models.Address.objects.filter(user=OuterRef('user'), city=value)
+        return queryset.annotate(has_city=Exists(addresses)).filter(has_city=True)
+
+
+class AuthEventFilter(django_filters.FilterSet):
+    # a number, not a choice of users: events outlive their user
+    user = django_filters.NumberFilter(field_name='user_id')
+    event = django_filters.ChoiceFilter(choices=AuthEvent.EVENT_CHOICES)
+    since = django_filters.IsoDateTimeFilter(method='filter_since')
+    until = django_filters.IsoDateTimeFilter(method='filter_until')
+
+    class Meta:
+        model = AuthEvent
+        fields = ('user', 'event', 'since', 'until')
+
+    def filter_since(self, queryset, name, value):
+        return queryset.between(since=value)
+
+    def filter_until(self, queryset, name, value):
+        return queryset.between(until=value)
@@ -0,0 +1,85 @@
+import datetime
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import benchmark
+from users.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the authentication endpoints against a throwaway test "
+            "database and print the results as JSON. With --compare, report "
+            "the metrics that regressed against an earlier result file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f"Comma separated, from: {', '.join(SCENARIOS)}.")
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="SQLite serializes writers, use a local Postgres above 1.")
+        parser.add_argument('--output', help="Write the JSON here instead of stdout.")
+        parser.add_argument('--compare', help="Earlier JSON output to compare with.")
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help="Percent a metric may get worse before it counts as a regression.")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+        with benchmark.test_database():
+            results = {
+                'meta': self.meta(options),
+                'results': {name: self.run_scenario(name, options) for name in names},
+            }
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            self.report(benchmark.compare(baseline, results, options['threshold']))
+
+    def run_scenario(self, name, options):
+        call = SCENARIOS[name](options['requests'])
+        result = benchmark.run(call, options['requests'], options['concurrency'])
+        self.stderr.write(
+            f"{name:>15}: {result['throughput']} req/s  p50 {result['p50_ms']} ms  "
+            f"p99 {result['p99_ms']} ms  {result['queries_per_request']} queries  "
+            f"{result['errors']} errors")
+        return result
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'date': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+        }
+
+    def report(self, rows):
+        regressions = [row for row in rows if row[5]]
+        for scenario, metric, old, new, change, regressed in rows:
+            flag = '  REGRESSION' if regressed else ''
+            self.stderr.write(f"{scenario:>15} {metric:>20}: {old} -> {new} ({change:+.1f}%){flag}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} metrics regressed by more than the threshold")
@@ -0,0 +1,76 @@
+import base64
+import io
+import json
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import benchmark, images
+from users import models, views
+
+
+class Command(BaseCommand):
+    help = ("Compare profile picture upload latency with inline and background "
+            "processing, and the bytes served for the original and thumbnails. "
+            "Runs against a throwaway test database and media directory.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20)
+        parser.add_argument('--width', type=int, default=2000)
+        parser.add_argument('--height', type=int, default=1500)
+
+    def handle(self, *args, **options):
+        with benchmark.test_database(), tempfile.TemporaryDirectory() as media_root:
+            try:
+                upload = self.make_upload(options['width'], options['height'])
+                self.stdout.write(f"upload: {len(upload) * 3 // 4} bytes base64-decoded")
+                for mode, run_async in (('inline', False), ('async', True)):
+                    with override_settings(MEDIA_ROOT=media_root, IMAGE_PIPELINE={'ASYNC': run_async}):
+                        self.run_mode(mode, upload, options)
+                        # let the background tasks finish inside the override
+                        images.shutdown()
+                with override_settings(MEDIA_ROOT=media_root):
+                    self.report_sizes()
+            finally:
+                images.shutdown()
+
+    def make_upload(self, width, height):
+        # a busy pattern so the JPEG is about as large as a camera photo
+        image = Image.frombytes('RGB', (width, height), bytes(
+            (x * 7 + y * 13) % 256 for y in range(height // 10) for x in range(width * 3)) * 10)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=95)
+        return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+    def run_mode(self, mode, upload, options):
+        user = get_user_model().objects.create_user(f'bench-{mode}', f'{mode}@example.com', 'bench')
+        view = views.UserDetailsAPIView.as_view()
+        factory = APIRequestFactory()
+
+        latencies = []
+        for _ in range(options['requests']):
+            request = factory.patch('/user/', {'profile_picture': upload}, format='json')
+            # a fresh principal per request, as the authentication class loads it
+            force_authenticate(request, user=get_user_model().objects.get(pk=user.pk))
+            start = time.perf_counter()
+            response = view(request)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+
+        latencies.sort()
+        self.stdout.write(
+            f"{mode:>7}: p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms  "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f} ms  "
+            f"({len(latencies)} uploads)")
+
+    def report_sizes(self):
+        profile = models.Profile.objects.exclude(profile_picture_thumbnails=None).latest('modified')
+        storage = profile.profile_picture.storage
+        self.stdout.write(f"original: {storage.size(profile.profile_picture.name)} bytes")
+        for size, name in json.loads(profile.profile_picture_thumbnails).items():
+            self.stdout.write(f"{size:>8}: {storage.size(name)} bytes")
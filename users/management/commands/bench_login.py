@@ -0,0 +1,56 @@
+import time
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from allauth.account.models import EmailAddress
+from core import benchmark
+from users import views
+
+
+class Command(BaseCommand):
+    help = ("Compare login throughput with and without the password hashing admission "
+            "limit (PASSWORD_HASH_ADMISSION). Runs against a throwaway test database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with benchmark.test_database():
+            user = get_user_model().objects.create_user('bench', 'bench@example.com', 'bench-password')
+            EmailAddress.objects.create(user=user, email=user.email, verified=True, primary=True)
+            for mode, limit_hashing in (('unlimited', False), ('limited', True)):
+                self.run_mode(mode, views.LoginUserView.as_view(limit_hashing=limit_hashing), options)
+
+    def run_mode(self, mode, view, options):
+        factory = APIRequestFactory()
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        data = {'username': 'bench', 'password': 'bench-password'}
+
+        def login(_):
+            request = factory.post('/login/', data, format='json')
+            request.session = session_store()
+            try:
+                return view(request).status_code
+            finally:
+                connection.close()
+
+        # warm up the database connections
+        list(ThreadPoolExecutor(options['concurrency']).map(login, range(options['concurrency'])))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            statuses = list(executor.map(login, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        ok = statuses.count(200)
+        self.stdout.write(
+            f"{mode:>9}: {ok / elapsed:8.1f} logins/s  "
+            f"({ok} ok, {statuses.count(503)} busy, {len(statuses)} total, "
+            f"concurrency {options['concurrency']}, {elapsed:.2f}s)")
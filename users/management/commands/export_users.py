@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from users.bulk import export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = "Stream users with their profile to a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, '-' for stdout.")
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                            help="Defaults to the file extension, ndjson for stdout.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        stream = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            write_rows(export_rows(options['chunk_size']), stream, fmt)
+        finally:
+            if path != '-':
+                stream.close()
@@ -0,0 +1,43 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bulk import import_users
+
+
+class Command(BaseCommand):
+    help = ("Create users, profiles, e-mail addresses and addresses from a CSV "
+            "or NDJSON file in bulk. Rejected rows are reported as NDJSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, '-' for stdin.")
+        parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                            help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes, 0 hashes inline.")
+        parser.add_argument('--errors', default=None,
+                            help="Write rejected rows to this file instead of stderr.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        if path == '-' and not options['format']:
+            raise CommandError("--format is required when reading from stdin.")
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        errors = open(options['errors'], 'w') if options['errors'] else self.stderr
+
+        def report(line, row_errors):
+            errors.write(json.dumps({'line': line, 'errors': row_errors}) + '\n')
+
+        try:
+            created, rejected = import_users(stream, fmt, options['chunk_size'],
+                                             options['workers'], report)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if options['errors']:
+                errors.close()
+        self.stdout.write(f"created {created}, rejected {rejected}")
@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+# django runs `email__iexact` as UPPER(email) = UPPER(%s) on postgres, these
+# indexes serve the login and registration e-mail lookups
+INDEXES = (
+    ('users_auth_user_email_upper_idx', 'auth_user', 'UPPER("email"::text)'),
+    ('users_emailaddress_email_upper_idx', 'account_emailaddress', 'UPPER("email"::text)'),
+    ('users_emailaddress_user_email_idx', 'account_emailaddress', '"user_id", "email"'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns in INDEXES:
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({columns})')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, columns in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('account', '0002_email_max_length'),
+        ('users', '0009_auto_20200313_1708'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.4 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_email_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['created', 'id'], name='profile_created_id_idx'),
+        ),
+    ]
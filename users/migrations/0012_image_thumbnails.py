@@ -0,0 +1,23 @@
+# Generated by Django 3.0.4 on 2026-10-18 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_profile_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idimages',
+            name='thumbnails',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='profile_picture_thumbnails',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
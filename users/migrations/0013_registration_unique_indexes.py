@@ -0,0 +1,84 @@
+from django.db import IntegrityError, migrations
+
+
+# registration leaves taken usernames and e-mails to these indexes instead of
+# SELECTing first; UPPER() keeps allauth's case insensitive uniqueness
+INDEXES = (
+    ('users_auth_user_username_upper_uniq', 'auth_user', 'UPPER("username"::text)', ''),
+    ('users_auth_user_email_upper_uniq', 'auth_user', 'UPPER("email"::text)', 'WHERE "email" <> \'\''),
+    ('users_emailaddress_email_upper_uniq', 'account_emailaddress', 'UPPER("email"::text)', ''),
+)
+# the unique index serves the same lookups
+REPLACED = ('users_emailaddress_email_upper_idx', 'account_emailaddress', 'UPPER("email"::text)', '')
+
+
+def check_duplicates(schema_editor, table, columns, where):
+    """
+    Refuse to start while rows differ only in case, the unique index would
+    fail on them, and leave it INVALID on postgres.
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        columns = columns.replace('::text', '')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT {columns} FROM "{table}" {where} GROUP BY {columns} HAVING COUNT(*) > 1 LIMIT 10')
+        duplicates = [value for value, in cursor.fetchall()]
+    if duplicates:
+        raise IntegrityError(
+            f'{table} has rows that differ only in case for {columns}: {", ".join(duplicates)}. '
+            f'Merge or rename them before running this migration.')
+
+
+def is_invalid(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s',
+            [name])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def create_index(schema_editor, name, table, columns, where, unique='UNIQUE '):
+    if schema_editor.connection.vendor == 'postgresql':
+        # an interrupted or failed CONCURRENTLY build leaves an INVALID index
+        # that IF NOT EXISTS would keep: it enforces nothing, so rebuild it
+        if is_invalid(schema_editor, name):
+            drop_index(schema_editor, name)
+        schema_editor.execute(
+            f'CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" ({columns}) {where}')
+    elif schema_editor.connection.vendor == 'sqlite':
+        columns = columns.replace('::text', '')
+        schema_editor.execute(f'CREATE {unique}INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns}) {where}')
+
+
+def drop_index(schema_editor, name):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+def create_indexes(apps, schema_editor):
+    for name, table, columns, where in INDEXES:
+        check_duplicates(schema_editor, table, columns, where)
+    for index in INDEXES:
+        create_index(schema_editor, *index)
+    drop_index(schema_editor, REPLACED[0])
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        create_index(schema_editor, *REPLACED, unique='')
+    for name, table, columns, where in INDEXES:
+        drop_index(schema_editor, name)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0012_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
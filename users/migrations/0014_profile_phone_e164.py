@@ -0,0 +1,27 @@
+# Generated by Django 3.0.4 on 2026-10-18 11:25
+
+from django.db import migrations, models
+import users.phones
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_registration_unique_indexes'),
+    ]
+
+    operations = [
+        # unique once filled in, see 0016
+        migrations.AddField(
+            model_name='profile',
+            name='phone_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16, null=True),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='phone_number',
+            field=users.phones.PhoneNumberField(
+                blank=True, error_messages={'unique': 'A phone number already exists.'}, max_length=128, null=True,
+                region=None, unique=True),
+        ),
+    ]
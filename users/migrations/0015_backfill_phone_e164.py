@@ -0,0 +1,46 @@
+import phonenumbers
+from django.conf import settings
+from django.db import migrations, transaction
+
+
+# rows updated per transaction, each chunk holds its row locks only briefly
+CHUNK_SIZE = 2000
+
+
+def e164(value):
+    try:
+        number = phonenumbers.parse(value, getattr(settings, 'PHONENUMBER_DEFAULT_REGION', None))
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(number):
+        return None
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+def backfill(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    profiles = Profile.objects.using(schema_editor.connection.alias)
+    last_pk = 0
+    while True:
+        rows = list(
+            profiles.filter(pk__gt=last_pk, phone_number__isnull=False, phone_e164__isnull=True)
+            .exclude(phone_number='').order_by('pk').values_list('pk', 'phone_number')[:CHUNK_SIZE])
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        changed = [Profile(pk=pk, phone_e164=e164(phone_number)) for pk, phone_number in rows]
+        changed = [profile for profile in changed if profile.phone_e164]
+        with transaction.atomic(using=schema_editor.connection.alias):
+            profiles.bulk_update(changed, ['phone_e164'])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0014_profile_phone_e164'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
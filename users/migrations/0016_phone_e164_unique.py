@@ -0,0 +1,63 @@
+from django.db import migrations, models
+import users.phones
+
+
+NAME = 'users_profile_phone_e164_key'
+
+
+def is_invalid(schema_editor, name):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s',
+            [name])
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def create_unique(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        # an INVALID index left by a failed build is dropped and built again
+        if is_invalid(schema_editor, NAME):
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{NAME}"')
+        # built without blocking writes, then turned into the constraint
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{NAME}" ON "users_profile" ("phone_e164")')
+        schema_editor.execute(f'ALTER TABLE "users_profile" ADD CONSTRAINT "{NAME}" UNIQUE USING INDEX "{NAME}"')
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{NAME}" ON "users_profile" ("phone_e164")')
+
+
+def drop_unique(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'ALTER TABLE "users_profile" DROP CONSTRAINT IF EXISTS "{NAME}"')
+    elif schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{NAME}"')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('users', '0015_backfill_phone_e164'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(create_unique, drop_unique)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='profile',
+                    name='phone_e164',
+                    field=models.CharField(
+                        blank=True, editable=False, error_messages={'unique': 'A phone number already exists.'},
+                        max_length=16, null=True, unique=True),
+                ),
+            ],
+        ),
+        # phone_e164 enforces it from here on
+        migrations.AlterField(
+            model_name='profile',
+            name='phone_number',
+            field=users.phones.PhoneNumberField(blank=True, max_length=128, null=True, region=None),
+        ),
+    ]
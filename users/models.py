@@ -1,15 +1,18 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import MaxLengthValidator
 
-from phonenumber_field.modelfields import PhoneNumberField
+from allauth.account.models import EmailAddress
+from allauth.account.signals import email_confirmed
 
 from core.models import TimeStampedModel
 from . import choices
 from core import image_paths
+from .phones import PhoneNumberField, as_e164
+from .verification import invalidate_email_verified
 
 
 User = get_user_model()
@@ -33,11 +36,15 @@ class Profile(TimeStampedModel):
         User, related_name='profile', on_delete=models.CASCADE)
     profile_picture = models.ImageField(
         upload_to=image_paths.profile_image_path, blank=True, null=True)
+    # {size: name} written by core.images once the picture is processed
+    profile_picture_thumbnails = models.TextField(blank=True, null=True, editable=False)
     # skills = relation with category
     about = models.TextField(blank=True, null=True)
     birth_date = models.DateField(blank=True, null=True)
-    phone_number = PhoneNumberField(blank=True, null=True, unique=True, error_messages={
-                                    'unique': _("A phone number already exists."), })
+    phone_number = PhoneNumberField(blank=True, null=True)
+    # phone_number in E.164, kept by save(); unique, and what phone lookups filter on
+    phone_e164 = models.CharField(max_length=16, blank=True, null=True, unique=True, editable=False,
+                                  error_messages={'unique': _("A phone number already exists.")})
     transportation = models.CharField(
         max_length=1, choices=choices.TRANSPORTATION_CHOICES, null=True, blank=True)
     gender = models.CharField(
@@ -46,15 +53,39 @@ class Profile(TimeStampedModel):
     accept_terms = models.BooleanField(default=False)
     is_tasker = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id'], name='profile_created_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.phone_e164 = as_e164(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_e164'}
+        super().save(*args, **kwargs)
+
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, *args, **kwargs):
     if created:
-        Profile.objects.create(user=instance)
+        # registration sets the profile columns it collected on the user
+        Profile.objects.create(user=instance, **getattr(instance, 'initial_profile', {}))
+
+
+@receiver(email_confirmed)
+def email_confirmed_verified(sender, request, email_address, *args, **kwargs):
+    invalidate_email_verified(email_address.user_id)
+
+
+@receiver([post_save, post_delete], sender=EmailAddress)
+def email_address_verified(sender, instance, *args, **kwargs):
+    invalidate_email_verified(instance.user_id)
 
 
 class IDImages(TimeStampedModel):
     profile = models.ForeignKey(Profile, related_name='id_images', on_delete=models.CASCADE)
     title = models.CharField(max_length=200, null=True, blank=True)
     image = models.ImageField(upload_to=image_paths.id_image_path)
+    thumbnails = models.TextField(blank=True, null=True, editable=False)
 
@@ -0,0 +1,78 @@
+import functools
+
+from django.conf import settings
+from django.core import validators
+from phonenumber_field import modelfields
+from phonenumber_field.phonenumber import PhoneNumber, to_python
+
+
+# distinct (number, region) strings whose parse is kept
+PARSE_CACHE_SIZE = 4096
+
+
+class ParsedPhoneNumber(PhoneNumber):
+    """
+    PhoneNumber shared by every parse of the same string, with its validity
+    and formats computed once. It cannot be changed.
+    """
+
+    def __init__(self, number):
+        super().__init__()
+        self.merge_from(number)
+        self._valid = super().is_valid()
+        self._formats = {}
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("parsed phone numbers are shared and cannot be changed")
+        super().__setattr__(name, value)
+
+    def is_valid(self):
+        return self._valid
+
+    def format_as(self, format):
+        try:
+            return self._formats[format]
+        except KeyError:
+            formatted = self._formats[format] = super().format_as(format)
+            return formatted
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse(value, region):
+    return ParsedPhoneNumber(to_python(value, region))
+
+
+def parse_phone(value, region=None):
+    """
+    `to_python()` of phonenumber_field, parsing each distinct string once.
+    """
+    if isinstance(value, str) and value not in validators.EMPTY_VALUES:
+        return _parse(value, region or getattr(settings, 'PHONENUMBER_DEFAULT_REGION', None))
+    return to_python(value, region)
+
+
+def as_e164(value):
+    """
+    E.164 form ('+201001234567') of a phone number or string, None when it
+    is not a valid number.
+    """
+    number = parse_phone(value)
+    if not number or not number.is_valid():
+        return None
+    return number.as_e164
+
+
+class PhoneNumberDescriptor(modelfields.PhoneNumberDescriptor):
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.name] = parse_phone(value, region=self.field.region)
+
+
+class PhoneNumberField(modelfields.PhoneNumberField):
+    """
+    phonenumber_field's model field, parsing the loaded values through the
+    parse cache.
+    """
+    descriptor_class = PhoneNumberDescriptor
@@ -1,41 +1,117 @@
+import json
+
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
-from django.contrib.auth import get_user_model
+from django.contrib.auth import get_user_model, password_validation
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.http import urlsafe_base64_decode
 from rest_framework import serializers, exceptions
 from rest_auth.serializers import LoginSerializer
 from rest_auth.registration.serializers import RegisterSerializer
-from rest_framework.validators import UniqueValidator
-from drf_extra_fields.fields import Base64ImageField
 from drf_writable_nested.serializers import WritableNestedModelSerializer
+from phonenumber_field.serializerfields import PhoneNumberField
 
 from rest_auth.serializers import LoginSerializer
 from allauth.account import app_settings as allauth_settings
 from allauth.utils import email_address_exists
 from allauth.account.adapter import get_adapter
-from phonenumber_field.serializerfields import PhoneNumberField
-from allauth.account.models import EmailAddress, EmailConfirmationHMAC
+from allauth.account.models import EmailAddress
+from core.audit import audit_log
+from core.images import LimitedBase64ImageField, ThumbnailsField, schedule_image
+from core.jwt_handler import revoke_user_refresh_tokens
+from core.mail import queue_mail
+from core.signals import invalidate_principal, invalidate_user_render
+from core.signed_tokens import check_token, consume, make_token, revoke_before
+from core.models import AuthEvent, ChunkedUpload
+from core.uploads import uploads_settings
 from . import models, choices
+from .phones import as_e164, parse_phone
+from .verification import is_email_verified
 
 User = get_user_model()
 
+USERNAME_TAKEN = ('username', _("A user with that username already exists."))
+EMAIL_TAKEN = ('email', _("A user is already registered with this e-mail address."))
+PHONE_NUMBER_TAKEN = ('phone_number', _("phone number already exist."))
+
+# unique constraints of the registration columns (see migrations 0013 and
+# 0016) -> field, message; SQLite names plain column constraints `table.column`
+UNIQUE_VIOLATIONS = {
+    'users_auth_user_username_upper_uniq': USERNAME_TAKEN,
+    'auth_user_username_key': USERNAME_TAKEN,
+    'auth_user.username': USERNAME_TAKEN,
+    'users_auth_user_email_upper_uniq': EMAIL_TAKEN,
+    'users_emailaddress_email_upper_uniq': EMAIL_TAKEN,
+    'account_emailaddress_email_key': EMAIL_TAKEN,
+    'account_emailaddress.email': EMAIL_TAKEN,
+    'users_profile_phone_e164_key': PHONE_NUMBER_TAKEN,
+    'users_profile.phone_e164': PHONE_NUMBER_TAKEN,
+}
+SQLITE_UNIQUE_FAILED = 'UNIQUE constraint failed: '
+
+
+def violated_constraint(error):
+    """
+    Name of the constraint that `error` (an IntegrityError) reports: postgres
+    has it in the diagnostics of the driver error, SQLite only in its message.
+    """
+    diag = getattr(error.__cause__, 'diag', None)
+    if diag is not None:
+        return diag.constraint_name
+    message = str(error)
+    if not message.startswith(SQLITE_UNIQUE_FAILED):
+        return None
+    name = message[len(SQLITE_UNIQUE_FAILED):]
+    if name.startswith("index '") and name.endswith("'"):
+        name = name[len("index '"):-1]
+    return name
+
+
+def unique_violation(error):
+    """
+    `{field: [message]}` of the registration field whose unique constraint
+    `error` (an IntegrityError) reports, None for other errors.
+    """
+    field, message = UNIQUE_VIOLATIONS.get(violated_constraint(error), (None, None))
+    if field is None:
+        return None
+    return {field: [message]}
+
+
+class PhoneNumberSerializerField(PhoneNumberField):
+    """
+    phonenumber_field's serializer field, parsing through users.phones'
+    parse cache. Kept here rather than in users.phones so that loading the
+    models does not import DRF's serializers.
+    """
+
+    def to_internal_value(self, data):
+        phone_number = parse_phone(data)
+        if phone_number and not phone_number.is_valid():
+            raise serializers.ValidationError(self.error_messages['invalid'])
+        return phone_number
+
+
 class RegisterUserSerializer(RegisterSerializer):
+    """
+    Taken usernames, e-mails and phone numbers are not looked up while
+    validating: `save()` inserts and the unique indexes answer.
+    """
     first_name = serializers.CharField(required=True, write_only=True)
     last_name = serializers.CharField(required=True, write_only=True)
-    phone_number = PhoneNumberField(required=True, write_only=True, 
-                            validators=[UniqueValidator(models.Profile.objects.all(), 
-                            message=_("phone number already exist."))])
+    phone_number = PhoneNumberSerializerField(required=True, write_only=True)
     accept_terms = serializers.BooleanField(required=True, write_only=True)
 
     def validate_username(self, username):
-        username = get_adapter().clean_username(username)
+        username = get_adapter().clean_username(username, shallow=True)
         return username
 
     def validate_email(self, email):
         email = get_adapter().clean_email(email)
-        if allauth_settings.UNIQUE_EMAIL:
-            if email and email_address_exists(email):
-                raise serializers.ValidationError(
-                    _("A user is already registered with this e-mail address."))
         return email
 
     def validate(self, data):
@@ -50,30 +126,76 @@ class RegisterUserSerializer(RegisterSerializer):
     #         'phone_number': self.validated_data.get('phone_number', '')
     #     }
 
-    def create_profile_data(self, user):
-        # create profile data
-        user.first_name = self.validated_data.get('first_name', '')
-        user.last_name = self.validated_data.get('last_name', '')
-        user.save()
-        user.profile.phone_number = self.validated_data.get('phone_number')
-        user.profile.accept_terms = self.validated_data.get('accept_terms')
-        user.profile.save()
-
-    def custom_signup(self, request, user):
-        self.create_profile_data(user)
+    def get_cleaned_data(self):
+        return dict(super().get_cleaned_data(),
+                    first_name=self.validated_data.get('first_name', ''),
+                    last_name=self.validated_data.get('last_name', ''))
+
+    def save(self, request):
+        """
+        One transaction with an INSERT each for the user, its profile, its
+        e-mail address and the confirmation e-mail in the outbox.
+        """
+        adapter = get_adapter()
+        user = adapter.new_user(request)
+        self.cleaned_data = self.get_cleaned_data()
+        # hashes the password, before the transaction starts
+        adapter.save_user(request, user, self, commit=False)
+        # inserted with the profile by users.models.create_profile
+        user.initial_profile = {
+            'phone_number': self.validated_data.get('phone_number'),
+            'accept_terms': self.validated_data.get('accept_terms'),
+        }
+        try:
+            with transaction.atomic():
+                user.save()
+                email = EmailAddress.objects.create(user=user, email=user.email, primary=True, verified=False)
+                queue_mail('account/email/email_confirmation_signup', user.email,
+                           {'user_id': user.pk, 'key': make_token('email_confirm', user.pk, email.pk)})
+        except IntegrityError as error:
+            errors = unique_violation(error)
+            if errors is None:
+                raise
+            raise serializers.ValidationError(errors)
+
+        # a new user has no addresses or ID images, skip loading them for the response
+        user._prefetched_objects_cache = {'address': models.Address.objects.none()}
+        user.profile._prefetched_objects_cache = {'id_images': models.IDImages.objects.none()}
+        return user
+
+
+INVALID_CREDENTIALS = 'invalid_credentials'
 
 
 class LoginUserSerializer(LoginSerializer):
     email = None
+    phone_number = serializers.CharField(required=False, allow_blank=True)
+
+    def _validate_phone_number(self, phone_number, password):
+        """
+        The user whose profile has `phone_number`, found with one query on
+        the unique phone_e164 index, if `password` is theirs.
+        """
+        e164 = as_e164(phone_number)
+        user = User.objects.filter(profile__phone_e164=e164).first() if e164 else None
+        if user is None:
+            # as long as a wrong password, like ModelBackend does
+            User().set_password(password)
+            return None
+        return user if user.check_password(password) else None
 
     def validate(self, attrs):
         username = attrs.get('username')
         email = attrs.get('email')
         password = attrs.get('password')
+        phone_number = attrs.get('phone_number')
 
         user = None
 
-        if 'allauth' in settings.INSTALLED_APPS:
+        if phone_number and not username and not email:
+            user = self._validate_phone_number(phone_number, password)
+
+        elif 'allauth' in settings.INSTALLED_APPS:
             from allauth.account import app_settings
 
             # Authentication through email
@@ -105,32 +227,185 @@ class LoginUserSerializer(LoginSerializer):
                 msg = _('User account is banned by admin.')
                 raise exceptions.ValidationError(msg)
         else:
+            # the only failure the login throttle counts
             msg = _('Wrong username or password.')
-            raise exceptions.ValidationError(msg)
+            raise exceptions.ValidationError(msg, code=INVALID_CREDENTIALS)
 
         # If required, is the email verified?
         if 'rest_auth.registration' in settings.INSTALLED_APPS:
             from allauth.account import app_settings
             if app_settings.EMAIL_VERIFICATION == app_settings.EmailVerificationMethod.MANDATORY:
-                email_address = user.emailaddress_set.get(email=user.email)
-                if not email_address.verified:
+                if not is_email_verified(user):
                     raise serializers.ValidationError(_('E-mail is not verified.'))
 
         attrs['user'] = user
         return attrs
 
 
+def save_changed(instance, data):
+    """
+    Set only the attributes of `data` that differ from `instance` and save
+    those columns, skipping the write when nothing changed.
+    """
+    changed = [field for field, value in data.items() if getattr(instance, field) != value]
+    if not changed:
+        return changed
+    for field in changed:
+        setattr(instance, field, data[field])
+    if any(field.name == 'modified' for field in instance._meta.concrete_fields):
+        changed.append('modified')
+    instance.save(update_fields=changed)
+    return changed
+
+
+def sync_nested(instance, related_name, items, **parent):
+    """
+    Reconcile the `related_name` rows of `instance` with the validated `items`:
+    items with an `id` update that row, items without one are created and
+    rows missing from the list are deleted, one statement per kind.
+    """
+    manager = getattr(instance, related_name)
+    model = manager.model
+    existing = {obj.pk: obj for obj in manager.all()}
+    to_create, to_update, fields = [], [], set()
+
+    for item in items:
+        item = {field: value for field, value in item.items() if field not in parent}
+        pk = item.pop('id', None)
+        if pk is None:
+            to_create.append(model(**item, **parent))
+            continue
+        obj = existing.pop(pk, None)
+        if obj is None:
+            raise exceptions.ValidationError({related_name: _("Unknown id %(pk)s.") % {'pk': pk}})
+        changed = [field for field, value in item.items() if getattr(obj, field) != value]
+        if changed:
+            for field in changed:
+                setattr(obj, field, item[field])
+            obj.modified = timezone.now()
+            fields.update(changed)
+            to_update.append(obj)
+
+    if existing:
+        model.objects.filter(pk__in=existing).delete()
+    if to_update:
+        model.objects.bulk_update(to_update, fields | {'modified'})
+    if to_create:
+        model.objects.bulk_create(to_create)
+    getattr(instance, '_prefetched_objects_cache', {}).pop(related_name, None)
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
+class PasswordResetConfirmSerializer(serializers.Serializer):
+    """
+    Checks the signed reset token without reading the user. `save()` reads
+    the user to validate the password against its attributes, then sets it
+    with one conditional UPDATE and burns the token.
+    """
+    new_password1 = serializers.CharField(max_length=128)
+    new_password2 = serializers.CharField(max_length=128)
+    uid = serializers.CharField()
+    token = serializers.CharField()
+
+    def validate(self, attrs):
+        token = check_token(attrs['token'], 'password_reset')
+        try:
+            uid = int(force_str(urlsafe_base64_decode(attrs['uid'])))
+        except (TypeError, ValueError, OverflowError):
+            uid = None
+        if uid != token.subject:
+            raise serializers.ValidationError({'uid': [_('Invalid value')]})
+        if attrs['new_password1'] != attrs['new_password2']:
+            raise serializers.ValidationError({'new_password2': [_("The two password fields didn't match.")]})
+        # the validators needing the user run again in save()
+        self.validate_new_password(attrs['new_password1'])
+        attrs['signed_token'] = token
+        return attrs
+
+    def validate_new_password(self, password, user=None):
+        try:
+            password_validation.validate_password(password, user)
+        except DjangoValidationError as error:
+            raise serializers.ValidationError({'new_password2': list(error.messages)})
+
+    def save(self):
+        token = self.validated_data['signed_token']
+        user = User.objects.filter(pk=token.subject, is_active=True).only(
+            'username', 'first_name', 'last_name', 'email').first()
+        if user is None:
+            raise serializers.ValidationError({'token': [_('Invalid or expired token.')]})
+        self.validate_new_password(self.validated_data['new_password1'], user)
+        password = make_password(self.validated_data['new_password1'])
+        consume(token)
+        if not User.objects.filter(pk=token.subject, is_active=True).update(password=password):
+            raise serializers.ValidationError({'token': [_('Invalid or expired token.')]})
+        # the other reset links sent before and the logins stop working too
+        revoke_before('password_reset', token.subject)
+        revoke_user_refresh_tokens(token.subject)
+        invalidate_principal(token.subject)
+
 
 class AddressSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+
     class Meta:
         model = models.Address
         exclude = ('created', 'modified',)
 
+
 class IDImagesSerializer(serializers.ModelSerializer):
-    
+    """
+    ID images nested in `/user/` only reference images uploaded through
+    `/user/id-images/`, so the user JSON never carries image bytes.
+    """
+    id = serializers.IntegerField()
+    thumbnails = ThumbnailsField()
+
     class Meta:
         model = models.IDImages
         exclude = ('created', 'modified',)
+        read_only_fields = ('profile', 'image')
+
+    def validate(self, attrs):
+        # `id` is not enforced as required on PATCH
+        if 'id' not in attrs:
+            raise serializers.ValidationError(
+                {'id': _("Upload the image to /user/id-images/ first and send its id.")})
+        return attrs
+
+
+class IDImageUploadSerializer(serializers.ModelSerializer):
+    thumbnails = ThumbnailsField()
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$', required=False, write_only=True)
+
+    class Meta:
+        model = models.IDImages
+        fields = ('id', 'title', 'image', 'thumbnails', 'sha256')
+
+    def validate(self, attrs):
+        sha256 = attrs.pop('sha256', None)
+        # set by core.uploads.ChecksumUploadHandler while the file streamed in
+        if sha256 and sha256 != getattr(attrs['image'], 'sha256', None):
+            raise serializers.ValidationError({'sha256': _("Checksum does not match the uploaded file.")})
+        return attrs
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    sha256 = serializers.RegexField(r'^[0-9a-f]{64}$')
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'filename', 'size', 'sha256', 'offset')
+        read_only_fields = ('id', 'offset')
+
+    def validate_size(self, size):
+        max_size = uploads_settings()['MAX_SIZE']
+        if not 0 < size <= max_size:
+            raise serializers.ValidationError(_("Size must be between 1 and %(max)s bytes.") % {'max': max_size})
+        return size
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -141,10 +416,10 @@ class UserSerializer(serializers.ModelSerializer):
     if update profile, fields you will update only (first name , last name, email)
     """
 
-    phone_number = PhoneNumberField(required=False, source='profile.phone_number',
-                            validators=[UniqueValidator(models.Profile.objects.all(), 
-                            message=_("phone number already exist."))])
-    profile_picture = Base64ImageField(required=False, source='profile.profile_picture')
+    # a taken number is reported by the unique index of phone_e164 in update()
+    phone_number = PhoneNumberSerializerField(required=False, source='profile.phone_number')
+    profile_picture = LimitedBase64ImageField(required=False, source='profile.profile_picture')
+    profile_picture_thumbnails = ThumbnailsField(source='profile.profile_picture_thumbnails')
     about = serializers.CharField(required=False, source='profile.about')
     # address = serializers.PrimaryKeyRelatedField(source='profile.address', queryset=models.Address.objects.all(), required=False)
     address = AddressSerializer(required=False, many=True)
@@ -159,11 +434,10 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('pk', 'first_name', 'last_name', 'username', 'email', 'phone_number', 
-                    'profile_picture', 'about', 'address', 'birth_date', 'transportation', 
+                    'profile_picture', 'profile_picture_thumbnails', 'about', 'address', 'birth_date', 'transportation', 
                     'gender', 'id_number', 'id_images', 'accept_terms', 'is_tasker',)
         read_only_fields = ('username', 'birth_date')
 
-
     def validate_email(self, email):
         email = get_adapter().clean_email(email)
         if allauth_settings.UNIQUE_EMAIL:
@@ -172,58 +446,45 @@ class UserSerializer(serializers.ModelSerializer):
                     _("A user is already registered with this e-mail address."))
         return email
 
-    
     def update(self, instance, validated_data):
         profile_data = validated_data.pop('profile', {})
-        phone_number = profile_data.pop('phone_number', None)
-        profile_picture = profile_data.get('profile_picture', None)
-        about = profile_data.get('about', None)
-        address = profile_data.get('address', None)
-        birth_date = profile_data.get('birth_date', None)
-        transportation = profile_data.get('transportation', None)
-        gender = profile_data.get('gender', None)
-        id_number = profile_data.get('id_number', None)
-        id_images = profile_data.get('id_images', [])
-        is_tasker = profile_data.get('is_tasker', None)
+        id_images = profile_data.pop('id_images', None)
+        address = validated_data.pop('address', None)
         new_email = validated_data.pop('email', None)
-
-
-        user = super(UserSerializer, self).update(instance, validated_data)
-
-        if new_email:
-            if EmailAddress.objects.filter(user=user, email=new_email, verified=False).exists():
-                raise exceptions.ValidationError(_("Email confirmation has been sent"))
-            
-            if not EmailAddress.objects.filter(user=user, email=new_email, verified=False).exists():
-                email_address = EmailAddress.objects.add_email(self.context.get('request'), user, new_email)
-                confirmation = EmailConfirmationHMAC(email_address)
-                print("confirmation key ->", confirmation.key)
-                # TODO send mail to confirmation
-
-
-        profile = user.profile
-        if profile_data:
-            if phone_number:
-                profile.phone_number = phone_number
-            if profile_picture:
-                profile.profile_picture = profile_picture
-            if about:
-                profile.about = about
-            if address:
-                profile.address = address
-            if birth_date:
-                profile.birth_date = birth_date
-            if transportation:
-                profile.transportation = transportation
-            if gender:
-                profile.gender = gender
-            if id_number:
-                profile.id_number = id_number
-            if id_images:
-                profile.id_images = id_images
-            if is_tasker:
-                profile.is_tasker = is_tasker
-        profile.save()
+        # new uploads drop the thumbnails of the previous image until processed
+        if profile_data.get('profile_picture'):
+            profile_data['profile_picture_thumbnails'] = None
+
+        try:
+            with transaction.atomic():
+                save_changed(instance, validated_data)
+
+                if new_email and new_email != instance.email:
+                    if EmailAddress.objects.filter(user=instance, email=new_email, verified=False).exists():
+                        raise exceptions.ValidationError(_("Email confirmation has been sent"))
+
+                    email_address = EmailAddress.objects.add_email(self.context.get('request'), instance, new_email)
+                    key = make_token('email_change', instance.pk, email_address.pk)
+                    queue_mail('account/email/email_confirmation', new_email, {'user_id': instance.pk, 'key': key})
+                    request = self.context.get('request')
+                    transaction.on_commit(lambda: audit_log.record(
+                        AuthEvent.EMAIL_CHANGE_REQUEST, instance.pk, request, email=new_email))
+
+                profile = instance.profile
+                changed = save_changed(profile, profile_data)
+                if 'profile_picture' in changed and profile.profile_picture:
+                    schedule_image(profile, 'profile_picture', 'profile_picture_thumbnails')
+                if address is not None:
+                    sync_nested(instance, 'address', address, user=instance)
+                if id_images is not None:
+                    sync_nested(profile, 'id_images', id_images, profile=profile)
+                # the bulk statements of sync_nested send no signals
+                invalidate_user_render(instance.pk)
+        except IntegrityError as error:
+            errors = unique_violation(error)
+            if errors is None:
+                raise
+            raise serializers.ValidationError(errors)
         return instance
 
     # def to_representation(self, instance):
@@ -233,3 +494,38 @@ class UserSerializer(serializers.ModelSerializer):
     #     return data
 
 
+class UserListSerializer(serializers.ModelSerializer):
+    """
+    Read only row of the staff user listing `/staff/users/`, one per profile.
+    """
+    pk = serializers.IntegerField(source='user.pk')
+    username = serializers.CharField(source='user.username')
+    email = serializers.EmailField(source='user.email')
+    first_name = serializers.CharField(source='user.first_name')
+    last_name = serializers.CharField(source='user.last_name')
+    is_active = serializers.BooleanField(source='user.is_active')
+    date_joined = serializers.DateTimeField(source='user.date_joined')
+    phone_number = PhoneNumberSerializerField()
+
+    class Meta:
+        model = models.Profile
+        fields = ('pk', 'username', 'email', 'first_name', 'last_name', 'is_active',
+                  'date_joined', 'phone_number', 'about', 'birth_date', 'transportation',
+                  'gender', 'id_number', 'accept_terms', 'is_tasker', 'created')
+        read_only_fields = fields
+
+
+class AuthEventSerializer(serializers.ModelSerializer):
+    """
+    Read only row of `/user/auth-events/` and `/staff/auth-events/`.
+    """
+    user = serializers.IntegerField(source='user_id')
+    data = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AuthEvent
+        fields = ('id', 'event', 'user', 'created', 'ip', 'user_agent', 'identifier', 'data')
+        read_only_fields = fields
+
+    def get_data(self, event):
+        return json.loads(event.data)
@@ -1,3 +1,734 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from PIL import Image
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_auth.utils import jwt_encode
+from allauth.account.models import EmailAddress, EmailConfirmationHMAC
+
+from core.audit import audit_log
+from core.authentication import principal_cache
+from core.hashers import AdmissionRefused, AdmittedPBKDF2PasswordHasher
+from core.models import AuthEvent, OutgoingEmail
+from core.revocation import revocation_store
+from core.signals import invalidate_principal, invalidate_user_render
+from core.signed_tokens import make_token
+from core.uploads import read_stream
+from . import models
+from .bulk import import_users
+from .phones import parse_phone
+from .serializers import unique_violation
+from .verification import invalidate_email_verified, is_email_verified
+
+
+User = get_user_model()
+
+
+class UserDetailsQueryBudgetTest(APITestCase):
+    # authentication (user + profile), addresses, id images
+    GET_USER_QUERIES = 3
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        for street in ('first', 'second', 'third'):
+            models.Address.objects.create(user=self.user, street=street)
+        for title in ('front', 'back'):
+            models.IDImages.objects.create(profile=self.user.profile, title=title, image=f'{title}.png')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(self.user))
+
+    def test_get_user_query_budget(self):
+        with self.assertNumQueries(self.GET_USER_QUERIES):
+            response = self.client.get('/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['address']), 3)
+        self.assertEqual(len(response.json()['id_images']), 2)
+
+        # the second call gets the principal and the rendered JSON from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/user/').content, response.content)
+
+    def test_etag_answers_304_without_queries_until_a_write(self):
+        etag = self.client.get('/user/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/user/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        models.Address.objects.create(user=self.user, street='fourth')
+        response = self.client.get('/user/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['address']), 4)
+        etag = response['ETag']
+
+        # nested lists are written with bulk statements, which send no signals
+        self.client.patch('/user/', {'address': []}, format='json')
+        response = self.client.get('/user/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['address']), (200, []))
+
+    def test_write_after_authentication_is_not_cached_as_current(self):
+        self.client.get('/user/')
+        models.Address.objects.create(user=self.user, street='fourth')
+        load = principal_cache.get
+
+        def load_then_write(user_id, version):
+            # the principal is read, then another request renames the user
+            user = load(user_id, version)
+            User.objects.filter(pk=user_id).update(first_name='New')
+            invalidate_principal(user_id)
+            invalidate_user_render(user_id)
+            return user
+
+        with mock.patch.object(principal_cache, 'get', side_effect=load_then_write):
+            self.assertEqual(self.client.get('/user/').json()['first_name'], '')
+        self.assertEqual(self.client.get('/user/').json()['first_name'], 'New')
+
+    def test_bodies_are_kept_per_host(self):
+        first = self.client.get('/user/', HTTP_HOST='a.example.com')
+        second = self.client.get('/user/', HTTP_HOST='b.example.com')
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertIn('Accept', first['Vary'])
+        self.assertEqual(self.client.get('/user/', HTTP_HOST='b.example.com',
+                                         HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+class RegistrationTest(APITestCase):
+    # SAVEPOINT, INSERT user, profile, e-mail address and outbox row, RELEASE;
+    # the savepoint is a BEGIN/COMMIT outside of the test's transaction
+    REGISTRATION_STATEMENTS = 6
+
+    def setUp(self):
+        cache.clear()
+
+    def register(self, **fields):
+        data = dict({
+            'username': 'neo', 'email': 'neo@example.com', 'password1': 'Xy-secret-99',
+            'password2': 'Xy-secret-99', 'first_name': 'Thomas', 'last_name': 'Anderson',
+            'phone_number': '+201001234567', 'accept_terms': True,
+        }, **fields)
+        return self.client.post('/registration/', data, format='json')
+
+    def test_registration_statement_count(self):
+        with self.assertNumQueries(self.REGISTRATION_STATEMENTS):
+            response = self.register()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['user']['address'], response.data['user']['id_images']), ([], []))
+
+        profile = models.Profile.objects.select_related('user').get(user__username='neo')
+        self.assertEqual((profile.user.first_name, str(profile.phone_number), profile.accept_terms),
+                         ('Thomas', '+201001234567', True))
+        self.assertTrue(EmailAddress.objects.filter(user=profile.user, primary=True, verified=False).exists())
+
+    def test_taken_fields_come_back_from_the_constraints(self):
+        self.assertEqual(self.register().status_code, 201)
+        for field, taken in (('username', 'NEO'), ('email', 'Neo@Example.com'), ('phone_number', '+201001234567')):
+            fresh = {'username': 'trinity', 'email': 'trinity@example.com', 'phone_number': '+201007654321'}
+            response = self.register(**dict(fresh, **{field: taken}))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(list(response.data), [field])
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_postgres_violations_are_matched_by_constraint_name(self):
+        def violation(constraint, message):
+            error = IntegrityError(message)
+            error.__cause__ = Exception(message)
+            error.__cause__.diag = mock.Mock(constraint_name=constraint)
+            return unique_violation(error)
+
+        self.assertEqual(list(violation('users_auth_user_email_upper_uniq', 'duplicate key value')), ['email'])
+        self.assertIsNone(violation('users_address_pkey', 'Key (auth_user.username)=(neo) already exists'))
+
+
+class SignedTokenFlowTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def outbox_context(self, template):
+        return json.loads(OutgoingEmail.objects.filter(template_prefix=template).latest('pk').context)
+
+    def test_signup_confirmation_is_one_update_and_single_use(self):
+        self.client.post('/registration/', {
+            'username': 'neo', 'email': 'neo@example.com', 'password1': 'Xy-secret-99',
+            'password2': 'Xy-secret-99', 'first_name': 'Thomas', 'last_name': 'Anderson',
+            'phone_number': '+201001234567', 'accept_terms': True,
+        }, format='json')
+        key = self.outbox_context('account/email/email_confirmation_signup')['key']
+
+        # the auth event is inserted after the request, outside of its budget
+        with mock.patch.object(audit_log, 'write') as write, self.assertNumQueries(1):
+            response = self.client.post(f'/account-confirm-email/{key}/', {'key': key})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event.event for event in write.call_args.args[0]], [AuthEvent.EMAIL_CONFIRM])
+        self.assertTrue(EmailAddress.objects.get(email='neo@example.com').verified)
+        self.assertEqual(self.client.post(f'/account-confirm-email/{key}/', {'key': key}).status_code, 400)
+
+    def test_email_change_replaces_the_old_address(self):
+        user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        EmailAddress.objects.create(user=user, email=user.email, verified=True, primary=True)
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(user))
+        self.assertEqual(self.client.patch('/user/', {'email': 'robert@example.com'}, format='json').status_code, 200)
+        key = self.outbox_context('account/email/email_confirmation')['key']
+
+        self.client.credentials()
+        self.assertEqual(self.client.post(f'/account-confirm-email/{key}/', {'key': key}).status_code, 200)
+        self.assertEqual(User.objects.get(pk=user.pk).email, 'robert@example.com')
+        self.assertEqual(list(EmailAddress.objects.filter(user=user).values_list('email', 'verified', 'primary')),
+                         [('robert@example.com', True, True)])
+
+    def test_password_reset_is_one_update_and_single_use(self):
+        user = User.objects.create_user('bob', 'bob@example.com', 'old-Passw0rd')
+        self.client.post('/password/reset/', {'email': 'bob@example.com'})
+        uid, token = self.outbox_context('account/email/password_reset_key')['password_reset_url'].split('/')[-3:-1]
+        data = {'uid': uid, 'token': token, 'new_password1': 'new-Passw0rd!', 'new_password2': 'new-Passw0rd!'}
+
+        # the user's SELECT for the password validators and the UPDATE
+        with mock.patch.object(audit_log, 'write') as write, self.assertNumQueries(2):
+            response = self.client.post(f'/password/reset/confirm/{uid}/{token}/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event.event for event in write.call_args.args[0]], [AuthEvent.PASSWORD_RESET])
+        self.assertTrue(User.objects.get(pk=user.pk).check_password('new-Passw0rd!'))
+        self.assertEqual(self.client.post(f'/password/reset/confirm/{uid}/{token}/', data).status_code, 400)
+
+    def test_password_reset_rejects_a_password_like_the_username(self):
+        User.objects.create_user('bobsworth', 'bob@example.com', 'old-Passw0rd')
+        self.client.post('/password/reset/', {'email': 'bob@example.com'})
+        uid, token = self.outbox_context('account/email/password_reset_key')['password_reset_url'].split('/')[-3:-1]
+        data = {'uid': uid, 'token': token, 'new_password1': 'bobsworth1', 'new_password2': 'bobsworth1'}
+
+        response = self.client.post(f'/password/reset/confirm/{uid}/{token}/', data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('new_password2', response.data)
+        # the link still works
+        data.update(new_password1='new-Passw0rd!', new_password2='new-Passw0rd!')
+        self.assertEqual(self.client.post(f'/password/reset/confirm/{uid}/{token}/', data).status_code, 200)
+
+
+class UserUpdateTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        self.address = models.Address.objects.create(user=self.user, street='first')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(self.user))
+        self.client.get('/user/')
+
+    def writes(self, queries):
+        return [query['sql'].split()[0] for query in queries
+                if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+
+    def test_unchanged_patch_does_not_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/user/', {'first_name': '', 'is_tasker': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.writes(queries), [])
+
+    def test_patch_writes_changed_columns_and_syncs_addresses(self):
+        data = {
+            'about': 'hello',
+            'address': [{'id': self.address.pk, 'street': 'renamed'}, {'street': 'new'}],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/user/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.writes(queries), ['UPDATE', 'UPDATE', 'INSERT'])
+        self.assertEqual(sorted(a['street'] for a in response.data['address']), ['new', 'renamed'])
+        self.assertEqual(response.data['about'], 'hello')
+
+        response = self.client.patch('/user/', {'address': []}, format='json')
+        self.assertEqual(response.data['address'], [])
+        self.assertFalse(models.Address.objects.exists())
+
+
+class ImagePipelineTest(APITransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_PIPELINE={'ASYNC': False, 'THUMBNAIL_SIZES': (32,), 'MAX_UPLOAD_BYTES': 50 * 1024})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(self.user))
+
+    def upload(self, size=(64, 48)):
+        exif = Image.Exif()
+        exif[0x010f] = 'camera'
+        output = io.BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'JPEG', exif=exif)
+        return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode()
+
+    def test_upload_is_stripped_renamed_and_thumbnailed(self):
+        response = self.client.patch('/user/', {'profile_picture': self.upload()}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        profile = models.Profile.objects.get(user=self.user)
+        self.assertRegex(profile.profile_picture.name, r'[0-9a-f]{20}\.jpg$')
+        with profile.profile_picture.open('rb') as picture:
+            self.assertEqual(dict(Image.open(picture).getexif()), {})
+
+        response = self.client.get('/user/')
+        thumbnail = response.json()['profile_picture_thumbnails']['32']
+        self.assertTrue(thumbnail.startswith('http://testserver/media/'))
+        with open(os.path.join(self.media_root, json.loads(
+                profile.profile_picture_thumbnails)['32']), 'rb') as thumbnail:
+            self.assertEqual(max(Image.open(thumbnail).size), 32)
+
+    def test_oversized_upload_is_refused_before_decoding(self):
+        response = self.client.patch(
+            '/user/', {'profile_picture': self.upload(size=(1, 1)) + 'A' * 80 * 1024}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('profile_picture', response.data)
+
+
+class IDImageUploadTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=os.path.join(directory.name, 'media'),
+            UPLOADS={'LOCATION': os.path.join(directory.name, 'uploads'), 'MAX_SIZE': 100 * 1024})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(self.user))
+        output = io.BytesIO()
+        Image.new('RGB', (40, 30), 'blue').save(output, 'PNG')
+        self.content = output.getvalue()
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+
+    def test_multipart_upload_checks_the_checksum(self):
+        image = io.BytesIO(self.content)
+        image.name = 'front.png'
+        response = self.client.post('/user/id-images/', {
+            'title': 'front', 'image': image, 'sha256': '0' * 64}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sha256', response.data)
+
+        image.seek(0)
+        response = self.client.post('/user/id-images/', {
+            'title': 'front', 'image': image, 'sha256': self.sha256}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.user.profile.id_images.get().title, 'front')
+
+    def test_multipart_upload_past_max_size_is_refused(self):
+        image = io.BytesIO(self.content + b'\0' * 100 * 1024)
+        image.name = 'front.png'
+        with mock.patch('django.core.files.uploadhandler.TemporaryUploadedFile.write') as write:
+            response = self.client.post('/user/id-images/', {'title': 'front', 'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 413)
+        # stopped at the chunk crossing the limit
+        self.assertLessEqual(sum(len(call.args[0]) for call in write.call_args_list), 100 * 1024)
+        self.assertFalse(self.user.profile.id_images.exists())
+
+    def put_chunk(self, url, start, end, **extra):
+        return self.client.generic(
+            'PUT', url, self.content[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}', **extra)
+
+    def test_chunked_upload_resumes_and_completes(self):
+        response = self.client.post('/user/id-images/uploads/', {
+            'filename': 'back.png', 'size': len(self.content), 'sha256': self.sha256}, format='json')
+        self.assertEqual(response.status_code, 201)
+        url = f"/user/id-images/uploads/{response.data['id']}/"
+        middle = len(self.content) // 2
+
+        response = self.put_chunk(url, 0, middle - 1, HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        response = self.put_chunk(url, 0, middle - 1)
+        self.assertEqual(response.data['offset'], middle)
+        # a chunk that does not start at the offset is refused
+        response = self.put_chunk(url, middle + 1, len(self.content) - 1)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(url).data['offset'], middle)
+
+        response = self.client.post(url + 'complete/', {'title': 'back'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.put_chunk(url, middle, len(self.content) - 1)
+        response = self.client.post(url + 'complete/', {'title': 'back'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        with self.user.profile.id_images.get().image.open('rb') as image:
+            self.assertEqual(image.read(), self.content)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        # a repeated call finds the upload gone instead of adding the image twice
+        self.assertEqual(self.client.post(url + 'complete/', {'title': 'back'}, format='json').status_code, 404)
+        self.assertEqual(self.user.profile.id_images.count(), 1)
+
+    def test_upload_not_matching_its_checksum_is_dropped(self):
+        response = self.client.post('/user/id-images/uploads/', {
+            'filename': 'back.png', 'size': len(self.content), 'sha256': '0' * 64}, format='json')
+        url = f"/user/id-images/uploads/{response.data['id']}/"
+        self.put_chunk(url, 0, len(self.content) - 1)
+        response = self.client.post(url + 'complete/', {'title': 'back'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sha256', response.data)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertFalse(self.user.profile.id_images.exists())
+
+    def test_chunk_is_read_before_the_upload_row_is_locked(self):
+        response = self.client.post('/user/id-images/uploads/', {
+            'filename': 'back.png', 'size': len(self.content), 'sha256': self.sha256}, format='json')
+        url = f"/user/id-images/uploads/{response.data['id']}/"
+        seen = []
+
+        def reading(*args):
+            seen.extend(query['sql'] for query in queries.captured_queries)
+            return read_stream(*args)
+
+        with mock.patch('users.views.read_stream', side_effect=reading), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.put_chunk(url, 0, len(self.content) - 1)
+        self.assertEqual(response.data['offset'], len(self.content))
+        self.assertFalse([sql for sql in seen if 'core_chunkedupload' in sql])
+        self.assertTrue([query for query in queries if 'core_chunkedupload' in query['sql']])
+
+    def test_user_update_only_references_uploaded_images(self):
+        response = self.client.patch('/user/', {'id_images': [{'title': 'new'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(LOGIN_THROTTLE={'RATES': {'ip': '10/min', 'username': '3/min', 'email': '3/min'}})
+class LoginThrottleTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('bob', 'bob@example.com', 'pass')
+
+    def test_locked_username_is_rejected_before_hashing(self):
+        for attempt in range(3):
+            response = self.client.post('/login/', {'username': 'bob', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 400)
+
+        with mock.patch.object(AdmittedPBKDF2PasswordHasher, 'verify') as verify, \
+                mock.patch.object(AdmittedPBKDF2PasswordHasher, 'encode') as encode, \
+                self.assertNumQueries(0):
+            response = self.client.post('/login/', {'username': 'BOB', 'password': 'pass'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        verify.assert_not_called()
+        encode.assert_not_called()
+
+    def test_unverified_email_is_not_a_failed_attempt(self):
+        for attempt in range(5):
+            response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['non_field_errors'], ['E-mail is not verified.'])
+
+    @override_settings(LOGIN_THROTTLE={'RATES': {'ip': '2/min', 'username': '5/min', 'email': '5/min', 'phone': '5/min'}})
+    def test_forwarded_for_does_not_change_the_limited_ip(self):
+        for attempt in range(2):
+            response = self.client.post('/login/', {'username': f'user{attempt}', 'password': 'wrong'},
+                                        HTTP_X_FORWARDED_FOR=f'10.0.0.{attempt}')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'},
+                                    HTTP_X_FORWARDED_FOR='10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+
+
+class TokenRotationTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        revocation_store.clear()
+        user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        EmailAddress.objects.create(user=user, email=user.email, verified=True, primary=True)
+        response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+        self.token, self.refresh = response.data['token'], response.data['refresh']
+
+    def test_refresh_rotates_and_replay_revokes_the_family(self):
+        response = self.client.post('/token/refresh/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200)
+        rotated = response.data['refresh']
+        self.assertNotEqual(rotated, self.refresh)
+
+        response = self.client.post('/token/refresh/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 401)
+        # the replay revoked the tokens issued from the same login
+        response = self.client.post('/token/refresh/', {'refresh': rotated})
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.post('/token/refresh/', {'refresh': self.token})
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_change_revokes_every_login(self):
+        other_login = self.client.post('/login/', {'username': 'bob', 'password': 'pass'}).data['refresh']
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.token)
+        data = {'new_password1': 'new-Passw0rd!', 'new_password2': 'new-Passw0rd!'}
+        self.assertEqual(self.client.post('/password/change/', data).status_code, 200)
+        self.client.credentials()
+        for refresh in (self.refresh, other_login):
+            self.assertEqual(self.client.post('/token/refresh/', {'refresh': refresh}).status_code, 401)
+
+        # a login after the change is not affected
+        refresh = self.client.post('/login/', {'username': 'bob', 'password': 'new-Passw0rd!'}).data['refresh']
+        self.assertEqual(self.client.post('/token/refresh/', {'refresh': refresh}).status_code, 200)
+
+    def test_password_reset_revokes_every_login(self):
+        user = User.objects.get(username='bob')
+        uid, token = urlsafe_base64_encode(force_bytes(user.pk)), make_token('password_reset', user.pk)
+        data = {'uid': uid, 'token': token, 'new_password1': 'new-Passw0rd!', 'new_password2': 'new-Passw0rd!'}
+        self.assertEqual(self.client.post(f'/password/reset/confirm/{uid}/{token}/', data).status_code, 200)
+        self.assertEqual(self.client.post('/token/refresh/', {'refresh': self.refresh}).status_code, 401)
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + self.token)
+        self.assertEqual(self.client.get('/user/').status_code, 200)
+        response = self.client.post('/logout/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get('/user/').status_code, 401)
+        self.client.credentials()
+        response = self.client.post('/token/refresh/', {'refresh': self.refresh})
+        self.assertEqual(response.status_code, 401)
+
+
+class LoginHashAdmissionTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('bob', 'bob@example.com', 'pass')
+
+    def test_refused_hash_answers_503(self):
+        with mock.patch('core.hashers.hash_admission.run', side_effect=AdmissionRefused):
+            response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class EmailVerifiedCacheTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        self.email = EmailAddress.objects.create(user=self.user, email=self.user.email, primary=True)
+
+    def emailaddress_queries(self, queries):
+        return [query for query in queries if 'account_emailaddress' in query['sql']]
+
+    def test_verified_flag_is_cached_and_invalidated_on_confirm(self):
+        response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+        self.assertEqual(response.status_code, 400)
+
+        EmailConfirmationHMAC(self.email).confirm(None)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.emailaddress_queries(queries)), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/login/', {'username': 'bob', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.emailaddress_queries(queries), [])
+
+    def test_deleting_the_address_clears_the_cached_flag(self):
+        self.email.verified = True
+        self.email.save()
+        self.assertTrue(is_email_verified(self.user))
+        EmailAddress.objects.filter(pk=self.email.pk).delete()
+        with self.assertNumQueries(1):
+            self.assertFalse(is_email_verified(self.user))
+
+    def test_settings_are_read_per_call(self):
+        self.email.verified = True
+        self.email.save()
+        other = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'email-verified'}
+        with override_settings(CACHES=dict(settings.CACHES, other=other),
+                               EMAIL_VERIFIED={'CACHE_ALIAS': 'other', 'KEY_PREFIX': 'verified'}):
+            self.assertTrue(is_email_verified(self.user))
+            self.assertEqual(caches['other'].get(f'verified:{self.user.pk}')[1], True)
+            invalidate_email_verified(self.user.pk)
+            self.assertIsNone(caches['other'].get(f'verified:{self.user.pk}'))
+        self.assertIsNone(cache.get(f'email_verified:{self.user.pk}'))
+
+
+class BulkUsersCommandTest(TestCase):
+
+    def test_import_reports_bad_rows_and_export_streams_users(self):
+        User.objects.create_user('taken', 'taken@example.com', 'pass')
+        rows = [
+            {'username': 'ali', 'email': 'ali@example.com', 'password': 'pass',
+             'phone_number': '01001234567', 'is_tasker': True, 'street': 'Tahrir', 'city': 'ca'},
+            {'username': 'taken', 'email': 'other@example.com'},
+            {'username': 'mona', 'email': 'Ali@example.com'},
+            {'username': 'nour', 'email': 'not-an-email'},
+            {'username': 'omar', 'email': 'omar@example.com', 'email_verified': True},
+            {'username': 'sara', 'email': 'sara@example.com', 'phone_number': '+20 100 123 4567'},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as source:
+            source.write('\n'.join(json.dumps(row) for row in rows))
+        errors, out = io.StringIO(), io.StringIO()
+        call_command('import_users', source.name, '--workers', '0', stdout=out, stderr=errors)
+        os.unlink(source.name)
+
+        self.assertIn('created 2, rejected 4', out.getvalue())
+        rejected = {json.loads(line)['line']: json.loads(line)['errors']
+                    for line in errors.getvalue().splitlines()}
+        self.assertEqual(rejected, {2: {'username': 'already exists'},
+                                    3: {'email': 'already exists'},
+                                    4: {'email': 'invalid e-mail'},
+                                    6: {'phone_number': 'already exists'}})
+
+        ali = User.objects.get(username='ali')
+        self.assertTrue(ali.check_password('pass'))
+        self.assertTrue(ali.profile.is_tasker)
+        self.assertEqual(ali.address.get().city, 'ca')
+
+        out = io.StringIO()
+        call_command('export_users', '--format', 'ndjson', stdout=out)
+        exported = {row['username']: row for row in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(set(exported), {'taken', 'ali', 'omar'})
+        self.assertEqual(exported['ali']['phone_number'], '+201001234567')
+        self.assertTrue(exported['omar']['email_verified'])
+
+    def test_import_rejects_unreadable_rows_and_isolates_failed_inserts(self):
+        User.objects.create_user('taken', 'taken@example.com', 'pass')
+        lines = [
+            '{"username": "ali", "email": "ali@',
+            '[1, 2]',
+            json.dumps({'username': 7, 'email': 'seven@example.com'}),
+            json.dumps({'username': 'mona', 'email': 'mona@example.com', 'birth_date': 19900101}),
+            json.dumps({'username': 'taken', 'email': 'other@example.com'}),
+            json.dumps({'username': 'omar', 'email': 'omar@example.com'}),
+        ]
+        reported = {}
+        # a username taken after the duplicate check
+        with mock.patch('users.bulk.find_duplicates', return_value={}):
+            created, rejected = import_users(io.StringIO('\n'.join(lines)), 'ndjson', workers=0,
+                                             report=reported.__setitem__)
+
+        self.assertEqual((created, rejected), (1, 5))
+        self.assertEqual(reported[1], {'row': 'not a JSON object'})
+        self.assertEqual(reported[2], {'row': 'not a JSON object'})
+        self.assertEqual(reported[3], {'username': 'not a string'})
+        self.assertEqual(reported[4], {'birth_date': 'invalid date'})
+        self.assertEqual(set(reported[5]), {'row'})
+        self.assertTrue(User.objects.filter(username='omar').exists())
+        self.assertFalse(User.objects.filter(email='other@example.com').exists())
+
+
+class StaffUserListTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        for index in range(5):
+            user = User.objects.create_user(f'user{index}', f'user{index}@example.com', 'pass')
+            user.profile.is_tasker = index % 2 == 0
+            user.profile.save()
+        models.Address.objects.create(user=User.objects.get(username='user1'), street='x', city='ca')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(admin))
+
+    def test_keyset_pages_cover_every_profile_once(self):
+        usernames, url = [], '/staff/users/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            usernames += [row['username'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(usernames, ['admin'] + [f'user{index}' for index in range(5)])
+
+    def test_filters_and_ndjson_stream(self):
+        response = self.client.get('/staff/users/', {'is_tasker': 'true'})
+        self.assertEqual([row['username'] for row in response.data['results']], ['user0', 'user2', 'user4'])
+        response = self.client.get('/staff/users/', {'city': 'ca'})
+        self.assertEqual([row['username'] for row in response.data['results']], ['user1'])
+
+        response = self.client.get('/staff/users/', {'format': 'ndjson', 'is_tasker': 'false'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['admin', 'user1', 'user3'])
+
+    def test_staff_only(self):
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(User.objects.get(username='user0')))
+        self.assertEqual(self.client.get('/staff/users/').status_code, 403)
+
+
+class PhoneNumberTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        EmailAddress.objects.create(user=self.user, email=self.user.email, verified=True, primary=True)
+        self.user.profile.phone_number = '01001234567'
+        self.user.profile.save(update_fields=['phone_number'])
+
+    def test_numbers_are_parsed_once_and_stored_in_e164(self):
+        number = parse_phone('01001234567')
+        self.assertIs(parse_phone('01001234567'), number)
+        with self.assertRaises(AttributeError):
+            number.national_number = 1
+        profile = models.Profile.objects.get(user=self.user)
+        self.assertEqual((profile.phone_e164, str(profile.phone_number)), ('+201001234567', '+201001234567'))
+
+    def test_login_by_phone_number_looks_the_user_up_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/login/', {'phone_number': '+20 100 123 4567', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user']['username'], 'bob')
+        lookups = [query['sql'] for query in queries if '"phone_e164" =' in query['sql']]
+        self.assertEqual(len(lookups), 1)
+
+        for phone_number in ('01001234567', '01007654321', 'junk'):
+            response = self.client.post('/login/', {'phone_number': phone_number, 'password': 'wrong'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_taken_number_is_reported_by_the_unique_index(self):
+        other = User.objects.create_user('alice', 'alice@example.com', 'pass')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(other))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch('/user/', {'phone_number': '+201001234567'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'phone_number': ['phone number already exist.']})
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT (1)')])
+
+
+class AuthEventTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        revocation_store.clear()
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pass')
+        EmailAddress.objects.create(user=self.user, email=self.user.email, verified=True, primary=True)
+
+    def test_logins_and_logout_are_recorded_and_listed(self):
+        self.client.post('/login/', {'username': 'Bob', 'password': 'wrong'}, HTTP_USER_AGENT='curl/7.68')
+        token = self.client.post('/login/', {'username': 'bob', 'password': 'pass'}).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + token)
+        self.assertEqual(self.client.post('/logout/').status_code, 200)
+
+        failed = AuthEvent.objects.get(event=AuthEvent.LOGIN_FAILED)
+        self.assertEqual((failed.user_id, failed.identifier, failed.ip, failed.user_agent),
+                         (None, 'bob', '127.0.0.1', 'curl/7.68'))
+
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(self.user))
+        response = self.client.get('/user/auth-events/')
+        self.assertEqual([(row['event'], row['user']) for row in response.data['results']],
+                         [(AuthEvent.LOGIN, self.user.pk), (AuthEvent.LOGOUT, self.user.pk)])
+        response = self.client.get('/user/auth-events/', {'event': AuthEvent.LOGOUT})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(self.client.get('/staff/auth-events/').status_code, 403)
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + jwt_encode(admin))
+        response = self.client.get('/staff/auth-events/', {'since': failed.created.isoformat()})
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get('/staff/auth-events/', {'user': self.user.pk, 'until': failed.created.isoformat()})
+        self.assertEqual(response.data['results'], [])
@@ -4,24 +4,30 @@ from django.urls import path, include
 from . import views
 from rest_framework import routers
 from rest_auth.registration.views import VerifyEmailView
-from rest_auth.views import LogoutView, UserDetailsView
+from rest_auth.views import UserDetailsView
 
 router = routers.DefaultRouter()
+router.register('staff/users', views.UserAdminViewSet, basename='staff-users')
+router.register('staff/auth-events', views.AuthEventAdminViewSet, basename='staff-auth-events')
+router.register('user/id-images/uploads', views.IDImageChunkedUploadViewSet, basename='id-image-uploads')
 
 
 urlpatterns = [
     path('', include(router.urls)),
     path('user/', views.UserDetailsAPIView.as_view(), name='rest_user_details'),
-    path('login/', views.LoginUserView.as_view(), name='account_login'),
-    path('password/change/', views.PasswordUserChangeView.as_view(), name='rest_password_change'),
+    path('user/id-images/', views.IDImageUploadView.as_view(), name='id_image_upload'),
+    path('user/auth-events/', views.AuthEventListView.as_view(), name='auth_events'),
+    path('login/', views.LoginUserView.as_view(limit_hashing=True), name='account_login'),
+    path('password/change/', views.PasswordUserChangeView.as_view(limit_hashing=True), name='rest_password_change'),
     path('password/reset/', views.PasswordResetUserView.as_view(), name='rest_password_reset'),
+    path('logout/', views.LogoutUserView.as_view(), name='rest_logout'),
+    path('token/refresh/', views.TokenRefreshView.as_view(), name='token_refresh'),
     path('', include('rest_auth.urls')),
-    path('registration/', views.RegisterUserView.as_view(), name='account_signup'),
+    path('registration/', views.RegisterUserView.as_view(limit_hashing=True), name='account_signup'),
     path('rest-auth/registration/', include('rest_auth.registration.urls')),
     path('account-confirm-email/<str:key>/', views.VerifyUserEmailView.as_view(), name='account_confirm_email'),
-    path('password/reset/confirm/<str:uid>/<str:token>/', views.PasswordResetConfirmUserView.as_view(), name='rest_password_reset_confirm'),
-    path('logout/', LogoutView.as_view(), name='rest_logout'),
+    path('password/reset/confirm/<str:uid>/<str:token>/',
+         views.PasswordResetConfirmUserView.as_view(limit_hashing=True), name='rest_password_reset_confirm'),
 
 
 ]
-
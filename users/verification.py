@@ -0,0 +1,50 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from allauth.account.models import EmailAddress
+
+
+EMAIL_VERIFIED_DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'email_verified',
+    # saving, deleting or confirming an address clears the cached answer before that
+    'TIMEOUT': 24 * 3600,
+}
+
+
+def email_verified_settings():
+    options = dict(EMAIL_VERIFIED_DEFAULTS)
+    options.update(getattr(settings, 'EMAIL_VERIFIED', {}))
+    return options
+
+
+def email_verified_key(user_id):
+    return f"{email_verified_settings()['KEY_PREFIX']}:{user_id}"
+
+
+def email_digest(email):
+    return hashlib.md5((email or '').lower().encode()).hexdigest()
+
+
+def is_email_verified(user):
+    """
+    Whether `user.email` is a verified address of `user`, cached per user
+    together with the address it is about, so a login normally needs no
+    query for it.
+    """
+    options = email_verified_settings()
+    cache = caches[options['CACHE_ALIAS']]
+    key = email_verified_key(user.pk)
+    digest = email_digest(user.email)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    verified = EmailAddress.objects.filter(user=user, email=user.email, verified=True).exists()
+    cache.set(key, (digest, verified), options['TIMEOUT'])
+    return verified
+
+
+def invalidate_email_verified(user_id):
+    caches[email_verified_settings()['CACHE_ALIAS']].delete(email_verified_key(user_id))
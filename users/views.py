@@ -1,24 +1,54 @@
+import hashlib
+import tempfile
+
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Subquery, prefetch_related_objects
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.debug import sensitive_post_parameters
 
 from rest_framework.response import Response
-from rest_framework import status, viewsets, permissions, generics, views, exceptions
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status, viewsets, permissions, generics, views, exceptions, mixins
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.settings import api_settings
 
 from rest_auth.registration.views import RegisterView
 from allauth.account import app_settings as allauth_settings
-from rest_auth.app_settings import JWTSerializer, PasswordResetConfirmSerializer, PasswordChangeSerializer
+from rest_auth.app_settings import JWTSerializer, PasswordChangeSerializer
 from rest_auth.utils import jwt_encode
 from allauth.account.utils import complete_signup
-from allauth.account.models import EmailAddress, EmailConfirmationHMAC
+from allauth.account.models import EmailAddress
 from rest_auth.views import LoginView
 from rest_auth.registration.views import VerifyEmailView
 from rest_auth.views import LogoutView, PasswordChangeView, PasswordResetConfirmView
-from . import serializers, models
+from core.audit import audit_log
+from core.images import schedule_image
+from core.jwt_handler import refresh_token_encode, revoke_tokens, revoke_user_refresh_tokens, rotate_refresh_token
+from core.mail import queue_mail
+from core.models import AuthEvent, ChunkedUpload
+from core.pagination import KeysetPagination
+from core.render_cache import user_render_cache
+from core.renderers import NDJSONRenderer
+from core.routers import pin_user
+from core.signals import invalidate_principal, invalidate_user_render
+from core.signed_tokens import check_token, consume, make_token, revoke_before
+from core.views import HashAdmissionMixin
+from core.throttling import LoginRateThrottle, login_idents, login_limiter
+from core.uploads import (ChecksumUploadHandler, UploadTooLarge, file_sha256, get_chunk_storage,
+                          parse_content_range, read_stream, uploads_settings)
+from . import serializers, models, filters
+from .verification import invalidate_email_verified
 
 
 sensitive_post_parameters_m = method_decorator(
@@ -26,7 +56,7 @@ sensitive_post_parameters_m = method_decorator(
 )
 
 
-class RegisterUserView(RegisterView):
+class RegisterUserView(HashAdmissionMixin, RegisterView):
 
     @sensitive_post_parameters_m
     def dispatch(self, *args, **kwargs):
@@ -38,20 +68,21 @@ class RegisterUserView(RegisterView):
                 'user': user,
                 'token': self.token
             }
-            return JWTSerializer(data).data
+            return dict(JWTSerializer(data).data, refresh=self.refresh_token)
 
     def perform_create(self, serializer):
+        # the serializer saves and queues the confirmation in one transaction
         user = serializer.save(self.request)
+        # the requests made with its tokens read the account from the primary
+        pin_user(user.pk)
         if getattr(settings, 'REST_USE_JWT', False):
             self.token = jwt_encode(user)
-        email = EmailAddress.objects.get(user=user, email=user.email)
-        confirmation = EmailConfirmationHMAC(email)
-        print("key ->>>", confirmation.key)
-        # TODO send email confirmation here
+            self.refresh_token = refresh_token_encode(user)
         return user
 
-class LoginUserView(LoginView):
+class LoginUserView(HashAdmissionMixin, LoginView):
     queryset = ''
+    throttle_classes = (LoginRateThrottle,)
 
     @sensitive_post_parameters_m
     def dispatch(self, *args, **kwargs):
@@ -67,6 +98,8 @@ class LoginUserView(LoginView):
             }
             serializer = serializer_class(instance=data,
                                           context={'request': self.request})
+            return Response(dict(serializer.data, refresh=refresh_token_encode(self.user)),
+                            status=status.HTTP_200_OK)
         else:
             serializer = serializer_class(instance=self.token,
                                           context={'request': self.request})
@@ -78,30 +111,92 @@ class LoginUserView(LoginView):
         self.request = request
         self.serializer = self.get_serializer(data=self.request.data,
                                               context={'request': request})
-        self.serializer.is_valid(raise_exception=True)
-
+        idents = login_idents(request)
+        try:
+            self.serializer.is_valid(raise_exception=True)
+        except exceptions.ValidationError as error:
+            # an unverified e-mail or a banned account is not a guessed password
+            if serializers.INVALID_CREDENTIALS in error.get_codes().get('non_field_errors', ()):
+                login_limiter.hit(idents)
+            audit_log.record(AuthEvent.LOGIN_FAILED, request=request,
+                             identifier=next((value for scope, value in idents[1:] if value), None))
+            raise
+        # a good password clears the account keys, the IP keeps its history
+        login_limiter.reset([ident for ident in idents if ident[0] != 'ip'])
+
+        pin_user(self.serializer.validated_data['user'].pk)
         self.login()
+        audit_log.record(AuthEvent.LOGIN, self.user.pk, request)
         return self.get_response()
 
 
+class TokenRefreshView(generics.GenericAPIView):
+    """
+    Exchange a refresh token for a new access token and refresh token.
+    """
+    serializer_class = serializers.TokenRefreshSerializer
+    permission_classes = (permissions.AllowAny,)
+
+    def perform_authentication(self, request):
+        # an expired access token in the header must not fail the request
+        pass
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user, tokens = rotate_refresh_token(serializer.validated_data['refresh'])
+        pin_user(user.pk)
+        return Response(tokens)
+
+
+class LogoutUserView(LogoutView):
+    """
+    Logout that also revokes the access token of the request and, when
+    `refresh` is sent, every refresh token of that login.
+    """
+
+    def logout(self, request):
+        revoke_tokens(request.auth, request.data.get('refresh'))
+        if request.user.is_authenticated:
+            audit_log.record(AuthEvent.LOGOUT, request.user.pk, request)
+        return super().logout(request)
+
+
 class VerifyUserEmailView(VerifyEmailView):
+    """
+    Confirms the address of a signup (`email_confirm` key) or the new address
+    of a user (`email_change` key). The key is checked without reading the
+    database and the confirmation is a conditional UPDATE of the address.
+    """
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.kwargs['key'] = serializer.validated_data['key']
-        confirmation = self.get_object()
-        confirmation.confirm(self.request)
-
-        # for updating email address
-        email_confirm = confirmation.email_address
-        user = email_confirm.user
-        user_email = EmailAddress.objects.filter(user=user)
-        
-        if email_confirm.verified and user_email.count() > 1:
-            EmailAddress.objects.filter(email=user.email).delete()
-            user_email.update(primary=True)
-            User.objects.filter(pk=user.pk).update(email=email_confirm.email)
+        token = check_token(serializer.validated_data['key'], 'email_confirm', 'email_change')
+
+        # the key is burnt once the conditional UPDATE confirmed the address,
+        # a key refused by it stays usable
+        address = EmailAddress.objects.filter(pk=token.object_id, user_id=token.subject, verified=False)
+        if token.purpose == 'email_confirm':
+            confirmed = address.update(verified=True)
+            if confirmed:
+                consume(token)
+        else:
+            # the new address replaces the old one, a used key rolls it back
+            with transaction.atomic():
+                confirmed = address.update(verified=True, primary=True)
+                if confirmed:
+                    new_email = EmailAddress.objects.filter(pk=token.object_id).values('email')
+                    User.objects.filter(pk=token.subject).update(email=Subquery(new_email[:1]))
+                    EmailAddress.objects.filter(user_id=token.subject).exclude(pk=token.object_id).delete()
+                    consume(token)
+            invalidate_principal(token.subject)
+            invalidate_user_render(token.subject)
+        if not confirmed:
+            raise exceptions.ValidationError(_('Invalid or expired token.'))
+        invalidate_email_verified(token.subject)
+        audit_log.record(AuthEvent.EMAIL_CONFIRM if token.purpose == 'email_confirm' else AuthEvent.EMAIL_CHANGE,
+                         token.subject, request)
         return Response({'detail': _('ok')}, status=status.HTTP_200_OK)
 
 
@@ -115,20 +210,22 @@ class PasswordResetUserView(views.APIView):
             user = User.objects.get(email=email)
         except User.DoesNotExist:
             raise exceptions.NotAcceptable(_("please enter correct email."))
-        # TODO send email
-        from django.contrib.auth.tokens import default_token_generator
         from django.utils.encoding import force_bytes
         from django.utils.http import urlsafe_base64_encode
 
         uid = urlsafe_base64_encode(force_bytes(user.pk))#.decode('utf-8')
-        token = default_token_generator.make_token(user)
-        print("password/reset/confirm/" + uid + "/" + token)
+        token = make_token('password_reset', user.pk)
+        url = request.build_absolute_uri(
+            reverse('rest_password_reset_confirm', kwargs={'uid': uid, 'token': token}))
+        queue_mail('account/email/password_reset_key', user.email,
+                   {'user_id': user.pk, 'password_reset_url': url, 'username': user.get_username()})
+        audit_log.record(AuthEvent.PASSWORD_RESET_REQUEST, user.pk, request)
         return Response({"detail": _("Password reset has been sent.")}, 
                         status=status.HTTP_200_OK)
 
 
-class PasswordResetConfirmUserView(generics.GenericAPIView):
-    serializer_class = PasswordResetConfirmSerializer
+class PasswordResetConfirmUserView(HashAdmissionMixin, generics.GenericAPIView):
+    serializer_class = serializers.PasswordResetConfirmSerializer
     permission_classes = (permissions.AllowAny,)
 
     @sensitive_post_parameters_m
@@ -139,24 +236,241 @@ class PasswordResetConfirmUserView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        audit_log.record(AuthEvent.PASSWORD_RESET, serializer.validated_data['signed_token'].subject, request)
         return Response({"detail": _("Password has been reset with the new password.")})
 
 
-class PasswordUserChangeView(PasswordChangeView):
+class PasswordUserChangeView(HashAdmissionMixin, PasswordChangeView):
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        revoke_before('password_reset', request.user.pk)
+        revoke_user_refresh_tokens(request.user.pk)
+        audit_log.record(AuthEvent.PASSWORD_CHANGE, request.user.pk, request)
         return Response({"detail": _("New password has been Changed.")})
 
 
 class UserDetailsAPIView(generics.RetrieveUpdateAPIView):
     serializer_class = serializers.UserSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    prefetch_fields = ('address', 'profile__id_images')
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        # the JWT authentication already loads the profile with the user,
+        # so only the nested lists are left to fetch
+        if get_user_model().profile.is_cached(user):
+            prefetch_related_objects([user], *self.prefetch_fields)
+            return user
+        return self.get_queryset().get(pk=user.pk)
+
+    def get_queryset(self):
+        return get_user_model().objects.select_related('profile').prefetch_related(*self.prefetch_fields)
+
+    def before_principal(self, user_id):
+        # read before the authentication loads the user from the principal
+        # cache: a write in between leaves the body under this older version
+        if self.request.method == 'GET':
+            self.render_version = user_render_cache.version(user_id)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        JSON of the user cached per version in `user_render_cache`, with the
+        version as ETag so polling clients get a 304 without a query. Bodies
+        hold absolute URLs, so they are kept per origin and media type.
+        """
+        renderer = request.accepted_renderer
+        version = getattr(self, 'render_version', None) if renderer.format == 'json' else None
+        if version is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        variant = hashlib.md5(f'{request.scheme}://{request.get_host()} {request.accepted_media_type}'
+                              .encode()).hexdigest()[:12]
+        etag = quote_etag(f'{version}-{variant}')
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or etags == ['*']:
+            response = HttpResponseNotModified()
+        else:
+            body = user_render_cache.get(request.user.pk, version, variant)
+            if body is None:
+                data = self.get_serializer(self.get_object()).data
+                body = renderer.render(data, request.accepted_media_type, self.get_renderer_context())
+                user_render_cache.set(request.user.pk, version, body, variant)
+            response = HttpResponse(body, content_type=renderer.media_type)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class IDImageUploadView(generics.CreateAPIView):
+    """
+    Multipart upload of one ID image (`title`, `image`, optional `sha256`).
+    The file is streamed to a temporary file, never held in memory, and
+    refused with 413 past UPLOADS['MAX_SIZE'].
+    """
+    serializer_class = serializers.IDImageUploadSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    parser_classes = (MultiPartParser,)
+
+    def initialize_request(self, request, *args, **kwargs):
+        self.upload_handler = ChecksumUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def create(self, request, *args, **kwargs):
+        # parses the body; a stopped upload leaves the file out of it
+        request.data
+        if self.upload_handler.too_large:
+            raise UploadTooLarge()
+        return super().create(request, *args, **kwargs)
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        id_image = serializer.save(profile=self.request.user.profile)
+        schedule_image(id_image, 'image', 'thumbnails')
+
+
+class IDImageChunkedUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                                  viewsets.GenericViewSet):
+    """
+    Resumable ID image upload:
+    `POST` announces `filename`, `size` and `sha256`, each `PUT` sends the
+    raw bytes of `Content-Range: bytes start-end/size` starting at the
+    current `offset` (`GET` it to resume), with an optional
+    `X-Chunk-SHA256`, and `POST .../complete/` with a `title` turns the
+    upload into an ID image.
+    """
+    serializer_class = serializers.ChunkedUploadSerializer
+    permission_classes = (permissions.IsAuthenticated,)
 
     def get_queryset(self):
-        return get_user_model().objects.none()
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        options = uploads_settings()
+        storage = get_chunk_storage()
+        content_range = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), options['MAX_SIZE'])
+        if content_range is None:
+            raise exceptions.ParseError(_("Invalid Content-Range header."))
+        start, end, total = content_range
+        length = end - start + 1
+        if request.META.get('CONTENT_LENGTH') != str(length):
+            raise exceptions.ParseError(_("Content-Length does not match Content-Range."))
+
+        # the body is read before the upload row is locked, so a slow client
+        # holds no transaction, row lock or pooled connection while sending
+        with tempfile.TemporaryFile() as chunk:
+            digest = hashlib.sha256()
+            try:
+                for data in read_stream(request.stream, length, options['READ_SIZE']):
+                    digest.update(data)
+                    chunk.write(data)
+            except EOFError:
+                raise exceptions.ParseError(_("Incomplete chunk."))
+            expected = request.META.get('HTTP_X_CHUNK_SHA256')
+            if expected and expected != digest.hexdigest():
+                raise exceptions.ValidationError({'detail': _("Chunk checksum does not match.")})
+
+            with transaction.atomic():
+                # one chunk at a time per upload
+                upload = get_object_or_404(self.get_queryset().select_for_update(), pk=kwargs['pk'])
+                if total != upload.size:
+                    raise exceptions.ParseError(_("Invalid Content-Range header."))
+                if start != upload.offset:
+                    return Response({'offset': upload.offset}, status=status.HTTP_409_CONFLICT)
+                chunk.seek(0)
+                storage.append(upload.pk, start, iter(lambda: chunk.read(options['READ_SIZE']), b''))
+                upload.offset = end + 1
+                upload.save(update_fields=['offset', 'modified'])
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, *args, **kwargs):
+        storage = get_chunk_storage()
+        # concurrent calls for one upload wait for the row lock, the later
+        # ones find the upload gone and get a 404 instead of a second image
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=kwargs['pk'])
+            if upload.offset != upload.size:
+                raise exceptions.ValidationError({'offset': _("Upload is not complete.")})
+            # delete() clears the primary key
+            key = upload.pk
+            with storage.open(key) as file:
+                matches = file_sha256(file) == upload.sha256
+                if matches:
+                    file.seek(0)
+                    serializer = serializers.IDImageUploadSerializer(
+                        data={'title': request.data.get('title'), 'image': File(file, name=upload.filename)},
+                        context=self.get_serializer_context())
+                    serializer.is_valid(raise_exception=True)
+                    id_image = serializer.save(profile=request.user.profile)
+                    schedule_image(id_image, 'image', 'thumbnails')
+            upload.delete()
+        storage.delete(key)
+        if not matches:
+            raise exceptions.ValidationError({'sha256': _("Checksum does not match the uploaded file.")})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AuthEventListView(generics.ListAPIView):
+    """
+    The auth events of the user, oldest first and keyset paginated, filtered
+    by `event`, `since` and `until` (ISO 8601).
+    """
+    serializer_class = serializers.AuthEventSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = filters.AuthEventFilter
+
+    def get_queryset(self):
+        return AuthEvent.objects.for_user(self.request.user.pk)
+
+
+class AuthEventAdminViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Staff listing of every auth event, filtered like `/user/auth-events/`
+    and by `user`.
+    """
+    serializer_class = serializers.AuthEventSerializer
+    permission_classes = (permissions.IsAdminUser,)
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = filters.AuthEventFilter
+    queryset = AuthEvent.objects.all()
+
+
+class UserAdminViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Staff listing of users and their profile, keyset paginated on
+    (created, id). `?format=ndjson` streams every matching row instead.
+    """
+    serializer_class = serializers.UserListSerializer
+    permission_classes = (permissions.IsAdminUser,)
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = filters.ProfileFilter
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (NDJSONRenderer,)
+
+    def get_queryset(self):
+        return models.Profile.objects.select_related('user').order_by('created', 'pk')
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != NDJSONRenderer.format:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(self.stream(queryset), content_type=NDJSONRenderer.media_type)
+        response['Content-Disposition'] = 'attachment; filename="users.ndjson"'
+        return response
+
+    def stream(self, queryset):
+        renderer = NDJSONRenderer()
+        serializer = self.get_serializer()
+        for profile in queryset.iterator(chunk_size=2000):
+            yield renderer.render_row(serializer.to_representation(profile))